@@ -13,30 +13,39 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import itertools
 import json
+import multiprocessing
 import os
 import shutil
+import sqlite3
 import tempfile
 
 from reviewtools.common import (
     debug,
     warn,
     open_file_write,
+    read_file_as_json_array_items,
     read_file_as_json_dict,
     MKDTEMP_PREFIX,
     _add_error,  # make a class
     get_rock_manifest,
     get_snap_manifest,
 )
+import reviewtools.debversion as debversion
 import reviewtools.email as email
+import reviewtools.overrides as overrides
 
 from reviewtools.store import (
+    get_pkg_binaries,
     get_pkg_revisions,
     get_secnots_for_manifest,
     get_shared_snap_without_override,
     get_faked_build_and_stage_packages,
+    SecnotReportMemo,
 )
-from reviewtools.usn import read_usn_db
+from reviewtools.usn import read_usn_db, tracked_releases
 
 email_update_required_text = """A scan of this %s shows that it was built with packages from the Ubuntu
 archive that have since received security updates. """
@@ -359,21 +368,123 @@ def _email_report_for_pkg(pkg_db, seen_db):
     return (email_to_addr, subj, body)
 
 
+# The seen db may either be a json file (the default) or, for large stores, an
+# sqlite database with a row for each reported (pkgname, revision, usn).
+# Either way, callers use the same seen_db[pkgname][revision] = [usn, ...]
+# dict and the format is detected from the file itself.
+SEEN_DB_SQLITE_HEADER = b"SQLite format 3\x00"
+SEEN_DB_SQLITE_SUFFIX = ".sqlite"
+SEEN_DB_SQLITE_SCHEMA = """CREATE TABLE IF NOT EXISTS seen (
+    pkgname TEXT NOT NULL,
+    revision TEXT NOT NULL,
+    usn TEXT NOT NULL,
+    PRIMARY KEY (pkgname, revision, usn)
+) WITHOUT ROWID"""
+
+
+def _is_sqlite_seen_db(fn):
+    """Return True if fn is an sqlite seen db"""
+    with open(fn, "rb") as fd:
+        header = fd.read(len(SEEN_DB_SQLITE_HEADER))
+    return header == SEEN_DB_SQLITE_HEADER
+
+
+def _open_sqlite_seen_db(fn):
+    """Open (creating if needed) the sqlite seen db"""
+    conn = sqlite3.connect(fn)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with conn:
+        conn.execute(SEEN_DB_SQLITE_SCHEMA)
+    return conn
+
+
+def _read_sqlite_seen_db(fn):
+    """Read the sqlite seen db into a seen_db dict"""
+    debug("Loading: %s" % fn)
+    seen_db = {}
+    conn = _open_sqlite_seen_db(fn)
+    try:
+        for (pkgname, r, secnot) in conn.execute(
+            "SELECT pkgname, revision, usn FROM seen ORDER BY pkgname, revision, usn"
+        ):
+            if pkgname not in seen_db:
+                seen_db[pkgname] = {}
+            if r not in seen_db[pkgname]:
+                seen_db[pkgname][r] = []
+            seen_db[pkgname][r].append(secnot)
+    finally:
+        conn.close()
+
+    return seen_db
+
+
+def _update_sqlite_seen_db(conn, pkgname, added, removed):
+    """Add the (revision, usn) pairs in added and delete the revisions in
+    removed for pkgname in a single transaction on the open seen db conn"""
+    with conn:
+        conn.executemany(
+            "DELETE FROM seen WHERE pkgname = ? AND revision = ?",
+            [(pkgname, r) for r in removed],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO seen (pkgname, revision, usn) VALUES (?, ?, ?)",
+            [(pkgname, r, secnot) for (r, secnot) in added],
+        )
+
+
+def import_seen_db(json_fn, sqlite_fn):
+    """Import the json seen db into the (possibly new) sqlite seen db"""
+    seen_db = read_file_as_json_dict(json_fn)
+    if os.path.exists(sqlite_fn) and not _is_sqlite_seen_db(sqlite_fn):
+        raise ValueError("'%s' is not an sqlite seen db" % sqlite_fn)
+
+    conn = _open_sqlite_seen_db(sqlite_fn)
+    try:
+        with conn:
+            for pkgname in seen_db:
+                conn.execute("DELETE FROM seen WHERE pkgname = ?", (pkgname,))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO seen (pkgname, revision, usn) "
+                    "VALUES (?, ?, ?)",
+                    [
+                        (pkgname, r, secnot)
+                        for r in seen_db[pkgname]
+                        for secnot in seen_db[pkgname][r]
+                    ],
+                )
+    finally:
+        conn.close()
+
+
 def read_seen_db(fn):
     if not os.path.exists(fn):
-        # write out an empty seen_db
-        with open_file_write(fn) as fd:
-            fd.write("{}\n")
-            fd.close()
+        if fn.endswith(SEEN_DB_SQLITE_SUFFIX):
+            # create an empty sqlite seen_db
+            _open_sqlite_seen_db(fn).close()
+        else:
+            # write out an empty seen_db
+            with open_file_write(fn) as fd:
+                fd.write("{}\n")
+                fd.close()
+
+    if _is_sqlite_seen_db(fn):
+        return _read_sqlite_seen_db(fn)
 
     return read_file_as_json_dict(fn)
 
 
-def _update_seen(seen_fn, seen_db, pkg_db):
+def _update_seen(seen_fn, seen_db, pkg_db, seen_conn=None):
+    """Update seen_db and seen_fn for pkg_db. seen_conn is an already open
+    connection to the sqlite seen_fn (see scan_store()), otherwise one is
+    opened if needed"""
     pkgname = pkg_db["name"]
     if pkgname not in seen_db:
         seen_db[pkgname] = {}
 
+    # track changes for the sqlite seen db
+    added = []
+
     # update to add new revisions
     for r in pkg_db["revisions"]:
         if len(pkg_db["revisions"][r]["secnot-report"]) == 0:
@@ -391,6 +502,7 @@ def _update_seen(seen_fn, seen_db, pkg_db):
                 ][p]:
                     if secnot not in seen_db[pkgname][r]:
                         seen_db[pkgname][r].append(secnot)
+                        added.append((r, secnot))
         seen_db[pkgname][r].sort()
 
     # remove old revisions
@@ -402,8 +514,21 @@ def _update_seen(seen_fn, seen_db, pkg_db):
         for r in remove:
             del seen_db[pkgname][r]
 
-    # TODO: update seen more efficiently (right now it is only 70k so not a
-    # huge deal, but should probably move to sqlite)
+    if seen_conn is not None:
+        if len(added) > 0 or len(remove) > 0:
+            _update_sqlite_seen_db(seen_conn, pkgname, added, remove)
+        return
+    elif _is_sqlite_seen_db(seen_fn):
+        if len(added) > 0 or len(remove) > 0:
+            conn = _open_sqlite_seen_db(seen_fn)
+            try:
+                _update_sqlite_seen_db(conn, pkgname, added, remove)
+            finally:
+                conn.close()
+        return
+
+    # The json seen db must be rewritten in full. Use an sqlite seen db (see
+    # import_seen_db()) for large stores
     (fd, fn) = tempfile.mkstemp(prefix=MKDTEMP_PREFIX)
     os.write(fd, bytes(json.dumps(seen_db, sort_keys=True, indent=2), "UTF-8"))
     os.close(fd)
@@ -411,58 +536,242 @@ def _update_seen(seen_fn, seen_db, pkg_db):
     shutil.move(fn, seen_fn)
 
 
+# Set in the parent before forking the scan_store() worker pool so the
+# (large) secnot_db is shared copy-on-write with the workers instead of being
+# pickled for each item. Each worker then memoizes secnot reports in its own
+# copy of the memo.
+_scan_store_secnot_db = None
+_scan_store_memo = None
+
+
+def _get_pkg_revisions_for_item(item, secnot_db, store_db_type, memo):
+    """Get the pkg_db for the store db item. Returns (pkg_db, errors, hits,
+    lookups) where pkg_db is None if the item could not be processed and hits
+    and lookups are the memo hits and lookups for the item."""
+    errors = {}
+    (hits, lookups) = (memo.hits, memo.lookups)
+    try:
+        pkg_db = get_pkg_revisions(item, secnot_db, errors, store_db_type, memo)
+    except ValueError as e:
+        if "name" in item:
+            _add_error(item["name"], errors, "%s" % e)
+        pkg_db = None
+
+    return (pkg_db, errors, memo.hits - hits, memo.lookups - lookups)
+
+
+def _get_pkg_revisions_for_item_worker(args):
+    """scan_store() worker pool entry point"""
+    (item, store_db_type) = args
+    return _get_pkg_revisions_for_item(
+        item, _scan_store_secnot_db, store_db_type, _scan_store_memo
+    )
+
+
 # To support ROCKs USN notifications, scan_store is extended to be able to not
 # only scan a store-db of published snaps but also a store-db of published
 # rocks
-def scan_store(secnot_db_fn, store_db_fn, seen_db_fn, pkgname, store_db_type="snap"):
+def scan_store(
+    secnot_db_fn,
+    store_db_fn,
+    seen_db_fn,
+    pkgname,
+    store_db_type="snap",
+    usn_db_cache_dir=None,
+    jobs=1,
+    delta_index_fn=None,
+):
     """For each entry in store db (either snap or rock), see if there are any
     binary packages with security notices, if see report them if not in the
     seen db. We perform these actions on each snap and rock and do not form
     a queue to keep the implementation simple.
+
+    With jobs > 1, the security notices for each entry are calculated in a
+    pool of worker processes while the reporting (and seen db updates) are
+    performed in store db order by the caller.
+
+    With delta_index_fn (an affected index, see update_affected_index()),
+    only the entries that are new or changed since the last delta scan or
+    that have binaries with new or changed security notices since then are
+    scanned. The others have nothing new to report. The index is updated
+    once the scan completes.
     """
+    if delta_index_fn is not None and pkgname:
+        raise ValueError("a delta scan can't be limited to a package name")
+
     if store_db_type == "rock":
         # Since ROCKs can be based on non LTS Ubuntu releases, secnot_db should
         # include them (otherwise the USN db is filtered by tracked LTS releases only
         # since that is the requirement for snaps)
-        secnot_db = read_usn_db(secnot_db_fn, support_non_lts=True)
+        secnot_db = read_usn_db(
+            secnot_db_fn, support_non_lts=True, cache_dir=usn_db_cache_dir
+        )
     else:
-        secnot_db = read_usn_db(secnot_db_fn)
-    store_db = read_file_as_json_dict(store_db_fn)
+        secnot_db = read_usn_db(secnot_db_fn, cache_dir=usn_db_cache_dir)
     if seen_db_fn:
         seen_db = read_seen_db(seen_db_fn)
     else:
         seen_db = {}
 
+    # The store db is streamed so only the entries currently being processed
+    # need to be in memory
+    def _get_items():
+        for item in read_file_as_json_array_items(store_db_fn):
+            if pkgname and "name" in item and pkgname != item["name"]:
+                continue
+            if delta is not None and "name" in item:
+                name = item["name"]
+                delta_seen.add(name)
+                digest = _affected_index_digest(item, salt)
+                if indexed.get(name) != digest:
+                    _index_affected_item(delta, item, store_db_type, digest)
+                if scanned.get(name) != digest:
+                    delta_scanned.append((store_db_type, name, digest))
+                    delta_counts["changed"] += 1
+                elif name in affected_names:
+                    delta_counts["affected"] += 1
+                else:
+                    delta_counts["skipped"] += 1
+                    continue
+            yield item
+
+    # Revisions with identical manifests share their secnot report
+    memo = SecnotReportMemo()
+
+    global _scan_store_secnot_db
+    global _scan_store_memo
+    pool = None
+    if jobs > 1:
+        _scan_store_secnot_db = secnot_db
+        _scan_store_memo = memo
+        pool = multiprocessing.get_context("fork").Pool(processes=jobs)
+
+        # Pool.imap() reads in all of its input up front, so instead hand out
+        # the items in batches to keep memory bounded
+        def _get_results(batch_size=jobs * 16):
+            items = _get_items()
+            while True:
+                batch = [
+                    (item, store_db_type)
+                    for item in itertools.islice(items, batch_size)
+                ]
+                if len(batch) == 0:
+                    return
+                for res in pool.imap(_get_pkg_revisions_for_item_worker, batch):
+                    yield res
+
+        results = _get_results()
+    else:
+        results = (
+            _get_pkg_revisions_for_item(item, secnot_db, store_db_type, memo)
+            for item in _get_items()
+        )
+
+    delta = None
+    seen_conn = None
     errors = {}
     sent = []
-    for item in store_db:
-        if pkgname and "name" in item and pkgname != item["name"]:
-            continue
+    (hits, lookups) = (0, 0)
+    try:
+        # The delta index and the sqlite seen db (whose updates share one
+        # connection for the whole scan) are opened after forking the pool so
+        # the workers don't inherit them. _get_items() only uses the delta
+        # state once the results are iterated below
+        if delta_index_fn is not None:
+            delta = _open_affected_index(delta_index_fn)
+            salt = _affected_index_salt()
+            indexed = _get_affected_index_digests(delta, store_db_type)
+            scanned = _get_affected_index_digests(delta, store_db_type, "scanned")
+            changed_secnots = _get_changed_secnots(delta, secnot_db, store_db_type)
+            affected_names = _get_affected_index_names(
+                delta, store_db_type, changed_secnots
+            )
+            delta_counts = {"changed": 0, "affected": 0, "skipped": 0}
+            delta_seen = set()
+            delta_scanned = []
 
-        try:
-            pkg_db = get_pkg_revisions(item, secnot_db, errors, store_db_type)
-        except ValueError as e:
-            if "name" in item:
-                _add_error(item["name"], errors, "%s" % e)
-            continue
+        if seen_db_fn and _is_sqlite_seen_db(seen_db_fn):
+            seen_conn = _open_sqlite_seen_db(seen_db_fn)
 
-        # (At least) the 'bare' snap is in the db but doesn't have a manifest
-        # so there are no revisions to report on
-        if "revisions" in pkg_db and len(pkg_db["revisions"]) == 0:
-            continue
+        for (pkg_db, item_errors, item_hits, item_lookups) in results:
+            hits += item_hits
+            lookups += item_lookups
+            for p in item_errors:
+                for e in item_errors[p]:
+                    _add_error(p, errors, e)
 
-        try:
-            (to_addr, subj, body) = _email_report_for_pkg(pkg_db, seen_db)
-            sent.append((to_addr, subj, body))
-        except Exception as e:  # pragma: nocover
-            _add_error(pkg_db["name"], errors, "%s" % e)
-            continue
+            if pkg_db is None:
+                continue
+
+            # (At least) the 'bare' snap is in the db but doesn't have a
+            # manifest so there are no revisions to report on
+            if "revisions" in pkg_db and len(pkg_db["revisions"]) == 0:
+                continue
+
+            try:
+                (to_addr, subj, body) = _email_report_for_pkg(pkg_db, seen_db)
+                sent.append((to_addr, subj, body))
+            except Exception as e:  # pragma: nocover
+                _add_error(pkg_db["name"], errors, "%s" % e)
+                continue
 
-        if body is None:  # pragma: nocover
-            debug("Skipped email for '%s': up to date" % pkg_db["name"])
+            if body is None:  # pragma: nocover
+                debug("Skipped email for '%s': up to date" % pkg_db["name"])
+
+            if seen_db_fn:
+                _update_seen(seen_db_fn, seen_db, pkg_db, seen_conn)
+
+        if delta is not None:
+            _remove_affected_index_items(
+                delta,
+                store_db_type,
+                [name for name in indexed if name not in delta_seen],
+            )
+            delta.executemany(
+                "INSERT OR REPLACE INTO scanned (pkg_type, name, digest) "
+                "VALUES (?, ?, ?)",
+                delta_scanned,
+            )
+            # Items with errors (changed or only affected by new secnots, eg
+            # when their email failed) are scanned again next time
+            delta.executemany(
+                "DELETE FROM scanned WHERE pkg_type = ? AND name = ?",
+                [(store_db_type, name) for name in errors],
+            )
+            delta.executemany(
+                "INSERT OR REPLACE INTO secnots (pkg_type, release, binary, digest) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (store_db_type, rel, pkg, digest)
+                    for ((rel, pkg), digest) in changed_secnots.items()
+                ],
+            )
+            delta.commit()
+            debug(
+                "delta scan: %d changed and %d affected items scanned, %d skipped"
+                % (
+                    delta_counts["changed"],
+                    delta_counts["affected"],
+                    delta_counts["skipped"],
+                )
+            )
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+            _scan_store_secnot_db = None
+            _scan_store_memo = None
+        if delta is not None:
+            # without the commit above, the index is left as it was
+            delta.close()
+        if seen_conn is not None:
+            seen_conn.close()
 
-        if seen_db_fn:
-            _update_seen(seen_db_fn, seen_db, pkg_db)
+    if lookups > 0:
+        debug(
+            "secnot report memo: %d hits in %d lookups (%.1f%%)"
+            % (hits, lookups, 100.0 * hits / lookups)
+        )
 
     if len(errors) > 0:
         for p in errors:
@@ -472,7 +781,7 @@ def scan_store(secnot_db_fn, store_db_fn, seen_db_fn, pkgname, store_db_type="sn
     return sent, errors
 
 
-def scan_snap(secnot_db_fn, snap_fn, with_cves=False):
+def scan_snap(secnot_db_fn, snap_fn, with_cves=False, usn_db_cache_dir=None):
     """Scan snap for packages with security notices"""
     out = ""
     (man, dpkg) = get_snap_manifest(snap_fn)
@@ -501,7 +810,7 @@ def scan_snap(secnot_db_fn, snap_fn, with_cves=False):
                     "%s=%s" % (pkg_name, tmp[2])
                 )
 
-    secnot_db = read_usn_db(secnot_db_fn)
+    secnot_db = read_usn_db(secnot_db_fn, cache_dir=usn_db_cache_dir)
     original_report = get_secnots_for_manifest(
         manifest=man, secnot_db=secnot_db, with_cves=with_cves
     )
@@ -518,14 +827,16 @@ def scan_snap(secnot_db_fn, snap_fn, with_cves=False):
     return out
 
 
-def scan_rock(secnot_db_fn, rock_fn, with_cves=False):
+def scan_rock(secnot_db_fn, rock_fn, with_cves=False, usn_db_cache_dir=None):
     """Scan rock for packages with security notices"""
     out = ""
     man = get_rock_manifest(rock_fn)
     # Since ROCKs can be based on non LTS Ubuntu releases, secnot_db should
     # include them (otherwise the USN db is filtered by tracked LTS releases only
     # since that is the requirement for snaps)
-    secnot_db = read_usn_db(secnot_db_fn, support_non_lts=True)
+    secnot_db = read_usn_db(
+        secnot_db_fn, support_non_lts=True, cache_dir=usn_db_cache_dir
+    )
     original_report = get_secnots_for_manifest(
         manifest=man, secnot_db=secnot_db, with_cves=with_cves, manifest_type="rock"
     )
@@ -545,7 +856,7 @@ def scan_shared_publishers(store_fn):
     """Check store db for any snaps with a shared email that don't also have a
     mapping.
     """
-    store_db = read_file_as_json_dict(store_fn)
+    store_db = read_file_as_json_array_items(store_fn)
     report = get_shared_snap_without_override(store_db)
 
     out = ""
@@ -555,3 +866,275 @@ def scan_shared_publishers(store_fn):
             out += "%s:\n- %s" % (eml, "\n- ".join(report[eml]))
 
     return out
+
+
+# The affected index is an sqlite database with a row for each (release,
+# binary, version) in the manifest of each revision of a store db, so that the
+# revisions affected by a USN can be found without rescanning the store db.
+# Each item is recorded with the digest of its store db entry (and of what
+# else goes into its rows) so that updates only reindex the changed items.
+# A delta scan_store() also records the digests of the items it scanned and
+# of the secnots of each (release, binary) so that the next one only scans the
+# changed items and the items the new secnots affect.
+AFFECTED_INDEX_FORMAT = 1
+AFFECTED_INDEX_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS items (
+    pkg_type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (pkg_type, name)
+) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS binaries (
+    release TEXT NOT NULL,
+    binary TEXT NOT NULL,
+    version TEXT NOT NULL,
+    override TEXT,
+    pkg_type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    revision TEXT NOT NULL,
+    PRIMARY KEY (release, binary, pkg_type, name, revision, version)
+) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS binaries_by_item ON binaries (pkg_type, name)",
+    """CREATE TABLE IF NOT EXISTS scanned (
+    pkg_type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (pkg_type, name)
+) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS secnots (
+    pkg_type TEXT NOT NULL,
+    release TEXT NOT NULL,
+    binary TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (pkg_type, release, binary)
+) WITHOUT ROWID""",
+]
+
+
+def _open_affected_index(fn):
+    """Open (creating if needed) the affected index"""
+    conn = sqlite3.connect(fn)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with conn:
+        for stmt in AFFECTED_INDEX_SCHEMA:
+            conn.execute(stmt)
+    return conn
+
+
+def _affected_index_salt():
+    """Return what, besides the store db entry, determines the rows of an
+    item: the index format and the overrides used to fake and filter the
+    packages of the manifests"""
+    salt = [
+        AFFECTED_INDEX_FORMAT,
+        overrides.update_stage_packages,
+        overrides.update_build_packages,
+        overrides.update_binaries_ignore,
+        overrides.update_package_version,
+    ]
+    return json.dumps(salt, sort_keys=True, default=str).encode()
+
+
+def _affected_index_digest(item, salt):
+    h = hashlib.sha256(salt)
+    h.update(b"\0")
+    h.update(json.dumps(item, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def _get_affected_index_digests(conn, store_db_type, table="items"):
+    """Return the digests of the store_db_type items in the affected index
+    (or, with table="scanned", as of the last delta scan_store())"""
+    return dict(
+        conn.execute(
+            "SELECT name, digest FROM %s WHERE pkg_type = ?" % table, (store_db_type,),
+        )
+    )
+
+
+def _index_affected_item(conn, item, store_db_type, digest):
+    """(Re)index the binaries of the store db item"""
+    name = item["name"]
+    conn.execute(
+        "DELETE FROM binaries WHERE pkg_type = ? AND name = ?", (store_db_type, name)
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO binaries (release, binary, version, override, "
+        "pkg_type, name, revision) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (rel, pkg, v, override, store_db_type, name, r)
+            for (rel, pkg, v, override, r) in get_pkg_binaries(item, store_db_type)
+        ],
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO items (pkg_type, name, digest) VALUES (?, ?, ?)",
+        (store_db_type, name, digest),
+    )
+
+
+def _remove_affected_index_items(conn, store_db_type, names):
+    for table in ["binaries", "items", "scanned"]:
+        conn.executemany(
+            "DELETE FROM %s WHERE pkg_type = ? AND name = ?" % table,
+            [(store_db_type, name) for name in names],
+        )
+
+
+def update_affected_index(store_db_fn, index_fn, store_db_type="snap", merge=False):
+    """Update the affected index in index_fn from the store db. Unless merge,
+    the items of store_db_type that are no longer in the store db are removed
+    from the index; with merge, store_db_fn may only have the new or updated
+    items. Returns (updated, unchanged, removed) item counts.
+    """
+    salt = _affected_index_salt()
+    (updated, unchanged) = (0, 0)
+    removed = []
+    conn = _open_affected_index(index_fn)
+    try:
+        with conn:
+            known = _get_affected_index_digests(conn, store_db_type)
+            seen = set()
+            for item in read_file_as_json_array_items(store_db_fn):
+                if "name" not in item:
+                    continue
+                seen.add(item["name"])
+                digest = _affected_index_digest(item, salt)
+                if known.get(item["name"]) == digest:
+                    unchanged += 1
+                    continue
+                _index_affected_item(conn, item, store_db_type, digest)
+                known[item["name"]] = digest
+                updated += 1
+
+            if not merge:
+                removed = [name for name in known if name not in seen]
+                _remove_affected_index_items(conn, store_db_type, removed)
+    finally:
+        conn.close()
+
+    debug(
+        "affected index: %d updated, %d unchanged and %d removed items"
+        % (updated, unchanged, len(removed))
+    )
+    return (updated, unchanged, len(removed))
+
+
+def _get_changed_secnots(conn, secnot_db, store_db_type):
+    """Return the digests of the secnots of the (release, binary) pairs of
+    secnot_db that changed since they were recorded by the last delta
+    scan_store() of store_db_type"""
+    known = {}
+    for (rel, pkg, digest) in conn.execute(
+        "SELECT release, binary, digest FROM secnots WHERE pkg_type = ?",
+        (store_db_type,),
+    ):
+        known[(rel, pkg)] = digest
+
+    changed = {}
+    for rel in secnot_db:
+        for pkg in secnot_db[rel]:
+            h = hashlib.sha256()
+            for secnot in sorted(secnot_db[rel][pkg]):
+                version = secnot_db[rel][pkg][secnot]["version"]
+                h.update(("%s=%s\n" % (secnot, version.full_version)).encode())
+            digest = h.hexdigest()
+            if known.get((rel, pkg)) != digest:
+                changed[(rel, pkg)] = digest
+    return changed
+
+
+def _get_affected_index_names(conn, store_db_type, binaries):
+    """Return the names of the store_db_type items in the affected index with
+    any of the (release, binary) pairs in binaries"""
+    names = set()
+    for (rel, pkg) in binaries:
+        for (name,) in conn.execute(
+            "SELECT DISTINCT name FROM binaries "
+            "WHERE release = ? AND binary = ? AND pkg_type = ?",
+            (rel, pkg, store_db_type),
+        ):
+            names.add(name)
+    return names
+
+
+def _get_affected_by_secnot(conn, rel, pkg, secnotversion):
+    """Return the (pkg_type, name, revision, version) rows of the affected
+    index that have a version of pkg in rel that is older than
+    secnotversion. Each indexed row for (rel, pkg) is compared in turn,
+    parsing each distinct version once"""
+    affected = []
+    parsed = {}
+    for (v, override, pkg_type, name, r) in conn.execute(
+        "SELECT version, override, pkg_type, name, revision FROM binaries "
+        "WHERE release = ? AND binary = ?",
+        (rel, pkg),
+    ):
+        # like scan_store(), only rocks are checked for non-LTS releases
+        if pkg_type != "rock" and rel not in tracked_releases:
+            continue
+        if v not in parsed:
+            parsed[v] = debversion.parse(v)
+        if override is not None:
+            if parsed[v] < debversion.parse(override):
+                affected.append((pkg_type, name, r, v))
+        elif parsed[v] < secnotversion:
+            affected.append((pkg_type, name, r, v))
+    return affected
+
+
+def get_affected_by(secnot_db, index_fn, secnot):
+    """Return the revisions in the affected index that secnot (eg, 3501-1 or
+    USN-3501-1) affects, as a sorted list of dicts with the pkg_type, name,
+    revision, release, binary and version of each affected binary"""
+    if secnot.startswith("USN-"):
+        secnot = secnot[len("USN-") :]
+    if not os.path.exists(index_fn):
+        raise ValueError("Could not find affected index '%s'" % index_fn)
+
+    found = False
+    affected = []
+    conn = _open_affected_index(index_fn)
+    try:
+        for rel in secnot_db:
+            for pkg in secnot_db[rel]:
+                if secnot not in secnot_db[rel][pkg]:
+                    continue
+                found = True
+                secnotversion = secnot_db[rel][pkg][secnot]["version"]
+                for (pkg_type, name, r, v) in _get_affected_by_secnot(
+                    conn, rel, pkg, secnotversion
+                ):
+                    affected.append(
+                        {
+                            "pkg_type": pkg_type,
+                            "name": name,
+                            "revision": r,
+                            "release": rel,
+                            "binary": pkg,
+                            "version": v,
+                        }
+                    )
+    finally:
+        conn.close()
+
+    if not found:
+        raise ValueError("'%s' not found in security notification database" % secnot)
+
+    affected.sort(key=lambda a: (a["pkg_type"], a["name"], a["revision"], a["binary"]))
+    return affected
+
+
+def scan_affected_by(secnot_db_fn, index_fn, secnot, usn_db_cache_dir=None):
+    """Report the revisions in the affected index that secnot affects"""
+    # rocks may be based on non-LTS releases
+    secnot_db = read_usn_db(
+        secnot_db_fn, support_non_lts=True, cache_dir=usn_db_cache_dir
+    )
+    affected = get_affected_by(secnot_db, index_fn, secnot)
+
+    out = ""
+    if len(affected) != 0:
+        out += json.dumps(affected, indent=2, sort_keys=True)
+
+    return out
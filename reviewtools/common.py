@@ -18,16 +18,22 @@ from __future__ import print_function
 import atexit
 import codecs
 import copy
+from collections.abc import Mapping
 from enum import Enum
+import fcntl
 import glob
+import hashlib
 import inspect
 import json
 import logging
 import magic
+import multiprocessing
 import os
 from pkg_resources import resource_filename
 import re
+import resource
 import shutil
+import sqlite3
 import stat
 import subprocess
 import sys
@@ -39,6 +45,7 @@ import types
 import yaml
 
 from reviewtools.overrides import common_external_symlink_override
+from reviewtools.squashfs import SquashfsError, SquashfsImage
 
 REPORT_OUTPUT = "json"
 RESULT_TYPES = ["info", "warn", "error"]
@@ -95,9 +102,54 @@ MAX_UNCOMPRESSED_SIZE = 25
 # cache the expensive magic calls
 PKG_BIN_FILES = None
 
+# classify files with libmagic in this many processes, when there are at least
+# MAGIC_JOBS_MIN_FILES candidates (see Review._list_all_compiled_binaries())
+MAGIC_JOBS = os.cpu_count() or 1
+MAGIC_JOBS_MIN_FILES = 256
+
 # cache gathering all the files
 PKG_FILES = None
 
+# cache the unsquashfs queries per package (see get_squashfs_metadata())
+SQUASHFS_METADATA = {}
+
+# cache whether unsquashfs supports -ignore-errors, per unsquashfs binary
+UNSQUASHFS_SUPPORTS_IGNORE_ERRORS = {}
+
+# opt-in cache of unpacked packages, keyed by the package sha512, shared
+# between runs (see unpack_pkg_cached()). Set RT_UNPACK_CACHE to a directory to
+# enable it and RT_UNPACK_CACHE_MAX_SIZE (in MB) to cap its size
+UNPACK_CACHE_MAX_SIZE = 10 * 1024
+# cache entries in use by this process, with their (shared) lock file
+UNPACK_CACHE_LOCKS = {}
+
+# cache the squashfs-tools version, per mksquashfs/unsquashfs binaries
+SQUASHFS_TOOLS_VERSION = {}
+
+# opt-in cache of resquash verdicts, shared between runs (see ResquashCache).
+# Set RT_RESQUASH_CACHE to a file to enable it. Bump RESQUASH_CACHE_FORMAT
+# whenever the resquash changes in a way not covered by resquash_cache_key()
+RESQUASH_CACHE_FORMAT = 1
+RESQUASH_CACHE_MAX_ENTRIES = 100000
+RESQUASH_CACHE_SCHEMA = """CREATE TABLE IF NOT EXISTS verdicts (
+    key TEXT NOT NULL PRIMARY KEY,
+    format INTEGER NOT NULL,
+    identical INTEGER NOT NULL,
+    last_used INTEGER NOT NULL
+) WITHOUT ROWID"""
+
+# parsed snapd base declaration (see read_snapd_base_declaration())
+BASE_DECLARATION_CACHE = {}
+
+# libyaml's safe loader builds the same objects as the pure-python one, only
+# several times faster, so use it when PyYAML was built with it (see
+# yaml_safe_load())
+YAML_SAFE_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# opt-in timings of the module constructors, check methods and commands, as
+# recorded by Timer (see timings_enable())
+TIMINGS = None
+
 # os release map
 OS_RELEASE_MAP = {
     "ubuntu": {
@@ -143,7 +195,10 @@ OS_RELEASE_MAP = {
 
 def cleanup_unpack():
     global UNPACK_DIR
-    if UNPACK_DIR is not None and os.path.isdir(UNPACK_DIR):
+    if UNPACK_DIR is not None and UNPACK_DIR in UNPACK_CACHE_LOCKS:
+        # owned by the unpack cache
+        UNPACK_DIR = None
+    elif UNPACK_DIR is not None and os.path.isdir(UNPACK_DIR):
         recursive_rm(UNPACK_DIR)
         UNPACK_DIR = None
     global RAW_UNPACK_DIR
@@ -154,6 +209,10 @@ def cleanup_unpack():
     if TMP_DIR is not None and os.path.isdir(TMP_DIR):
         recursive_rm(TMP_DIR)
         TMP_DIR = None
+    global SQUASHFS_METADATA
+    SQUASHFS_METADATA = {}
+    for entry in list(UNPACK_CACHE_LOCKS):
+        _unpack_cache_release(entry)
 
     # Also cleanup any stale review directories
     global MKDTEMP_PREFIX
@@ -335,7 +394,8 @@ class ReviewBase(object):
             if not methodname.startswith("check_"):
                 continue
             func = getattr(self, methodname)
-            func()
+            with Timer("check", "%s:%s" % (self.review_type, methodname)):
+                func()
 
     def set_review_type(self, name):
         """Set review name"""
@@ -371,6 +431,8 @@ class Review(ReviewBase):
             MKDTEMP_DIR = os.environ["SNAP_USER_COMMON"]
 
         global UNPACK_DIR
+        if UNPACK_DIR is None:
+            UNPACK_DIR = unpack_pkg_cached(fn)
         if UNPACK_DIR is None:
             UNPACK_DIR = unpack_pkg(fn)
         self.unpack_dir = UNPACK_DIR
@@ -422,10 +484,10 @@ class Review(ReviewBase):
 
     def _get_sha512sum(self, fn):
         """Get sha512sum of file"""
-        (rc, out) = cmd(["sha512sum", fn])
-        if rc != 0:
+        try:
+            return sha512sum(fn)
+        except OSError:
             return None
-        return out.split()[0]
 
     def _pkgfmt_type(self):
         """Return the package format type"""
@@ -465,23 +527,41 @@ class Review(ReviewBase):
         """List all compiled binaries in this package."""
         global PKG_BIN_FILES
         if PKG_BIN_FILES is None:
-            self.mime = magic.open(magic.MAGIC_MIME)
-            self.mime.load()
-            PKG_BIN_FILES = []
+            # all the magic_binary_file_descriptions are ELF, so only ask
+            # libmagic about ELF files
+            candidates = []
+            seen = set()
             for i in self.pkg_files:
-                try:
-                    res = self.mime.file(i)
-                except Exception:  # pragma: nocover
-                    # workaround for zesty python3-magic
-                    debug("could not detemine mime type of '%s'" % i)
-                    continue
-
                 if (
-                    res in self.magic_binary_file_descriptions
+                    i not in seen
                     and not self._check_if_message_catalog(i)
-                    and i not in PKG_BIN_FILES
+                    and _is_elf_file(i)
                 ):
-                    PKG_BIN_FILES.append(i)
+                    seen.add(i)
+                    candidates.append(i)
+
+            if (
+                MAGIC_JOBS > 1
+                and len(candidates) >= MAGIC_JOBS_MIN_FILES
+                # pool workers may not have children of their own
+                and not multiprocessing.current_process().daemon
+            ):
+                ctx = multiprocessing.get_context("fork")
+                with ctx.Pool(processes=MAGIC_JOBS, initializer=_magic_init) as pool:
+                    res = pool.map(
+                        _magic_file,
+                        candidates,
+                        chunksize=max(1, len(candidates) // (MAGIC_JOBS * 4)),
+                    )
+            else:
+                _magic_init()
+                res = [_magic_file(i) for i in candidates]
+
+            PKG_BIN_FILES = [
+                i
+                for (i, r) in zip(candidates, res)
+                if r in self.magic_binary_file_descriptions
+            ]
 
         self.pkg_bin_files = PKG_BIN_FILES
 
@@ -504,6 +584,39 @@ class Review(ReviewBase):
 #
 
 
+def _is_elf_file(fn):
+    """Check if fn is a regular file starting with the ELF magic"""
+    try:
+        if not stat.S_ISREG(os.lstat(fn).st_mode):
+            return False
+        with open(fn, "rb") as f:
+            return f.read(4) == b"\x7fELF"
+    except OSError:
+        return False
+
+
+# libmagic handle of this process (see _magic_init())
+_magic_mime = None
+
+
+def _magic_init():
+    """Open the libmagic handle for this process, if not already open"""
+    global _magic_mime
+    if _magic_mime is None:
+        _magic_mime = magic.open(magic.MAGIC_MIME)
+        _magic_mime.load()
+
+
+def _magic_file(fn):
+    """Return the mime type of fn, or None if it can't be determined"""
+    try:
+        return _magic_mime.file(fn)
+    except Exception:  # pragma: nocover
+        # workaround for zesty python3-magic
+        debug("could not detemine mime type of '%s'" % fn)
+        return None
+
+
 def error(out, exit_code=1, do_exit=True, output_type=None):
     """Print error message and exit"""
     global REPORT_OUTPUT
@@ -578,18 +691,125 @@ def jsonmsg(out):
     msg(json.dumps(out, sort_keys=True, indent=2, separators=(",", ": ")))
 
 
+def timings_enable():
+    """Start recording timings (see Timer)"""
+    global TIMINGS
+    if TIMINGS is None:
+        TIMINGS = []
+
+
+def _children_cpu_time():
+    """Return the CPU time used by the waited for children of this process"""
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ru.ru_utime + ru.ru_stime
+
+
+class Timer(object):
+    """Record the wall and CPU time of a 'with' block in TIMINGS, when
+       timings are enabled. The CPU time of the commands run in the block is
+       recorded separately, as 'child_cpu'.
+    """
+
+    def __init__(self, category, name, args=None):
+        self.category = category
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        if TIMINGS is not None:
+            self.start = time.time()
+            self.wall = time.perf_counter()
+            self.cpu = time.process_time()
+            self.child_cpu = _children_cpu_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.start is None or TIMINGS is None:
+            return
+        t = {
+            "category": self.category,
+            "name": self.name,
+            "start": self.start,
+            "wall": time.perf_counter() - self.wall,
+            "cpu": time.process_time() - self.cpu,
+            "child_cpu": _children_cpu_time() - self.child_cpu,
+            "pid": os.getpid(),
+        }
+        if self.args is not None:
+            t["args"] = self.args
+        TIMINGS.append(t)
+
+
+def timings_summary(timings):
+    """Sum up timings per category and name:
+         {
+           "<category>": {
+             "<name>": {"count": ..., "wall": ..., "cpu": ..., "child_cpu": ...}
+           }
+         }
+    """
+    summary = {}
+    for t in timings:
+        if t["category"] not in summary:
+            summary[t["category"]] = {}
+        if t["name"] not in summary[t["category"]]:
+            summary[t["category"]][t["name"]] = {
+                "count": 0,
+                "wall": 0.0,
+                "cpu": 0.0,
+                "child_cpu": 0.0,
+            }
+        s = summary[t["category"]][t["name"]]
+        s["count"] += 1
+        for k in ["wall", "cpu", "child_cpu"]:
+            s[k] += t[k]
+
+    for category in summary:
+        for name in summary[category]:
+            for k in ["wall", "cpu", "child_cpu"]:
+                summary[category][name][k] = round(summary[category][name][k], 6)
+    return summary
+
+
+def timings_write_trace(timings, fn):
+    """Write timings to fn in the Chrome trace event format (viewable with
+       chrome://tracing or https://ui.perfetto.dev)
+    """
+    events = []
+    for t in timings:
+        args = {"cpu": t["cpu"], "child_cpu": t["child_cpu"]}
+        if "args" in t:
+            args.update(t["args"])
+        events.append(
+            {
+                "name": t["name"],
+                "cat": t["category"],
+                "ph": "X",
+                "ts": int(t["start"] * 1000000),
+                "dur": int(t["wall"] * 1000000),
+                "pid": t["pid"],
+                "tid": t["pid"],
+                "args": args,
+            }
+        )
+    with open(fn, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
 def cmd(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT):
     """Try to execute the given command."""
     debug(" ".join(command))
-    try:
-        sp = subprocess.Popen(command, stdout=stdout, stderr=stderr)
-    except OSError as ex:
-        return [127, str(ex)]
+    with Timer("cmd", os.path.basename(command[0]), {"argv": command}):
+        try:
+            sp = subprocess.Popen(command, stdout=stdout, stderr=stderr)
+        except OSError as ex:
+            return [127, str(ex)]
 
-    if sys.version_info[0] >= 3:
-        out = sp.communicate()[0].decode("ascii", "ignore")
-    else:
-        out = sp.communicate()[0]
+        if sys.version_info[0] >= 3:
+            out = sp.communicate()[0].decode("ascii", "ignore")
+        else:
+            out = sp.communicate()[0]
 
     return [sp.returncode, out]
 
@@ -702,9 +922,114 @@ def move_dir_content(d, dest):
     os.chmod(dest, st_mode & 0o7777)
 
 
+class SquashfsMetadata(object):
+    """This class represents the unsquashfs metadata of a squashfs package.
+       Each unsquashfs query is run at most once and its output remembered.
+    """
+
+    def __init__(self, pkg, identity=None):
+        self.pkg = pkg
+        self.identity = identity
+        self._out = {}
+        self._lln_parsed = {}
+        self._native = None
+
+    def _unsquashfs(self, opt, lang=None):
+        """Run 'unsquashfs <opt>' on the package, if not already run"""
+        # the unsquashfs in PATH may change (eg, in the testsuite)
+        key = (shutil.which("unsquashfs"), opt)
+        if key not in self._out:
+            if lang is not None:
+                (origLANG, origLC_ALL) = set_lang(lang, lang)
+            self._out[key] = cmd(["unsquashfs", opt, self.pkg])
+            if lang is not None:
+                restore_lang(origLANG, origLC_ALL)
+        return self._out[key]
+
+    def lln(self):
+        """Return unsquashfs -lln output"""
+        return self._unsquashfs("-lln")
+
+    def _read_native(self):
+        """Read the listing directly from the image, if possible"""
+        if self._native is None:
+            self._native = {"lln": None, "size": None}
+            try:
+                with SquashfsImage(self.pkg) as img:
+                    self._native["lln"] = squashfs_lln_parse(img)
+            except (OSError, SquashfsError) as e:
+                # eg, compression without a python decompressor
+                debug("using unsquashfs for '%s': %s" % (self.pkg, e))
+                return self._native
+            except ReviewException as e:
+                self._native["lln"] = e
+                return self._native
+
+            size = 0
+            for (line, item) in self._native["lln"][1]:
+                if item is not None and item[StatLLN.FILETYPE] == "-":
+                    size += int(item[StatLLN.SIZE])
+            self._native["size"] = size
+        return self._native
+
+    def has_native_lln(self):
+        """Return whether the listing is read without running unsquashfs"""
+        return self._read_native()["lln"] is not None
+
+    def uncompressed_size(self):
+        """Return the total size of the regular files in the package, or None
+           if it can't be read without running unsquashfs
+        """
+        return self._read_native()["size"]
+
+    def lln_parse(self):
+        """Return the parsed unsquashfs -lln output (see
+           unsquashfs_lln_parse()), read directly from the image when
+           possible. Raises ReviewException if unsquashfs failed or if the
+           output is malformed.
+        """
+        native = self._read_native()["lln"]
+        if isinstance(native, ReviewException):
+            raise native
+        elif native is not None:
+            return native
+
+        key = shutil.which("unsquashfs")
+        if key not in self._lln_parsed:
+            (rc, out) = self.lln()
+            if rc != 0:
+                raise ReviewException("unsquashfs -lln failed: %s" % out)
+            self._lln_parsed[key] = unsquashfs_lln_parse(out)
+        return self._lln_parsed[key]
+
+    def stat(self):
+        """Return unsquashfs -stat output"""
+        return self._unsquashfs("-stat", lang="C.UTF-8")
+
+    def fstime(self):
+        """Return unsquashfs -fstime output"""
+        return self._unsquashfs("-fstime")
+
+
+def get_squashfs_metadata(pkg):
+    """Return the SquashfsMetadata for pkg, shared across the run"""
+    fn = os.path.abspath(pkg)
+    try:
+        st = os.stat(fn)
+    except OSError:
+        # let unsquashfs report the error, but don't remember it
+        return SquashfsMetadata(fn)
+
+    identity = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    global SQUASHFS_METADATA
+    if fn not in SQUASHFS_METADATA or SQUASHFS_METADATA[fn].identity != identity:
+        SQUASHFS_METADATA[fn] = SquashfsMetadata(fn, identity)
+    return SQUASHFS_METADATA[fn]
+
+
 def unsquashfs_lln(snap_pkg):
     """Return unsquashfs -lln output"""
-    return cmd(["unsquashfs", "-lln", snap_pkg])
+    return get_squashfs_metadata(snap_pkg).lln()
 
 
 unsquashfs_lln_regex = {
@@ -736,10 +1061,166 @@ class StatLLN(Enum):
     FULLNAME = 12  # full filename
 
 
-def unsquashfs_lln_parse_line(line):
-    """Parse a line of unsquashfs -lln output"""
-    item = {}  # XXX: make object to ease with comparisons, etc
+# ls file type character to stat file type
+statlln_ftype_ifmt = {
+    "-": stat.S_IFREG,
+    "d": stat.S_IFDIR,
+    "l": stat.S_IFLNK,
+    "b": stat.S_IFBLK,
+    "c": stat.S_IFCHR,
+    "p": stat.S_IFIFO,
+    "s": stat.S_IFSOCK,
+}
+
 
+def _ls_mode_to_int(mode):
+    """Convert ls permissions (eg, rwsr-xr-x) to an integer mode"""
+    perms = 0
+    for (i, special) in [(0, stat.S_ISUID), (3, stat.S_ISGID), (6, stat.S_ISVTX)]:
+        if mode[i] == "r":
+            perms |= 4 << (6 - i)
+        if mode[i + 1] == "w":
+            perms |= 2 << (6 - i)
+        if mode[i + 2] in "xst":
+            perms |= 1 << (6 - i)
+        if mode[i + 2] in "sStT":
+            perms |= special
+    return perms
+
+
+class StatLLNEntry(Mapping):
+    """This class represents an entry of the unsquashfs -lln output. The
+       fields are stored compactly (integer mode, uid, gid, size and
+       major/minor) and are read-only. For compatibility, they may also be
+       read by StatLLN key, as the strings in the unsquashfs -lln output.
+       Only the 'symbols' annotation may be added via item["symbols"].
+    """
+
+    __slots__ = (
+        "ftype",
+        "mode",
+        "uid",
+        "gid",
+        "size",
+        "major",
+        "minor",
+        "date",
+        "time",
+        "fullname",
+        "symbols",
+    )
+
+    def __init__(self, ftype, mode, uid, gid, size, major, minor, date, time, fullname):
+        for (k, v) in [
+            ("ftype", ftype),
+            ("mode", mode),
+            ("uid", uid),
+            ("gid", gid),
+            ("size", size),
+            ("major", major),
+            ("minor", minor),
+            # many entries share these
+            ("date", sys.intern(date)),
+            ("time", sys.intern(time)),
+            ("fullname", fullname),
+            ("symbols", None),
+        ]:
+            object.__setattr__(self, k, v)
+
+    def __setattr__(self, k, v):
+        raise AttributeError("StatLLNEntry is read-only")
+
+    def __reduce__(self):
+        if self.symbols is not None:
+            return (self.__class__, self._args(), {"symbols": self.symbols})
+        return (self.__class__, self._args())
+
+    def __setstate__(self, state):
+        object.__setattr__(self, "symbols", state["symbols"])
+
+    def _args(self):
+        return (
+            self.ftype,
+            self.mode,
+            self.uid,
+            self.gid,
+            self.size,
+            self.major,
+            self.minor,
+            self.date,
+            self.time,
+            self.fullname,
+        )
+
+    def is_device(self):
+        return self.ftype == "b" or self.ftype == "c"
+
+    def _keys(self):
+        keys = [
+            StatLLN.FILENAME,
+            StatLLN.FULLNAME,
+            StatLLN.FILETYPE,
+            StatLLN.MODE,
+            StatLLN.OWNER,
+            StatLLN.UID,
+            StatLLN.GID,
+        ]
+        if self.is_device():
+            keys += [StatLLN.MAJOR, StatLLN.MINOR]
+        else:
+            keys.append(StatLLN.SIZE)
+        keys += [StatLLN.DATE, StatLLN.TIME]
+        if self.symbols is not None:
+            keys.append("symbols")
+        return keys
+
+    def __getitem__(self, k):
+        if k == StatLLN.FILENAME:
+            # strip the leading 'squashfs-root'
+            return "." + self.fullname[13:]
+        elif k == StatLLN.FULLNAME:
+            return self.fullname
+        elif k == StatLLN.FILETYPE:
+            return self.ftype
+        elif k == StatLLN.MODE:
+            return stat.filemode(statlln_ftype_ifmt[self.ftype] | self.mode)[1:]
+        elif k == StatLLN.OWNER:
+            return "%d/%d" % (self.uid, self.gid)
+        elif k == StatLLN.UID:
+            return str(self.uid)
+        elif k == StatLLN.GID:
+            return str(self.gid)
+        elif k == StatLLN.SIZE and not self.is_device():
+            return str(self.size)
+        elif k == StatLLN.MAJOR and self.is_device():
+            return str(self.major)
+        elif k == StatLLN.MINOR and self.is_device():
+            return str(self.minor)
+        elif k == StatLLN.DATE:
+            return self.date
+        elif k == StatLLN.TIME:
+            return self.time
+        elif k == "symbols" and self.symbols is not None:
+            return self.symbols
+        raise KeyError(k)
+
+    def __setitem__(self, k, v):
+        if k != "symbols":
+            raise TypeError("StatLLNEntry is read-only")
+        object.__setattr__(self, "symbols", v)
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __repr__(self):
+        return "StatLLNEntry(%s)" % dict(self)
+
+
+def unsquashfs_lln_parse_line(line):
+    """Parse a line of unsquashfs -lln output into a StatLLNEntry"""
     if "\x00" in line:
         raise ReviewException("entry may not contain NUL characters: %s" % line)
 
@@ -764,28 +1245,22 @@ def unsquashfs_lln_parse_line(line):
 
     # embedded NULs handled above
     fname = unsquashfs_lln_regex["fname_pat"].sub(".", line)
-    item[StatLLN.FILENAME] = fname
-
     fname_full = unsquashfs_lln_regex["fname_pat"].sub("\\1", line)
-    item[StatLLN.FULLNAME] = fname_full
 
     # Also see 'info ls', but we list only the Linux ones
     if not unsquashfs_lln_regex["ftype_pat"].search(ftype):
         raise ReviewException("unknown type '%s' for entry '%s'" % (ftype, fname))
-    item[StatLLN.FILETYPE] = ftype
 
     # verify mode
     mode = tmp[0][1:]
     if not unsquashfs_lln_regex["mode_pat"].search(mode):
         raise ReviewException("mode '%s' malformed for '%s'" % (mode, fname))
-    item[StatLLN.MODE] = mode
 
     # verify ownership
     owner = tmp[1]
     if not unsquashfs_lln_regex["owner_pat"].search(owner):
         raise ReviewException("uid/gid '%s' malformed for '%s'" % (owner, fname))
-    item[StatLLN.OWNER] = owner
-    item[StatLLN.UID], item[StatLLN.GID] = owner.split("/")
+    (uid, gid) = owner.split("/")
 
     if ftype == "b" or ftype == "c":
         # Account for unsquashfs -lln doing:
@@ -799,34 +1274,43 @@ def unsquashfs_lln_parse_line(line):
             minor = tmp[3]
 
         try:
-            int(major)
+            major = int(major)
         except Exception:
             raise ReviewException("major '%s' malformed for '%s'" % (major, fname))
-        item[StatLLN.MAJOR] = major
         try:
-            int(minor)
+            minor = int(minor)
         except Exception:
             raise ReviewException("minor '%s' malformed for '%s'" % (minor, fname))
-        item[StatLLN.MINOR] = minor
+        size = None
     else:
         size = tmp[2]
         try:
-            int(size)
+            size = int(size)
         except Exception:
             raise ReviewException("size '%s' malformed for '%s'" % (size, fname))
-        item[StatLLN.SIZE] = size
+        major = None
+        minor = None
 
     date = tmp[date_idx]
     if not unsquashfs_lln_regex["date_pat"].search(date):
         raise ReviewException("date '%s' malformed for '%s'" % (date, fname))
-    item[StatLLN.DATE] = date
 
     time = tmp[time_idx]
     if not unsquashfs_lln_regex["time_pat"].search(time):
         raise ReviewException("time '%s' malformed for '%s'" % (time, fname))
-    item[StatLLN.TIME] = time
 
-    return copy.copy(item)
+    return StatLLNEntry(
+        ftype,
+        _ls_mode_to_int(mode),
+        int(uid),
+        int(gid),
+        size,
+        major,
+        minor,
+        date,
+        time,
+        fname_full,
+    )
 
 
 def unsquashfs_lln_parse(lln_out):
@@ -865,9 +1349,85 @@ def unsquashfs_lln_parse(lln_out):
     return hdr, entries
 
 
+def squashfs_lln_parse(img):
+    """Read the entries of a SquashfsImage, returning them as
+       unsquashfs_lln_parse() does for the 'unsquashfs -lln' output
+    """
+    hdr = []
+    entries = []
+
+    errors = []
+    for (path, inode) in img.walk():
+        ls_mode = stat.filemode(inode.mode)
+        ftype = ls_mode[0]
+        uid = str(inode.uid)
+        gid = str(inode.gid)
+        if inode.target is not None:
+            path += " -> %s" % inode.target
+
+        # see print_filename() in squashfs-tools/unsquashfs.c
+        if ftype == "b" or ftype == "c":
+            size = None
+            major = inode.rdev >> 8
+            minor = inode.rdev & 0xFF
+            data = "%d,%3d" % (major, minor)
+        else:
+            size = inode.size
+            major = None
+            minor = None
+            data = str(size)
+        mtime = time.localtime(inode.mtime)
+        date = time.strftime("%Y-%m-%d", mtime)
+        hm = time.strftime("%H:%M", mtime)
+        line = "%s %s/%s %*s %s %s squashfs-root%s" % (
+            ls_mode,
+            uid,
+            gid,
+            max(25 - len(uid) - len(gid), 0),
+            data,
+            date,
+            hm,
+            path,
+        )
+        # like cmd(), which unsquashfs_lln() uses
+        line = line.encode("utf-8", "surrogateescape").decode("ascii", "ignore")
+        path = path.encode("utf-8", "surrogateescape").decode("ascii", "ignore")
+
+        # names that the unsquashfs output can't represent on one line
+        if "\x00" in line or len(line.splitlines()) != 1:
+            errors.append("could not determine filename: %s" % line)
+            entries.append((line, None))
+            continue
+
+        item = StatLLNEntry(
+            ftype,
+            stat.S_IMODE(inode.mode),
+            inode.uid,
+            inode.gid,
+            size,
+            major,
+            minor,
+            date,
+            hm,
+            "squashfs-root" + path,
+        )
+        entries.append((line, item))
+
+    if len(errors) > 0:
+        raise ReviewException(
+            "malformed lines in unsquashfs output: '%s'" % ", ".join(errors)
+        )
+
+    return hdr, entries
+
+
 def _calculate_snap_unsquashfs_uncompressed_size(snap_pkg):
     """Calculate size of the uncompressed snap"""
-    (rc, out) = cmd(["unsquashfs", "-lln", snap_pkg])
+    size = get_squashfs_metadata(snap_pkg).uncompressed_size()
+    if size is not None:
+        return size
+
+    (rc, out) = unsquashfs_lln(snap_pkg)
     if rc != 0:
         error("unsquashfs -lln '%s' failed: %s" % (snap_pkg, out))
 
@@ -895,9 +1455,143 @@ def _calculate_rock_untar_uncompressed_size(rock_pkg):
 
 def unsquashfs_supports_ignore_errors():
     """Detect if unsquashfs supports the -ignore-errors option"""
-    (rc, out) = cmd(["unsquashfs", "-help"])
-    # unsquashfs -help returns non-zero, so just search for the option
-    return "-ig[nore-errors]" in out
+    global UNSQUASHFS_SUPPORTS_IGNORE_ERRORS
+    key = shutil.which("unsquashfs")
+    if key not in UNSQUASHFS_SUPPORTS_IGNORE_ERRORS:
+        (rc, out) = cmd(["unsquashfs", "-help"])
+        # unsquashfs -help returns non-zero, so just search for the option
+        UNSQUASHFS_SUPPORTS_IGNORE_ERRORS[key] = "-ig[nore-errors]" in out
+    return UNSQUASHFS_SUPPORTS_IGNORE_ERRORS[key]
+
+
+def squashfs_tools_version():
+    """Return the version of the mksquashfs and unsquashfs in use"""
+    global SQUASHFS_TOOLS_VERSION
+    key = (shutil.which("mksquashfs"), shutil.which("unsquashfs"))
+    if key not in SQUASHFS_TOOLS_VERSION:
+        version = []
+        for tool in ["mksquashfs", "unsquashfs"]:
+            (rc, out) = cmd([tool, "-version"])
+            version.append(out.splitlines()[0] if rc == 0 and out else "")
+        SQUASHFS_TOOLS_VERSION[key] = version
+    return SQUASHFS_TOOLS_VERSION[key]
+
+
+def unsquashfs_as_root():
+    """Return whether the resquash unsquashfs runs as (fake)root, which keeps
+       the ownership of the files
+    """
+    return "SNAP_FAKEROOT_RESQUASHFS" in os.environ or os.geteuid() == 0
+
+
+def resquash_cache_key(fn, comp, fstime):
+    """Return the resquash cache key of the squashfs fn, resquashed with the
+       comp compression and fstime
+    """
+    key = [
+        sha512sum(fn),
+        comp,
+        fstime,
+        squashfs_tools_version(),
+        MKSQUASHFS_OPTS,
+        unsquashfs_as_root(),
+    ]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+class ResquashCache(object):
+    """This class represents the on-disk cache of the resquash verdicts
+       (whether the resquashed image is identical to the original), keyed by
+       resquash_cache_key(). The least recently used entries are evicted on
+       close() to keep at most max_entries.
+    """
+
+    def __init__(self, fn, max_entries=RESQUASH_CACHE_MAX_ENTRIES):
+        self.filename = fn
+        self.max_entries = max_entries
+        self._used = set()
+        self._new = {}
+
+        self._conn = sqlite3.connect(fn, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(RESQUASH_CACHE_SCHEMA)
+            self._conn.execute(
+                "DELETE FROM verdicts WHERE format != ?", (RESQUASH_CACHE_FORMAT,)
+            )
+
+    def get(self, key):
+        """Return the cached verdict for key or None"""
+        try:
+            row = self._conn.execute(
+                "SELECT identical FROM verdicts WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            warn("Could not read resquash cache '%s': %s" % (self.filename, e))
+            row = None
+        if row is None:
+            debug("Resquash cache miss for '%s'" % key)
+            return None
+        debug("Resquash cache hit for '%s'" % key)
+        self._used.add(key)
+        return bool(row[0])
+
+    def put(self, key, identical):
+        """Cache the verdict for key. The cache is updated on close()"""
+        self._new[key] = identical
+
+    def close(self):
+        """Write the new entries, record which entries were used, evict and
+           close the cache
+        """
+        now = int(time.time())
+        try:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO verdicts "
+                    "(key, format, identical, last_used) VALUES (?, ?, ?, ?)",
+                    [
+                        (key, RESQUASH_CACHE_FORMAT, int(identical), now)
+                        for (key, identical) in self._new.items()
+                    ],
+                )
+                self._conn.executemany(
+                    "UPDATE verdicts SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in self._used],
+                )
+                self._conn.execute(
+                    "DELETE FROM verdicts WHERE key IN (SELECT key FROM verdicts "
+                    "ORDER BY last_used DESC, key LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error as e:
+            warn("Could not update resquash cache '%s': %s" % (self.filename, e))
+        self._conn.close()
+
+
+def open_resquash_cache():
+    """Open the resquash cache named by RT_RESQUASH_CACHE. Returns None if the
+       resquash cache is disabled or can't be opened.
+    """
+    if "RT_RESQUASH_CACHE" not in os.environ or os.environ["RT_RESQUASH_CACHE"] == "":
+        return None
+    fn = os.environ["RT_RESQUASH_CACHE"]
+
+    max_entries = RESQUASH_CACHE_MAX_ENTRIES
+    if "RT_RESQUASH_CACHE_MAX_ENTRIES" in os.environ:
+        try:
+            max_entries = int(os.environ["RT_RESQUASH_CACHE_MAX_ENTRIES"])
+        except ValueError:
+            warn(
+                "Ignoring RT_RESQUASH_CACHE_MAX_ENTRIES (not an integer: '%s')"
+                % os.environ["RT_RESQUASH_CACHE_MAX_ENTRIES"]
+            )
+
+    try:
+        return ResquashCache(fn, max_entries)
+    except sqlite3.Error as e:
+        warn("Could not open resquash cache '%s': %s" % (fn, e))
+        return None
 
 
 def _unpack_snap_squashfs(snap_pkg, dest, items=[]):
@@ -1092,6 +1786,176 @@ def raw_unpack_pkg(fn, dest=None):
     return dest
 
 
+def get_unpack_cache_dir():
+    """Return the unpack cache directory or None if the cache is disabled"""
+    if "RT_UNPACK_CACHE" not in os.environ or os.environ["RT_UNPACK_CACHE"] == "":
+        return None
+    cache = os.path.abspath(os.environ["RT_UNPACK_CACHE"])
+    if not os.path.isdir(cache):
+        os.makedirs(cache, mode=0o0700, exist_ok=True)
+    return cache
+
+
+def get_unpack_cache_max_size():
+    """Return the maximum size of the unpack cache, in bytes"""
+    size = UNPACK_CACHE_MAX_SIZE
+    if "RT_UNPACK_CACHE_MAX_SIZE" in os.environ:
+        try:
+            size = int(os.environ["RT_UNPACK_CACHE_MAX_SIZE"])
+        except ValueError:
+            error(
+                "RT_UNPACK_CACHE_MAX_SIZE should be an integer (got '%s')"
+                % os.environ["RT_UNPACK_CACHE_MAX_SIZE"]
+            )
+    return size * 1024 * 1024
+
+
+def sha512sum(fn):
+    """Get sha512sum of file"""
+    h = hashlib.sha512()
+    with open(fn, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def files_identical(fn1, fn2, blocksize=1024 * 1024):
+    """Compare two files block by block, stopping at the first block that
+       differs. Raises OSError if either file cannot be read.
+    """
+    if os.stat(fn1).st_size != os.stat(fn2).st_size:
+        return False
+    with open(fn1, "rb") as f1, open(fn2, "rb") as f2:
+        while True:
+            b1 = f1.read(blocksize)
+            if b1 != f2.read(blocksize):
+                return False
+            if not b1:
+                return True
+
+
+def _unpack_cache_lock(entry, op):
+    """Open and flock() the lock file of the cache entry. The lock file is
+       unlinked when the entry is evicted, so retry until the lock is held on
+       the file that is currently in place.
+    """
+    lock_fn = "%s.lock" % entry
+    while True:
+        fd = os.open(lock_fn, os.O_RDWR | os.O_CREAT, 0o0600)
+        try:
+            fcntl.flock(fd, op)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        try:
+            if os.stat(lock_fn).st_ino == os.fstat(fd).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+def _unpack_cache_release(entry):
+    """Stop using the cache entry"""
+    fd = UNPACK_CACHE_LOCKS.pop(entry, None)
+    if fd is not None:
+        os.close(fd)
+
+
+def _unpack_cache_get(fn, populate):
+    """Return the cache entry for fn, holding a shared lock on it until
+       _unpack_cache_release(). If the entry does not exist, unpack fn into it
+       when populate is True, otherwise return None.
+    """
+    cache = get_unpack_cache_dir()
+    if cache is None:
+        return None
+
+    entry = os.path.join(cache, sha512sum(check_fn(fn)))
+    if entry in UNPACK_CACHE_LOCKS:
+        return entry
+
+    fd = _unpack_cache_lock(entry, fcntl.LOCK_SH)
+    while not os.path.isdir(entry):
+        os.close(fd)
+        if not populate:
+            return None
+
+        fd = _unpack_cache_lock(entry, fcntl.LOCK_EX)
+        if not os.path.isdir(entry):
+            debug("Adding '%s' to the unpack cache" % fn)
+            tmp = "%s.tmp" % entry
+            if os.path.lexists(tmp):  # left behind by an interrupted unpack
+                recursive_rm(tmp)
+            unpack_pkg(fn, tmp)
+            os.rename(tmp, entry)
+
+            size = 0
+            for root, dirnames, filenames in os.walk(entry):
+                for f in dirnames + filenames:
+                    size += os.lstat(os.path.join(root, f)).st_size
+            os.ftruncate(fd, 0)
+            os.write(fd, b"%d\n" % size)
+
+        # flock() doesn't downgrade atomically, so the entry might be evicted
+        # in between. If so, just start over.
+        fcntl.flock(fd, fcntl.LOCK_SH)
+
+    # the mtime of the lock file tracks when the entry was last used
+    os.utime(fd)
+    UNPACK_CACHE_LOCKS[entry] = fd
+
+    if populate:
+        _unpack_cache_evict(cache, get_unpack_cache_max_size())
+
+    return entry
+
+
+def _unpack_cache_evict(cache, max_size):
+    """Remove the least recently used cache entries that are not in use until
+       the cache is no larger than max_size
+    """
+    entries = []
+    total = 0
+    for lock_fn in glob.glob(os.path.join(cache, "*.lock")):
+        try:
+            st = os.stat(lock_fn)
+            with open(lock_fn, "r") as f:
+                size = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            continue
+        entries.append((st.st_mtime, lock_fn[: -len(".lock")], size))
+        total += size
+
+    for (mtime, entry, size) in sorted(entries):
+        if total <= max_size:
+            break
+        # skip entries that are in use (including our own)
+        fd = _unpack_cache_lock(entry, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if fd is None:
+            continue
+        try:
+            debug("Evicting '%s' from the unpack cache" % entry)
+            if os.path.isdir(entry):
+                tmp = "%s.evict" % entry
+                if os.path.lexists(tmp):  # left behind by an interrupted evict
+                    recursive_rm(tmp)
+                os.rename(entry, tmp)
+                recursive_rm(tmp)
+            os.unlink("%s.lock" % entry)
+            total -= size
+        finally:
+            os.close(fd)
+
+
+def unpack_pkg_cached(fn):
+    """Unpack package into the unpack cache or reuse a previous unpack of
+       the same package. Returns None if the unpack cache is disabled. The
+       unpacked directory must not be modified.
+    """
+    return _unpack_cache_get(fn, populate=True)
+
+
 def create_tempdir():
     """Create/reuse a temporary directory that is automatically cleaned up"""
     global TMP_DIR
@@ -1365,6 +2229,115 @@ def read_file_as_json_dict(fn):
     return raw
 
 
+def read_file_as_json_array_items(fn, chunk_size=1024 * 1024):
+    """Read in filename as json array, yielding one item at a time so only
+    the current item needs to be in memory"""
+    debug("Streaming: %s" % fn)
+    decoder = json.JSONDecoder()
+    ws = " \t\n\r"
+
+    with open_file_read(fn) as fd:
+        buf = ""
+        idx = 0
+        eof = False
+
+        def _fill(idx, need=0):
+            """Drop the consumed part of buf and read (at least need) more"""
+            nonlocal buf, eof
+            buf = buf[idx:]
+            while not eof:
+                data = fd.read(max(chunk_size, need))
+                if data == "":
+                    eof = True
+                buf += data
+                if len(buf) > need:
+                    break
+            return 0
+
+        def _skip_ws(idx):
+            while True:
+                while idx < len(buf) and buf[idx] in ws:
+                    idx += 1
+                if idx < len(buf) or eof:
+                    return idx
+                idx = _fill(idx)
+
+        idx = _skip_ws(_fill(idx))
+        if idx >= len(buf) or buf[idx] != "[":
+            raise ValueError("'%s' is not a json array" % fn)
+        idx = _skip_ws(idx + 1)
+        if idx < len(buf) and buf[idx] == "]":
+            return
+
+        while True:
+            try:
+                (item, end) = decoder.raw_decode(buf, idx)
+                # a number at the end of buf may be incomplete
+                if end == len(buf) and not eof:
+                    raise json.JSONDecodeError("incomplete", buf, end)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # read in (at least) as much again as what we have of this
+                # item so large items don't need many attempts
+                idx = _fill(idx, 2 * (len(buf) - idx))
+                continue
+            yield item
+
+            idx = _skip_ws(end)
+            if idx >= len(buf):
+                raise ValueError("'%s' is not a json array (unterminated)" % fn)
+            if buf[idx] == "]":
+                return
+            if buf[idx] != ",":
+                raise ValueError(
+                    "'%s' is not a json array (unexpected '%s')" % (fn, buf[idx])
+                )
+            idx = _skip_ws(idx + 1)
+
+
+class YamlDuplicateKeyError(yaml.constructor.ConstructorError):
+    """This class represents duplicated map keys found by yaml_safe_load()"""
+
+
+class _YamlUniqueKeyLoader(YAML_SAFE_LOADER):
+    """YAML_SAFE_LOADER refusing duplicated map keys, which PyYAML otherwise
+    silently resolves by keeping the last value"""
+
+    def construct_mapping(self, node, deep=False):
+        if isinstance(node, yaml.MappingNode):
+            seen = set()
+            for key_node, _ in node.value:
+                # merged maps (<<: *anchor) may be overridden
+                if key_node.tag == "tag:yaml.org,2002:merge":
+                    continue
+                key = self.construct_object(key_node, deep=deep)
+                try:
+                    duplicate = key in seen
+                    seen.add(key)
+                except TypeError:
+                    # unhashable, reported by construct_mapping() below
+                    continue
+                if duplicate:
+                    raise YamlDuplicateKeyError(
+                        "while constructing a mapping",
+                        node.start_mark,
+                        'found duplicate key "%s"' % key,
+                        key_node.start_mark,
+                    )
+        return super().construct_mapping(node, deep=deep)
+
+
+def yaml_safe_load(stream, allow_duplicate_keys=True):
+    """Parse the yaml document in stream (a str, bytes or file) like
+    yaml.safe_load(), using libyaml when available. Unless
+    allow_duplicate_keys, duplicated map keys raise YamlDuplicateKeyError"""
+    loader = YAML_SAFE_LOADER
+    if not allow_duplicate_keys:
+        loader = _YamlUniqueKeyLoader
+    return yaml.load(stream, Loader=loader)
+
+
 def get_snap_manifest(fn):
     if "SNAP_USER_COMMON" in os.environ and os.path.exists(
         os.environ["SNAP_USER_COMMON"]
@@ -1376,20 +2349,32 @@ def get_snap_manifest(fn):
     man = "snap/manifest.yaml"
     os_dpkg = "usr/share/snappy/dpkg.list"
     snap_dpkg = "snap/dpkg.list"
-    # unpack_pkg() fails if this exists, so this is safe
-    dir = tempfile.mktemp(prefix=MKDTEMP_PREFIX, dir=MKDTEMP_DIR)
-    unpack_pkg(fn, dir, [man, os_dpkg, snap_dpkg])
+    # reuse the full unpack if the package is in the unpack cache, otherwise
+    # only unpack what is needed
+    cached = _unpack_cache_get(fn, populate=False)
+    if cached is not None:
+        dir = cached
+    else:
+        # unpack_pkg() fails if this exists, so this is safe
+        dir = tempfile.mktemp(prefix=MKDTEMP_PREFIX, dir=MKDTEMP_DIR)
+        unpack_pkg(fn, dir, [man, os_dpkg, snap_dpkg])
+
+    def _cleanup():
+        if cached is None:
+            recursive_rm(dir)
+        elif cached != UNPACK_DIR:
+            _unpack_cache_release(cached)
 
     man_fn = os.path.join(dir, man)
     if not os.path.isfile(man_fn):
-        recursive_rm(dir)
+        _cleanup()
         error("%s not in %s" % (man, fn))
 
     with open_file_read(man_fn) as fd:
         try:
-            man_yaml = yaml.safe_load(fd)
+            man_yaml = yaml_safe_load(fd)
         except Exception:
-            recursive_rm(dir)
+            _cleanup()
             error("Could not load %s. Is it properly formatted?" % man)
 
     os_dpkg_fn = os.path.join(dir, os_dpkg)
@@ -1400,17 +2385,17 @@ def get_snap_manifest(fn):
             try:
                 dpkg_list = fd.readlines()
             except Exception:
-                recursive_rm(dir)
+                _cleanup()
                 error("Could not load %s. Is it properly formatted?" % os_dpkg)
     elif os.path.isfile(snap_dpkg_fn):
         with open_file_read(snap_dpkg_fn) as fd:
             try:
                 dpkg_list = fd.readlines()
             except Exception:
-                recursive_rm(dir)
+                _cleanup()
                 error("Could not load %s. Is it properly formatted?" % snap_dpkg)
 
-    recursive_rm(dir)
+    _cleanup()
 
     return (man_yaml, dpkg_list)
 
@@ -1571,14 +2556,31 @@ def read_snapd_base_declaration():
         bd_fn = resource_filename(__name__, "data/snapd-base-declaration.yaml")
         if not os.path.exists(bd_fn):
             error("could not find '%s'" % bd_fn)
-    fd = open_file_read(bd_fn)
-    contents = fd.read()
-    fd.close()
 
-    bd_yaml = yaml.safe_load(contents)
+    # the parsed yaml is kept per file and mtime. Callers modify what we
+    # return (eg, to add in-progress interfaces), so hand out copies
+    global BASE_DECLARATION_CACHE
+    key = (os.path.abspath(bd_fn), os.stat(bd_fn).st_mtime_ns)
+    if key not in BASE_DECLARATION_CACHE:
+        fd = open_file_read(bd_fn)
+        contents = fd.read()
+        fd.close()
+
+        BASE_DECLARATION_CACHE = {key: yaml_safe_load(contents)}
+    bd_yaml = BASE_DECLARATION_CACHE[key]
+
     # FIXME: don't hardcode series
     series = "16"
-    return series, bd_yaml[series]
+    return series, copy.deepcopy(bd_yaml[series])
+
+
+def preload_review_state():
+    """Load what every review needs before looking at the package (libmagic
+       and the base declaration), so that a long-running process can share
+       it across reviews.
+    """
+    _magic_init()
+    read_snapd_base_declaration()
 
 
 # TODO: make this a class
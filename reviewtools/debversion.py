@@ -13,9 +13,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import functools
 import re
 import struct
 
+# The number of parsed versions kept by parse()
+DEBVERSION_CACHE_SIZE = 65536
+
 
 # reimplemented from lib/dpkg/version.c
 class DebVersion:
@@ -57,12 +61,49 @@ class DebVersion:
         #       (self.full_version, self.epoch, self.version, self.revision))
         self.validate()
 
+        # compare() is called a lot when checking USNs, so the comparable
+        # form of the version is computed once here
+        self._key = (self.epoch, _sort_key(self.version), _sort_key(self.revision))
+
     def __repr__(self):
         return self.full_version
 
     def __str__(self):
         return self.full_version
 
+    def __eq__(self, other):
+        if not isinstance(other, DebVersion):
+            return NotImplemented
+        return self._key == other._key
+
+    def __ne__(self, other):
+        if not isinstance(other, DebVersion):
+            return NotImplemented
+        return self._key != other._key
+
+    def __lt__(self, other):
+        if not isinstance(other, DebVersion):
+            return NotImplemented
+        return self._key < other._key
+
+    def __le__(self, other):
+        if not isinstance(other, DebVersion):
+            return NotImplemented
+        return self._key <= other._key
+
+    def __gt__(self, other):
+        if not isinstance(other, DebVersion):
+            return NotImplemented
+        return self._key > other._key
+
+    def __ge__(self, other):
+        if not isinstance(other, DebVersion):
+            return NotImplemented
+        return self._key >= other._key
+
+    def __hash__(self):
+        return hash(self._key)
+
     def validate(self):
         """Check a couple extra things not caught by valid_pat"""
         # https://www.debian.org/doc/debian-policy/#s-f-version
@@ -147,18 +188,34 @@ def _verrevcomp(a, b):
     return 0
 
 
-def compare(a, b):
-    # print("compare(%s, %s)" % (a.full_version, b.full_version))
-    # if epoch greater
-    if a.epoch > b.epoch:
-        return 1
-    elif a.epoch < b.epoch:
-        return -1
+_part_pat = re.compile(r"(\D*)(\d*)")
 
-    # if version greater
-    rc = _verrevcomp(a.version, b.version)
-    if rc != 0:
-        return rc
 
-    # if revision greater
-    return _verrevcomp(a.revision, b.revision)
+def _sort_key(s):
+    """Return a key of the version or revision s such that keys sort like
+       _verrevcomp() compares the strings: a (non-digit, digit) pair for each
+       part of s followed by an end marker. The orders of the non-digit
+       characters are followed by a 0 since anything ending there (a digit or
+       the end of s) sorts after '~' and before anything else.
+    """
+    key = []
+    for (nondigits, digits) in _part_pat.findall(s):
+        if nondigits or digits:
+            key.append((tuple(_order(c) for c in nondigits) + (0,), int(digits or "0")))
+    key.append(((0,), 0))
+    return tuple(key)
+
+
+def compare(a, b):
+    """Compare the Debian versions a and b, returning 0 if they are equal,
+       <0 if a is smaller than b and >0 if a is greater than b
+    """
+    return (a._key > b._key) - (a._key < b._key)
+
+
+@functools.lru_cache(maxsize=DEBVERSION_CACHE_SIZE)
+def parse(version):
+    """Return the DebVersion of version, reusing it if version was recently
+       parsed. The returned DebVersion is shared so must not be modified.
+    """
+    return DebVersion(version)
@@ -0,0 +1,724 @@
+# Copyright (C) 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Read the dynamic symbols of ELF files (.dynsym, .gnu.version,
+# .gnu.version_d and .gnu.version_r) without running nm. The results follow
+# 'nm --format=bsd --dynamic --defined-only --with-symbol-versions' as shipped
+# in the review-tools snap (binutils 2.30): symbol types are classified like
+# bfd_decode_symclass() and versions like _bfd_elf_get_symbol_version_string().
+#
+# Also read the PT_GNU_STACK program header without running execstack.
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import struct
+import subprocess
+import time
+
+from reviewtools.common import Timer, debug, warn
+
+ELF_MAGIC = b"\x7fELF"
+
+# e_ident
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+# object file types
+ET_EXEC = 2
+ET_DYN = 3
+
+# program header types and flags
+PT_GNU_STACK = 0x6474E551
+PF_X = 0x1
+PN_XNUM = 0xFFFF
+
+# section header types and flags
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+SHT_GNU_VERDEF = 0x6FFFFFFD
+SHT_GNU_VERNEED = 0x6FFFFFFE
+SHT_GNU_VERSYM = 0x6FFFFFFF
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+
+# special section indexes
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xFF00
+SHN_ABS = 0xFFF1
+SHN_COMMON = 0xFFF2
+SHN_XINDEX = 0xFFFF
+
+# symbol binding and types
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STB_WEAK = 2
+STB_GNU_UNIQUE = 10
+STT_OBJECT = 1
+STT_SECTION = 3
+STT_FILE = 4
+STT_COMMON = 5
+STT_GNU_IFUNC = 10
+
+VERSYM_HIDDEN = 0x8000
+VERSYM_VERSION = 0x7FFF
+
+# symbol type by section name prefix, in order (see coff_section_type() in
+# bfd/syms.c)
+_section_name_types = [
+    (".bss", "b"),
+    ("code", "t"),
+    (".data", "d"),
+    ("*DEBUG*", "N"),
+    (".debug", "N"),
+    (".drectve", "i"),
+    (".edata", "e"),
+    (".fini", "t"),
+    (".idata", "i"),
+    (".init", "t"),
+    (".pdata", "p"),
+    (".rdata", "r"),
+    (".rodata", "r"),
+    (".sbss", "s"),
+    (".scommon", "c"),
+    (".sdata", "g"),
+    (".text", "t"),
+    ("vars", "d"),
+    ("zerovars", "b"),
+]
+
+# section names bfd considers debugging sections
+_debug_section_prefixes = (".debug", ".gnu.linkonce.wi.", ".zdebug", ".line", ".stab")
+
+# (e_shoff, e_shentsize, e_shnum, e_shstrndx) from the ELF header, after
+# e_ident
+_ehdr_fmts = {
+    ELFCLASS32: "HHIIIIIHHHHHH",
+    ELFCLASS64: "HHIQQQIHHHHHH",
+}
+# (p_type, p_flags) from each program header
+_phdr_fmts = {
+    ELFCLASS32: "I20xI4x",
+    ELFCLASS64: "II48x",
+}
+# (sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link, sh_info,
+# ...)
+_shdr_fmts = {
+    ELFCLASS32: "IIIIIIIIII",
+    ELFCLASS64: "IIQQQQIIQQ",
+}
+
+# Bump this whenever the symbols returned by global_symbols() change (eg, how
+# they are read or demangled) so stale symbol cache entries are not used
+SYMBOL_CACHE_FORMAT = 1
+SYMBOL_CACHE_MAX_SIZE = 256  # in MB
+SYMBOL_CACHE_SCHEMA = """CREATE TABLE IF NOT EXISTS symbols (
+    sha256 TEXT NOT NULL PRIMARY KEY,
+    format INTEGER NOT NULL,
+    symbols TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used INTEGER NOT NULL
+) WITHOUT ROWID"""
+
+# names that might be demangled by c++filt (manglings start with '_' and are
+# made of these characters)
+_mangled_name_re = re.compile(r"^_[A-Za-z0-9_$.]+$")
+
+
+class ElfError(Exception):
+    """This class represents errors reading ELF files"""
+
+
+class _ElfSection(object):
+    __slots__ = ["name", "type", "flags", "offset", "size", "link", "info", "entsize"]
+
+    def __init__(self, name, type, flags, offset, size, link, info, entsize):
+        self.name = name
+        self.type = type
+        self.flags = flags
+        self.offset = offset
+        self.size = size
+        self.link = link
+        self.info = info
+        self.entsize = entsize
+
+
+def _cstr(data, offset):
+    """Return the NUL-terminated string at offset, like nm output it"""
+    if offset >= len(data):
+        raise ElfError("string offset %d out of range" % offset)
+    end = data.find(b"\0", offset)
+    if end < 0:
+        end = len(data)
+    # nm output was read with cmd(), which drops non-ascii characters
+    return data[offset:end].decode("ascii", "ignore")
+
+
+def _symbol_type(info, shndx, sections):
+    """Return the nm symbol type (see bfd_decode_symclass() in bfd/syms.c)"""
+    bind = info >> 4
+    typ = info & 0xF
+
+    if shndx == SHN_COMMON:
+        return "C"
+    if shndx == SHN_UNDEF:
+        if bind == STB_WEAK:
+            return "v" if typ in [STT_OBJECT, STT_COMMON] else "w"
+        return "U"
+    if typ == STT_GNU_IFUNC:
+        return "i"
+    if bind == STB_WEAK:
+        return "V" if typ in [STT_OBJECT, STT_COMMON] else "W"
+    if bind == STB_GNU_UNIQUE:
+        return "u"
+    if bind not in [STB_LOCAL, STB_GLOBAL]:
+        return "?"
+
+    # symbols in sections bfd doesn't know about are in the abs section
+    if shndx == SHN_ABS or shndx >= SHN_LORESERVE or shndx >= len(sections):
+        c = "a"
+    else:
+        c = _section_type(sections[shndx])
+
+    if bind == STB_GLOBAL:
+        c = c.upper()
+    return c
+
+
+def _section_type(section):
+    """Return the nm symbol type for symbols in section"""
+    for (prefix, c) in _section_name_types:
+        if section.name.startswith(prefix):
+            return c
+
+    # see decode_section_type() in bfd/syms.c and the mapping of section
+    # header flags in _bfd_elf_make_section_from_shdr() in bfd/elf.c
+    has_contents = section.type != SHT_NOBITS
+    if section.flags & SHF_EXECINSTR:
+        return "t"
+    if section.flags & SHF_ALLOC and has_contents:
+        if not section.flags & SHF_WRITE:
+            return "r"
+        return "d"
+    if not has_contents:
+        return "b"
+    if section.name.startswith(_debug_section_prefixes):
+        return "N"
+    if not section.flags & SHF_WRITE:
+        return "n"
+    return "?"
+
+
+class ElfFile(object):
+    """This class represents an ELF file opened for reading its dynamic
+       symbols.
+    """
+
+    def __init__(self, fn):
+        self.filename = fn
+        self._f = open(fn, "rb")
+        try:
+            self._size = os.fstat(self._f.fileno()).st_size
+            self._read_sections()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _read(self, offset, size):
+        # offsets and sizes come from the file, so check them before seeking
+        # or allocating anything
+        if offset + size > self._size:
+            raise ElfError("truncated ELF file '%s'" % self.filename)
+        self._f.seek(offset)
+        data = self._f.read(size)
+        if len(data) != size:
+            raise ElfError("truncated ELF file '%s'" % self.filename)
+        return data
+
+    def _read_section(self, section):
+        if section.type == SHT_NOBITS:
+            return b""
+        return self._read(section.offset, section.size)
+
+    def _read_sections(self):
+        ident = self._f.read(16)
+        if len(ident) != 16 or not ident.startswith(ELF_MAGIC):
+            raise ElfError("'%s' is not an ELF file" % self.filename)
+        eclass = ident[4]
+        if eclass not in _ehdr_fmts or ident[5] not in [ELFDATA2LSB, ELFDATA2MSB]:
+            raise ElfError("unsupported ELF file '%s'" % self.filename)
+        self._eclass = eclass
+        self._endian = "<" if ident[5] == ELFDATA2LSB else ">"
+
+        ehdr = struct.Struct(self._endian + _ehdr_fmts[eclass])
+        (shoff, shentsize, shnum, shstrndx) = [
+            ehdr.unpack(self._read(16, ehdr.size))[i] for i in [5, 10, 11, 12]
+        ]
+
+        self.sections = []
+        if shoff == 0:
+            return
+        shdr = struct.Struct(self._endian + _shdr_fmts[eclass])
+        if shentsize < shdr.size:
+            raise ElfError("bad section header size in '%s'" % self.filename)
+
+        def _shdr(idx):
+            return shdr.unpack(self._read(shoff + idx * shentsize, shdr.size))
+
+        # large section counts and indexes are stored in the first header
+        first = _shdr(0)
+        if shnum == 0:
+            shnum = first[5]
+        if shstrndx == SHN_XINDEX:
+            shstrndx = first[6]
+        if shoff + shnum * shentsize > self._size:
+            raise ElfError("bad section header count in '%s'" % self.filename)
+
+        hdrs = [first] + [_shdr(i) for i in range(1, shnum)]
+        for (name, typ, flags, addr, offset, size, link, info, _, entsize) in hdrs:
+            self.sections.append(
+                _ElfSection(name, typ, flags, offset, size, link, info, entsize)
+            )
+
+        names = b""
+        if shstrndx < len(self.sections):
+            names = self._read_section(self.sections[shstrndx])
+        for section in self.sections:
+            section.name = _cstr(names, section.name) if names else ""
+
+    def _find_section(self, typ):
+        for section in self.sections:
+            if section.type == typ:
+                return section
+        return None
+
+    def _read_strtab(self, section):
+        if section.link >= len(self.sections):
+            raise ElfError("bad string table index in '%s'" % self.filename)
+        return self._read_section(self.sections[section.link])
+
+    def _read_verdefs(self):
+        """Return the version definition names by version index"""
+        verdefs = {}
+        section = self._find_section(SHT_GNU_VERDEF)
+        if section is None:
+            return verdefs
+        data = self._read_section(section)
+        strtab = self._read_strtab(section)
+        verdef = struct.Struct(self._endian + "HHHHIII")
+        verdaux = struct.Struct(self._endian + "II")
+
+        # sh_info is the number of entries
+        offset = 0
+        for i in range(section.info):
+            if offset + verdef.size > len(data):
+                break
+            (version, flags, ndx, cnt, hash, aux, next) = verdef.unpack_from(
+                data, offset
+            )
+            if cnt > 0 and offset + aux + verdaux.size <= len(data):
+                verdefs[ndx] = _cstr(strtab, verdaux.unpack_from(data, offset + aux)[0])
+            if next == 0:
+                break
+            offset += next
+        return verdefs
+
+    def _read_verneeds(self):
+        """Return the needed version names by version index"""
+        verneeds = {}
+        section = self._find_section(SHT_GNU_VERNEED)
+        if section is None:
+            return verneeds
+        data = self._read_section(section)
+        strtab = self._read_strtab(section)
+        verneed = struct.Struct(self._endian + "HHIII")
+        vernaux = struct.Struct(self._endian + "IHHII")
+
+        # sh_info is the number of entries
+        offset = 0
+        for i in range(section.info):
+            if offset + verneed.size > len(data):
+                break
+            (version, cnt, file, aux, next) = verneed.unpack_from(data, offset)
+            aux_offset = offset + aux
+            for j in range(cnt):
+                if aux_offset + vernaux.size > len(data):
+                    break
+                (hash, flags, other, name, aux_next) = vernaux.unpack_from(
+                    data, aux_offset
+                )
+                if other not in verneeds:
+                    verneeds[other] = _cstr(strtab, name)
+                if aux_next == 0:
+                    break
+                aux_offset += aux_next
+            if next == 0:
+                break
+            offset += next
+        return verneeds
+
+    def dynamic_symbols(self):
+        """Return the defined dynamic symbols as a list of (name, type,
+           version) sorted by name, where version is '@@<version>',
+           '@<version>' for hidden versions or ''.
+        """
+        dynsym = self._find_section(SHT_DYNSYM)
+        if dynsym is None:
+            return []
+
+        if self._eclass == ELFCLASS64:
+            sym = struct.Struct(self._endian + "IBBHQQ")
+            (name_idx, info_idx, shndx_idx) = (0, 1, 3)
+        else:
+            sym = struct.Struct(self._endian + "IIIBBH")
+            (name_idx, info_idx, shndx_idx) = (0, 3, 5)
+        # like bfd_section_from_shdr(), reject tables with other entry sizes
+        if dynsym.entsize != sym.size:
+            raise ElfError("bad symbol table entry size in '%s'" % self.filename)
+        data = self._read_section(dynsym)
+        strtab = self._read_strtab(dynsym)
+        count = len(data) // sym.size
+
+        versyms = None
+        verdefs = {}
+        verneeds = {}
+        versym = self._find_section(SHT_GNU_VERSYM)
+        if versym is not None and (
+            self._find_section(SHT_GNU_VERDEF) is not None
+            or self._find_section(SHT_GNU_VERNEED) is not None
+        ):
+            if versym.entsize != 2:
+                raise ElfError("bad version table entry size in '%s'" % self.filename)
+            versym_data = self._read_section(versym)
+            versyms = struct.unpack_from(
+                "%s%dH" % (self._endian, min(count, len(versym_data) // 2)),
+                versym_data,
+            )
+            verdefs = self._read_verdefs()
+            verneeds = self._read_verneeds()
+        max_verdef = max(verdefs) if verdefs else 0
+
+        symbols = []
+        # the first symbol is a null dummy
+        for i in range(1, count):
+            fields = sym.unpack_from(data, i * sym.size)
+            info = fields[info_idx]
+            shndx = fields[shndx_idx]
+            # skip undefined and debugging symbols
+            if shndx == SHN_UNDEF or (info & 0xF) in [STT_SECTION, STT_FILE]:
+                continue
+
+            version = ""
+            if versyms is not None and i < len(versyms):
+                vernum = versyms[i] & VERSYM_VERSION
+                if vernum == 1:
+                    version = "Base"
+                elif vernum > 1 and vernum <= max_verdef:
+                    version = verdefs.get(vernum, "")
+                elif vernum > 1:
+                    version = verneeds.get(vernum, "")
+                if version != "":
+                    at = "@" if versyms[i] & VERSYM_HIDDEN else "@@"
+                    version = at + version
+
+            symbols.append(
+                (
+                    _cstr(strtab, fields[name_idx]),
+                    _symbol_type(info, shndx, self.sections),
+                    version,
+                )
+            )
+
+        # nm sorts by (mangled) name, keeping the symbol table order otherwise
+        symbols.sort(key=lambda s: s[0])
+        return symbols
+
+
+def read_dynamic_symbols(fn):
+    """Return the defined dynamic symbols of the ELF file fn (see
+       ElfFile.dynamic_symbols())
+    """
+    with ElfFile(fn) as elf:
+        return elf.dynamic_symbols()
+
+
+def has_execstack(fn):
+    """Return whether fn is an executable or shared object with an executable
+       PT_GNU_STACK segment, like 'execstack -q' reporting 'X'. Objects
+       without PT_GNU_STACK are reported as not having an executable stack,
+       like execstack's '?'. Raises ElfError if fn is not a valid ELF file.
+    """
+    with open(fn, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+
+        def _read(offset, size):
+            # offsets and sizes come from the file, so check them before
+            # seeking or allocating anything
+            if offset + size > file_size:
+                raise ElfError("truncated ELF file '%s'" % fn)
+            f.seek(offset)
+            data = f.read(size)
+            if len(data) != size:
+                raise ElfError("truncated ELF file '%s'" % fn)
+            return data
+
+        ident = f.read(16)
+        if len(ident) != 16 or not ident.startswith(ELF_MAGIC):
+            raise ElfError("'%s' is not an ELF file" % fn)
+        eclass = ident[4]
+        if eclass not in _ehdr_fmts or ident[5] not in [ELFDATA2LSB, ELFDATA2MSB]:
+            raise ElfError("unsupported ELF file '%s'" % fn)
+        endian = "<" if ident[5] == ELFDATA2LSB else ">"
+
+        ehdr = struct.Struct(endian + _ehdr_fmts[eclass])
+        (etype, phoff, shoff, phentsize, phnum) = [
+            ehdr.unpack(_read(16, ehdr.size))[i] for i in [0, 4, 5, 8, 9]
+        ]
+        # execstack only handles executables and shared objects
+        if etype not in [ET_EXEC, ET_DYN] or phoff == 0:
+            return False
+
+        phdr = struct.Struct(endian + _phdr_fmts[eclass])
+        # the program header size is fixed by the class
+        if phentsize != phdr.size:
+            raise ElfError("bad program header size in '%s'" % fn)
+
+        # large program header counts are stored in the first section header
+        if phnum == PN_XNUM:
+            if shoff == 0:
+                raise ElfError("bad program header count in '%s'" % fn)
+            shdr = struct.Struct(endian + _shdr_fmts[eclass])
+            phnum = shdr.unpack(_read(shoff, shdr.size))[7]
+
+        phdrs = _read(phoff, phnum * phentsize)
+        for idx in range(phnum):
+            (typ, flags) = phdr.unpack_from(phdrs, idx * phentsize)
+            if typ == PT_GNU_STACK:
+                return bool(flags & PF_X)
+    return False
+
+
+def demangle(names):
+    """Demangle names with a single c++filt, like nm --demangle. Returns a
+       dict of the names that changed.
+    """
+    mangled = sorted(set(n for n in names if _mangled_name_re.match(n)))
+    if len(mangled) == 0:
+        return {}
+
+    # -i: like nm, don't show implementation details
+    try:
+        with Timer("cmd", "c++filt", {"argv": ["c++filt", "-i"]}):
+            sp = subprocess.run(
+                ["c++filt", "-i"],
+                input="\n".join(mangled).encode("ascii"),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+    except OSError as e:
+        raise ElfError("could not run c++filt: %s" % e)
+    out = sp.stdout.decode("ascii", "ignore").split("\n")
+    if sp.returncode != 0 or len(out) < len(mangled):
+        raise ElfError("c++filt failed: %s" % sp.stderr.decode("ascii", "ignore"))
+
+    return dict((m, d) for (m, d) in zip(mangled, out) if m != d)
+
+
+def global_symbols(dynamic_symbols):
+    """Take a dict of filenames to their dynamic symbols (see
+       read_dynamic_symbols()) and return a dict of filenames to the
+       {symbol: {"type": ..., "version": ...}} of their global symbols,
+       demangled. All the files are demangled together.
+    """
+    demangled = demangle(
+        name
+        for symbols in dynamic_symbols.values()
+        for (name, symbol_type, version) in symbols
+    )
+
+    res = {}
+    for fn in dynamic_symbols:
+        symbols = {}
+        for (name, symbol_type, version) in dynamic_symbols[fn]:
+            # quick check if global symbols (uppercase and special global 'u',
+            # 'v', 'w' (note, defined only should remove u, v and w))
+            if not symbol_type.isupper() and symbol_type not in ["u", "v", "w"]:
+                continue
+            # skipped symbols:
+            # * N - debugging
+            # * U - undefined (note, defined only should handle this)
+            if symbol_type in ["N", "U"]:
+                continue
+            # ???: filter out @@GLIBC_PRIVATE?
+            symbol = demangled.get(name, name)
+            if symbol not in symbols:
+                symbols[symbol] = {"type": symbol_type, "version": version}
+        res[fn] = symbols
+    return res
+
+
+class SymbolCache(object):
+    """This class represents the on-disk cache of the global symbols (see
+       global_symbols()) of ELF files, keyed by the sha256 of the file. The
+       least recently used entries are evicted on close() to keep the cache
+       under max_size bytes.
+    """
+
+    def __init__(self, fn, max_size=SYMBOL_CACHE_MAX_SIZE * 1024 * 1024):
+        self.filename = fn
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._used = set()
+        self._new = {}
+
+        self._conn = sqlite3.connect(fn, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(SYMBOL_CACHE_SCHEMA)
+            self._conn.execute(
+                "DELETE FROM symbols WHERE format != ?", (SYMBOL_CACHE_FORMAT,)
+            )
+
+    def get(self, sha256):
+        """Return the cached symbols for sha256 or None"""
+        try:
+            row = self._conn.execute(
+                "SELECT symbols FROM symbols WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            warn("Could not read symbol cache '%s': %s" % (self.filename, e))
+            row = None
+        symbols = None
+        if row is not None:
+            try:
+                symbols = json.loads(row[0])
+            except ValueError as e:
+                warn("Corrupt entry in symbol cache '%s': %s" % (self.filename, e))
+        if symbols is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used.add(sha256)
+        return symbols
+
+    def put(self, sha256, symbols):
+        """Cache the symbols for sha256. The cache is updated on close()"""
+        self._new[sha256] = json.dumps(symbols, separators=(",", ":"))
+
+    def _evict(self):
+        """Remove the least recently used entries above max_size"""
+        total = 0
+        evict = []
+        for (sha256, size) in self._conn.execute(
+            "SELECT sha256, size FROM symbols ORDER BY last_used DESC, sha256"
+        ):
+            total += size
+            if total > self.max_size:
+                evict.append((sha256,))
+        if len(evict) > 0:
+            debug("Evicting %d entries from '%s'" % (len(evict), self.filename))
+            self._conn.executemany("DELETE FROM symbols WHERE sha256 = ?", evict)
+
+    def close(self):
+        """Write the new entries, record which entries were used, evict and
+           close the cache
+        """
+        (count, size) = (0, 0)
+        now = int(time.time())
+        try:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO symbols "
+                    "(sha256, format, symbols, size, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (sha256, SYMBOL_CACHE_FORMAT, data, len(data), now)
+                        for (sha256, data) in self._new.items()
+                    ],
+                )
+                self._conn.executemany(
+                    "UPDATE symbols SET last_used = ? WHERE sha256 = ?",
+                    [(now, sha256) for sha256 in self._used],
+                )
+                self._evict()
+            (count, size) = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM symbols"
+            ).fetchone()
+        except sqlite3.Error as e:
+            warn("Could not update symbol cache '%s': %s" % (self.filename, e))
+        self._conn.close()
+
+        lookups = self.hits + self.misses
+        debug(
+            "Symbol cache '%s': %d hits, %d misses (%d%% hit rate), "
+            "%d entries (%dK)"
+            % (
+                self.filename,
+                self.hits,
+                self.misses,
+                self.hits * 100 // lookups if lookups else 0,
+                count,
+                size // 1024,
+            )
+        )
+
+
+def open_symbol_cache():
+    """Open the symbol cache named by RT_SYMBOL_CACHE. Returns None if the
+       symbol cache is disabled or can't be opened.
+    """
+    if "RT_SYMBOL_CACHE" not in os.environ or os.environ["RT_SYMBOL_CACHE"] == "":
+        return None
+    fn = os.environ["RT_SYMBOL_CACHE"]
+
+    max_size = SYMBOL_CACHE_MAX_SIZE
+    if "RT_SYMBOL_CACHE_MAX_SIZE" in os.environ:
+        try:
+            max_size = int(os.environ["RT_SYMBOL_CACHE_MAX_SIZE"])
+        except ValueError:
+            warn(
+                "Ignoring RT_SYMBOL_CACHE_MAX_SIZE (not an integer: '%s')"
+                % os.environ["RT_SYMBOL_CACHE_MAX_SIZE"]
+            )
+
+    try:
+        return SymbolCache(fn, max_size * 1024 * 1024)
+    except sqlite3.Error as e:
+        warn("Could not open symbol cache '%s': %s" % (fn, e))
+        return None
+
+
+def sha256sum(fn):
+    """Get sha256sum of file"""
+    h = hashlib.sha256()
+    with open(fn, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
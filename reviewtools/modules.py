@@ -1,4 +1,5 @@
 import reviewtools
+from reviewtools.common import Timer
 import imp
 import inspect
 import os
@@ -6,6 +7,9 @@ import pkgutil
 
 IRRELEVANT_MODULES = ["sr_common", "sr_tests", "sr_skeleton", "common"]
 
+# main class of each loaded module (see find_main_class())
+MAIN_CLASSES = {}
+
 
 def narrow_down_modules(modules):
     """
@@ -47,6 +51,10 @@ def find_main_class(module_name):
     This function will find the Snap*Review class in
     the specified module.
     """
+    # only load each module once per process
+    if module_name in MAIN_CLASSES:
+        return MAIN_CLASSES[module_name]
+
     module = None
     # Search the different reviewtools.__path__ directories, loading the first
     # match (get_modules(), above, appends to reviewtools.__path__ so we can
@@ -74,24 +82,38 @@ def find_main_class(module_name):
         )
 
     test_class = list(filter(find_test_class, classes))
-    if not test_class:
-        return None
-    init_object = getattr(module, test_class[0][0])
+    init_object = None
+    if test_class:
+        init_object = getattr(module, test_class[0][0])
+    MAIN_CLASSES[module_name] = init_object
     return init_object
 
 
-def init_main_class(module_name, pkg_file, overrides=None, report_type=None):
+def init_main_class(
+    module_name, pkg_file, overrides=None, report_type=None, context=None
+):
     """
     This function will instantiate the main Snap*Review
     class of a given module and instantiate it with the
     location of the file we want to inspect.
+
+    The optional context (a SnapReviewContext) is shared
+    with the other modules reviewing the same package, for
+    classes that accept it.
     """
 
     init_object = find_main_class(module_name)
     if not init_object:
         return None
     try:
-        ob = init_object(pkg_file, overrides)
+        with Timer("init", module_name):
+            if (
+                context is not None
+                and "context" in inspect.signature(init_object).parameters
+            ):
+                ob = init_object(pkg_file, overrides, context=context)
+            else:
+                ob = init_object(pkg_file, overrides)
         # set the report_type separately since it is in the common class
         ob.set_report_type(report_type)
     except TypeError as e:
@@ -0,0 +1,1026 @@
+# Copyright (C) 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Read-only access to the metadata of squashfs 4.0 images (superblock, id,
+# inode and directory tables) without running unsquashfs, and verification
+# that an image is what mksquashfs would recreate from its contents (see
+# verify_resquash()). See squashfs-tools/squashfs_fs.h for the on-disk format.
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import lzma
+import os
+import stat
+import struct
+import zlib
+
+SQUASHFS_MAGIC = b"hsqs"
+SQUASHFS_METADATA_SIZE = 8192
+# walk() refuses images with more entries than this (far more than any snap
+# has) so that crafted directory tables can't keep it busy
+SQUASHFS_MAX_ENTRIES = 1 << 24
+# the mksquashfs default
+SQUASHFS_BLOCK_SIZE = 131072
+
+SQUASHFS_COMPRESSED_BIT = 1 << 15
+SQUASHFS_COMPRESSED_BIT_BLOCK = 1 << 24
+SQUASHFS_INVALID_FRAG = 0xFFFFFFFF
+SQUASHFS_INVALID_XATTR = 0xFFFFFFFF
+SQUASHFS_INVALID_BLK = 0xFFFFFFFFFFFFFFFF
+
+# superblock flags
+SQUASHFS_NO_FRAG = 0x10
+SQUASHFS_DUPLICATE = 0x40
+SQUASHFS_EXPORT = 0x80
+SQUASHFS_NO_XATTR = 0x200
+
+# compression ids
+SQUASHFS_COMPRESSION = {
+    1: "gzip",
+    2: "lzma",
+    3: "lzo",
+    4: "xz",
+    5: "lz4",
+    6: "zstd",
+}
+
+# inode types (basic and extended)
+SQUASHFS_DIR_TYPE = 1
+SQUASHFS_REG_TYPE = 2
+SQUASHFS_SYMLINK_TYPE = 3
+SQUASHFS_BLKDEV_TYPE = 4
+SQUASHFS_CHRDEV_TYPE = 5
+SQUASHFS_FIFO_TYPE = 6
+SQUASHFS_SOCKET_TYPE = 7
+SQUASHFS_LDIR_TYPE = 8
+SQUASHFS_LREG_TYPE = 9
+SQUASHFS_LSYMLINK_TYPE = 10
+SQUASHFS_LBLKDEV_TYPE = 11
+SQUASHFS_LCHRDEV_TYPE = 12
+SQUASHFS_LFIFO_TYPE = 13
+SQUASHFS_LSOCKET_TYPE = 14
+
+squashfs_inode_ifmt = {
+    SQUASHFS_DIR_TYPE: stat.S_IFDIR,
+    SQUASHFS_REG_TYPE: stat.S_IFREG,
+    SQUASHFS_SYMLINK_TYPE: stat.S_IFLNK,
+    SQUASHFS_BLKDEV_TYPE: stat.S_IFBLK,
+    SQUASHFS_CHRDEV_TYPE: stat.S_IFCHR,
+    SQUASHFS_FIFO_TYPE: stat.S_IFIFO,
+    SQUASHFS_SOCKET_TYPE: stat.S_IFSOCK,
+    SQUASHFS_LDIR_TYPE: stat.S_IFDIR,
+    SQUASHFS_LREG_TYPE: stat.S_IFREG,
+    SQUASHFS_LSYMLINK_TYPE: stat.S_IFLNK,
+    SQUASHFS_LBLKDEV_TYPE: stat.S_IFBLK,
+    SQUASHFS_LCHRDEV_TYPE: stat.S_IFCHR,
+    SQUASHFS_LFIFO_TYPE: stat.S_IFIFO,
+    SQUASHFS_LSOCKET_TYPE: stat.S_IFSOCK,
+}
+
+_superblock_fmt = struct.Struct("<4sIIIIHHHHHHQQQQQQQQ")
+_inode_header_fmt = struct.Struct("<HHHHII")
+_dir_header_fmt = struct.Struct("<III")
+_dir_entry_fmt = struct.Struct("<HhHH")
+
+
+def _decompress_lzma(data, size):
+    return lzma.LZMADecompressor(format=lzma.FORMAT_ALONE).decompress(data, size)
+
+
+def _decompress_xz(data, size):
+    return lzma.LZMADecompressor(format=lzma.FORMAT_XZ).decompress(data, size)
+
+
+def _decompress_gzip(data, size):
+    return zlib.decompressobj().decompress(data, size)
+
+
+squashfs_decompressors = {
+    "gzip": _decompress_gzip,
+    "lzma": _decompress_lzma,
+    "xz": _decompress_xz,
+}
+
+
+def _xz_vli(n):
+    """Encode n as an xz variable-length integer"""
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _lzma2_dict_size(props):
+    """Return the dictionary size of the LZMA2 properties byte"""
+    return (2 | (props & 1)) << (props // 2 + 11)
+
+
+def _compress_xz(data, dict_size):
+    """Compress data like the squashfs-tools xz compressor, which uses
+       lzma_stream_buffer_encode(): a single block stream with a CRC32 check
+       whose block header has the compressed and uncompressed sizes (the
+       header size is that of the worst case LZMA2 compressed size)
+    """
+    raw = lzma.compress(
+        data,
+        format=lzma.FORMAT_RAW,
+        filters=[{"id": lzma.FILTER_LZMA2, "preset": 6, "dict_size": dict_size}],
+    )
+    size = len(data)
+    bound = size + ((size + 0xFFFF) >> 16) * 3 + 1
+
+    # the LZMA2 dictionary size is rounded up to 2^n or 2^n + 2^(n-1)
+    dict_props = 0
+    while dict_props < 40 and _lzma2_dict_size(dict_props) < dict_size:
+        dict_props += 1
+    header_size = (6 + len(_xz_vli(bound)) + len(_xz_vli(size)) + 3 + 3) & ~3
+    header = (
+        bytes([header_size // 4 - 1, 0xC0])
+        + _xz_vli(len(raw))
+        + _xz_vli(size)
+        + bytes([0x21, 1, dict_props])
+    ).ljust(header_size - 4, b"\0")
+    header += struct.pack("<I", zlib.crc32(header))
+
+    index = b"\0" + _xz_vli(1) + _xz_vli(header_size + len(raw) + 4) + _xz_vli(size)
+    index += b"\0" * (-len(index) % 4)
+    index += struct.pack("<I", zlib.crc32(index))
+
+    flags = b"\0\x01"
+    footer = struct.pack("<I", len(index) // 4 - 1) + flags
+    return b"".join(
+        [
+            b"\xfd7zXZ\0",
+            flags,
+            struct.pack("<I", zlib.crc32(flags)),
+            header,
+            raw,
+            b"\0" * (-len(raw) % 4),
+            struct.pack("<I", zlib.crc32(data)),
+            index,
+            struct.pack("<I", zlib.crc32(footer)),
+            footer,
+            b"YZ",
+        ]
+    )
+
+
+def _compress_gzip(data, dict_size):
+    """Compress data like the squashfs-tools gzip compressor (level 9, 32K
+       window)
+    """
+    return zlib.compress(data, 9)
+
+
+# only the compressors whose squashfs-tools output can be reproduced
+squashfs_compressors = {
+    "gzip": _compress_gzip,
+    "xz": _compress_xz,
+}
+
+# lzo and zstd are not in the standard library, so only use them if the
+# python3-lzo or python3-zstandard modules happen to be installed
+try:
+    import lzo
+
+    def _decompress_lzo(data, size):
+        return lzo.decompress(data, False, size)
+
+    squashfs_decompressors["lzo"] = _decompress_lzo
+except ImportError:  # pragma: nocover
+    pass
+
+try:
+    import zstandard
+
+    def _decompress_zstd(data, size):
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+
+    squashfs_decompressors["zstd"] = _decompress_zstd
+except ImportError:  # pragma: nocover
+    pass
+
+
+class SquashfsError(Exception):
+    """This class represents errors reading squashfs images"""
+
+
+class SquashfsInode(object):
+    """This class represents a squashfs inode"""
+
+    __slots__ = (
+        "mode",
+        "uid",
+        "gid",
+        "mtime",
+        "size",
+        "rdev",
+        "target",
+        "_dir",
+        "_file",
+    )
+
+    def __init__(self, mode, uid, gid, mtime):
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.mtime = mtime
+        # unsquashfs reports the file, directory or symlink target size
+        self.size = 0
+        self.rdev = 0
+        self.target = None
+        # (block, offset, size) of the directory listing
+        self._dir = None
+        # (start block, fragment, position, offset) of a regular file, where
+        # the position and offset are those of its block list
+        self._file = None
+
+
+class SquashfsImage(object):
+    """This class represents a squashfs 4.0 image. Only the metadata
+       (superblock, ids, inodes and directories) is read.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self._fh = open(fn, "rb")
+        self._blocks = {}
+        try:
+            self._read_superblock()
+            self._read_id_table()
+        except Exception:
+            self._fh.close()
+            raise
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _read_superblock(self):
+        """Read and verify the superblock"""
+        buf = self._fh.read(_superblock_fmt.size)
+        if len(buf) != _superblock_fmt.size or not buf.startswith(SQUASHFS_MAGIC):
+            raise SquashfsError("'%s' is not a squashfs image" % self.fn)
+        self.superblock = buf
+
+        (
+            _,
+            self.inode_count,
+            self.mkfs_time,
+            self.block_size,
+            self.fragments,
+            compression_id,
+            self.block_log,
+            self.flags,
+            self.id_count,
+            major,
+            minor,
+            self.root_inode,
+            self.bytes_used,
+            self.id_table_start,
+            self.xattr_id_table_start,
+            self.inode_table_start,
+            self.directory_table_start,
+            self.fragment_table_start,
+            self.lookup_table_start,
+        ) = _superblock_fmt.unpack(buf)
+
+        if (major, minor) != (4, 0):
+            raise SquashfsError(
+                "unsupported squashfs version %d.%d in '%s'" % (major, minor, self.fn)
+            )
+        if self.bytes_used > os.fstat(self._fh.fileno()).st_size:
+            raise SquashfsError("truncated squashfs image '%s'" % self.fn)
+
+        if compression_id not in SQUASHFS_COMPRESSION:
+            raise SquashfsError(
+                "unknown compression id %d in '%s'" % (compression_id, self.fn)
+            )
+        self.compression = SQUASHFS_COMPRESSION[compression_id]
+        if self.compression not in squashfs_decompressors:
+            raise SquashfsError(
+                "unsupported compression '%s' in '%s'" % (self.compression, self.fn)
+            )
+        self._decompress = squashfs_decompressors[self.compression]
+
+    def _read_metadata_block(self, pos):
+        """Read the metadata block at pos, returning its data and the position
+           of the next block
+        """
+        if pos not in self._blocks:
+            if pos >= self.bytes_used:
+                raise SquashfsError("metadata block beyond end of '%s'" % self.fn)
+            self._fh.seek(pos)
+            buf = self._fh.read(2)
+            if len(buf) != 2:
+                raise SquashfsError("metadata block beyond end of '%s'" % self.fn)
+            (hdr,) = struct.unpack("<H", buf)
+            size = hdr & 0x7FFF
+            data = self._fh.read(size)
+            if len(data) != size:
+                raise SquashfsError("truncated metadata block in '%s'" % self.fn)
+            if not hdr & 0x8000:
+                try:
+                    data = self._decompress(data, SQUASHFS_METADATA_SIZE)
+                except Exception as e:
+                    raise SquashfsError(
+                        "could not decompress metadata block in '%s': %s" % (self.fn, e)
+                    )
+            self._blocks[pos] = (data, pos + 2 + size)
+        return self._blocks[pos]
+
+    def _read_metadata(self, pos, offset, length):
+        """Read length bytes of metadata starting at offset in the block at
+           pos, returning the data and the position and offset following it
+        """
+        chunks = []
+        while length > 0:
+            (data, next_pos) = self._read_metadata_block(pos)
+            chunk = data[offset : offset + length]
+            if len(chunk) == 0:
+                raise SquashfsError("metadata read beyond block in '%s'" % self.fn)
+            chunks.append(chunk)
+            length -= len(chunk)
+            offset += len(chunk)
+            if offset >= len(data):
+                (pos, offset) = (next_pos, 0)
+        return b"".join(chunks), pos, offset
+
+    def _read_id_table(self):
+        """Read the uid/gid lookup table"""
+        size = self.id_count * 4
+        nblocks = (size + SQUASHFS_METADATA_SIZE - 1) // SQUASHFS_METADATA_SIZE
+        if self.id_table_start >= self.bytes_used:
+            raise SquashfsError("id table beyond end of '%s'" % self.fn)
+        self._fh.seek(self.id_table_start)
+        buf = self._fh.read(nblocks * 8)
+        if len(buf) != nblocks * 8:
+            raise SquashfsError("truncated id table in '%s'" % self.fn)
+
+        ids = b""
+        for pos in struct.unpack("<%dQ" % nblocks, buf):
+            ids += self._read_metadata_block(pos)[0]
+        if len(ids) < size:
+            raise SquashfsError("truncated id table in '%s'" % self.fn)
+        self.ids = struct.unpack_from("<%dI" % self.id_count, ids)
+
+    def _get_id(self, idx):
+        if idx >= len(self.ids):
+            raise SquashfsError("invalid id index %d in '%s'" % (idx, self.fn))
+        return self.ids[idx]
+
+    def read_inode(self, ref):
+        """Read the inode with the given inode reference"""
+        pos = self.inode_table_start + (ref >> 16)
+        offset = ref & 0xFFFF
+
+        def _read(fmt):
+            nonlocal pos, offset
+            (buf, pos, offset) = self._read_metadata(pos, offset, struct.calcsize(fmt))
+            return struct.unpack(fmt, buf)
+
+        (itype, perms, uid_idx, gid_idx, mtime, _) = _read(_inode_header_fmt.format)
+        if itype not in squashfs_inode_ifmt:
+            raise SquashfsError("unknown inode type %d in '%s'" % (itype, self.fn))
+        inode = SquashfsInode(
+            squashfs_inode_ifmt[itype] | (perms & 0o7777),
+            self._get_id(uid_idx),
+            self._get_id(gid_idx),
+            mtime,
+        )
+
+        if itype == SQUASHFS_DIR_TYPE:
+            (block, _, size, dir_offset, _) = _read("<IIHHI")
+            inode._dir = (block, dir_offset, size)
+            inode.size = size
+        elif itype == SQUASHFS_LDIR_TYPE:
+            (_, size, block, _, _, dir_offset, _) = _read("<IIIIHHI")
+            inode._dir = (block, dir_offset, size)
+            inode.size = size
+        elif itype == SQUASHFS_REG_TYPE:
+            (block, fragment, _, inode.size) = _read("<IIII")
+            inode._file = (block, fragment, pos, offset)
+        elif itype == SQUASHFS_LREG_TYPE:
+            (block, inode.size, _, _, fragment, _, _) = _read("<QQQIIII")
+            inode._file = (block, fragment, pos, offset)
+        elif itype in [SQUASHFS_SYMLINK_TYPE, SQUASHFS_LSYMLINK_TYPE]:
+            (_, inode.size) = _read("<II")
+            (buf, pos, offset) = self._read_metadata(pos, offset, inode.size)
+            inode.target = buf.decode("utf-8", errors="surrogateescape")
+        elif itype in [
+            SQUASHFS_BLKDEV_TYPE,
+            SQUASHFS_CHRDEV_TYPE,
+            SQUASHFS_LBLKDEV_TYPE,
+            SQUASHFS_LCHRDEV_TYPE,
+        ]:
+            (_, inode.rdev) = _read("<II")
+
+        return inode
+
+    def read_blocks(self, inode):
+        """Return the start block and the block list (the on-disk size of
+           each data block) of a regular file inode
+        """
+        (block, fragment, pos, offset) = inode._file
+        if fragment == SQUASHFS_INVALID_FRAG:
+            count = (inode.size + self.block_size - 1) // self.block_size
+        else:
+            count = inode.size // self.block_size
+        (buf, _, _) = self._read_metadata(pos, offset, count * 4)
+        return block, struct.unpack("<%dI" % count, buf)
+
+    def read_dir(self, inode):
+        """Return the (name, inode reference) entries of a directory inode,
+           in on-disk (sorted) order
+        """
+        entries = []
+        (block, offset, size) = inode._dir
+        # the stored size includes the (not stored) '.' and '..' entries
+        if size <= 3:
+            return entries
+
+        pos = self.directory_table_start + block
+        (buf, _, _) = self._read_metadata(pos, offset, size - 3)
+        idx = 0
+        try:
+            while idx < len(buf):
+                (count, start, _) = _dir_header_fmt.unpack_from(buf, idx)
+                idx += _dir_header_fmt.size
+                for i in range(count + 1):
+                    (ioffset, _, _, name_size) = _dir_entry_fmt.unpack_from(buf, idx)
+                    idx += _dir_entry_fmt.size
+                    name = buf[idx : idx + name_size + 1]
+                    idx += name_size + 1
+                    entries.append(
+                        (
+                            name.decode("utf-8", errors="surrogateescape"),
+                            (start << 16) | ioffset,
+                        )
+                    )
+        except struct.error:
+            raise SquashfsError("truncated directory in '%s'" % self.fn)
+        if idx != len(buf):
+            raise SquashfsError("truncated directory in '%s'" % self.fn)
+        return entries
+
+    def walk(self):
+        """Yield (path, inode) for every entry in the image, depth-first with
+           each directory before its contents (like 'unsquashfs -lln'). The
+           root is yielded with the path ''. Directories can't be hard linked
+           so one that is reached twice (eg, through a cycle) is an error.
+        """
+        stack = [("", self.root_inode)]
+        seen = set()
+        count = 0
+        while stack:
+            (path, ref) = stack.pop()
+            count += 1
+            if count > SQUASHFS_MAX_ENTRIES:
+                raise SquashfsError("too many entries in '%s'" % self.fn)
+            inode = self.read_inode(ref)
+            yield path, inode
+            if stat.S_ISDIR(inode.mode):
+                if ref in seen:
+                    raise SquashfsError(
+                        "directory '%s' reached twice in '%s'" % (path, self.fn)
+                    )
+                seen.add(ref)
+                for name, child in reversed(self.read_dir(inode)):
+                    if "/" in name or name in ["", ".", ".."]:
+                        raise SquashfsError(
+                            "invalid filename '%s' in '%s'" % (name, self.fn)
+                        )
+                    stack.append(("%s/%s" % (path, name), child))
+
+
+def _mangle(compress, data, dict_size, out_size):
+    """Compress data like mksquashfs, storing it uncompressed when that is not
+       smaller or doesn't fit in out_size. Returns the data and whether it is
+       compressed.
+    """
+    buf = compress(data, dict_size)
+    if len(buf) >= len(data) or len(buf) > out_size:
+        return data, False
+    return buf, True
+
+
+class _MetadataWriter(object):
+    """This class represents a metadata table (inodes or directories) being
+       written by mksquashfs, which compresses it in SQUASHFS_METADATA_SIZE
+       blocks
+    """
+
+    def __init__(self, compress):
+        self._compress = compress
+        self.data = bytearray()
+        self._out = bytearray()
+        # the position of each (compressed) block in the table
+        self._starts = [0]
+
+    def _write_block(self):
+        i = len(self._starts) - 1
+        chunk = bytes(
+            self.data[i * SQUASHFS_METADATA_SIZE : (i + 1) * SQUASHFS_METADATA_SIZE]
+        )
+        (buf, compressed) = _mangle(
+            self._compress, chunk, SQUASHFS_METADATA_SIZE, SQUASHFS_METADATA_SIZE
+        )
+        hdr = len(buf) if compressed else len(buf) | SQUASHFS_COMPRESSED_BIT
+        self._out += struct.pack("<H", hdr) + buf
+        self._starts.append(len(self._out))
+
+    def ref(self, pos):
+        """Return the (block << 16 | offset) reference of the uncompressed
+           position pos
+        """
+        block = pos // SQUASHFS_METADATA_SIZE
+        while len(self._starts) <= block:
+            self._write_block()
+        return (self._starts[block] << 16) | (pos % SQUASHFS_METADATA_SIZE)
+
+    def finish(self):
+        """Return the compressed table"""
+        blocks = (len(self.data) + SQUASHFS_METADATA_SIZE - 1) // SQUASHFS_METADATA_SIZE
+        while len(self._starts) <= blocks:
+            self._write_block()
+        return bytes(self._out)
+
+
+class _DirListing(object):
+    """This class represents a directory listing being written by mksquashfs
+       (see add_dir() in squashfs-tools/mksquashfs.c)
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        # (position in listing, name) of the directory index entries
+        self.index = []
+        self._count = 256
+        self._header = None
+        self._index_pos = 0
+        self._start = 0
+        self._number = 0
+
+    def _write_header(self):
+        struct.pack_into(
+            "<III", self.buf, self._header, self._count - 1, self._start, self._number
+        )
+
+    def add(self, ref, number, name, itype):
+        size = len(name)
+        start = ref >> 16
+        pos = len(self.buf)
+        # start a new header (and index entry) before the listing since the
+        # last index entry grows beyond a metadata block
+        indexed = pos + _dir_entry_fmt.size + size - self._index_pos
+        if (
+            self._count == 256
+            or start != self._start
+            or (self._header is not None and indexed > SQUASHFS_METADATA_SIZE)
+            or not -32768 <= number - self._number <= 32767
+        ):
+            if self._header is not None:
+                if indexed > SQUASHFS_METADATA_SIZE:
+                    self.index.append((pos, name))
+                    self._index_pos = pos
+                self._write_header()
+            self._header = pos
+            self._count = 0
+            self._start = start
+            self._number = number
+            self.buf += bytes(_dir_header_fmt.size)
+        self.buf += _dir_entry_fmt.pack(
+            ref & 0xFFFF, number - self._number, itype, size - 1
+        )
+        self.buf += name
+        self._count += 1
+
+    def finish(self):
+        if self._header is not None:
+            self._write_header()
+        return bytes(self.buf)
+
+
+class _ResquashNode(object):
+    """This class represents an entry of the image being verified"""
+
+    __slots__ = ("name", "inode", "children", "number")
+
+    def __init__(self, name, inode):
+        self.name = name
+        self.inode = inode
+        # the entries of directories, sorted like mksquashfs does
+        self.children = None
+        self.number = 0
+
+
+def _resquash_options(img, mksquashfs_opts):
+    """Return (compression, all_root) of the mksquashfs options or raise
+       SquashfsError if they are not the ones verify_resquash() reproduces
+    """
+    opts = list(mksquashfs_opts)
+    comp = None
+    if "-comp" in opts:
+        idx = opts.index("-comp")
+        comp = opts[idx + 1] if idx + 1 < len(opts) else None
+        del opts[idx : idx + 2]
+    all_root = "-all-root" in opts
+    required = ["-noappend", "-no-xattrs", "-no-fragments"]
+    if sorted(set(opts) - set(["-all-root"])) != sorted(required):
+        raise SquashfsError(
+            "unsupported mksquashfs options '%s'" % " ".join(mksquashfs_opts)
+        )
+    if comp != img.compression:
+        raise SquashfsError(
+            "'%s' is not compressed with '%s'" % (os.path.basename(img.fn), comp)
+        )
+    if comp not in squashfs_compressors:
+        raise SquashfsError("unsupported compression '%s'" % comp)
+    return comp, all_root
+
+
+def _resquash_tree(img, unsquashfs_root):
+    """Read the tree of the image, as unsquashfs would extract it"""
+    seen = set()
+
+    def _node(name, ref):
+        if ref in seen:
+            raise SquashfsError("hard link '%s'" % name.decode(errors="replace"))
+        seen.add(ref)
+        inode = img.read_inode(ref)
+        node = _ResquashNode(name, inode)
+
+        if stat.S_ISDIR(inode.mode):
+            # mksquashfs has to be able to list the unpacked directory
+            if inode.mode & 0o500 != 0o500:
+                raise SquashfsError("unlistable directory")
+            entries = []
+            for (child, child_ref) in img.read_dir(inode):
+                child = child.encode("utf-8", errors="surrogateescape")
+                if b"/" in child or child in [b"", b".", b".."]:
+                    raise SquashfsError("invalid filename in '%s'" % img.fn)
+                entries.append((child, child_ref))
+            node.children = [_node(c, r) for (c, r) in sorted(entries)]
+        elif stat.S_ISREG(inode.mode):
+            if inode.mode & 0o400 != 0o400:
+                raise SquashfsError("unreadable file")
+        elif stat.S_ISLNK(inode.mode):
+            # the unpacked symlink has the permissions of any symlink
+            inode.mode = stat.S_IFLNK | 0o777
+        else:
+            raise SquashfsError("unsupported file type %o" % stat.S_IFMT(inode.mode))
+
+        if not unsquashfs_root:
+            # unsquashfs drops setuid/setgid/sticky when not run as root
+            inode.mode &= ~0o7000
+        return node
+
+    return _node(b"", img.root_inode)
+
+
+def _resquash_files(node):
+    """Yield the regular file entries in the order mksquashfs writes them"""
+    for child in node.children:
+        if child.children is not None:
+            yield from _resquash_files(child)
+        elif stat.S_ISREG(child.inode.mode):
+            yield child
+
+
+def _resquash_number(node, number):
+    """Number the entries of the directory node like mksquashfs, starting at
+       number. Returns the next number.
+    """
+    for child in node.children:
+        child.number = number
+        number += 1
+        if child.children is not None:
+            number = _resquash_number(child, number)
+    return number
+
+
+def _resquash_data(img, files, compress, jobs):
+    """Verify the data blocks of the files in the image, recompressing them in
+       memory in jobs threads. Returns the (start, block list) of each file
+       and the position following the data.
+    """
+    fd = img._fh.fileno()
+    block_size = img.block_size
+
+    def _verify_block(pos, entry, size):
+        csize = entry & ~SQUASHFS_COMPRESSED_BIT_BLOCK
+        if pos + csize > img.bytes_used:
+            raise SquashfsError("data block beyond end of '%s'" % img.fn)
+        buf = os.pread(fd, csize, pos)
+        if len(buf) != csize:
+            raise SquashfsError("truncated data block in '%s'" % img.fn)
+        data = buf
+        if not entry & SQUASHFS_COMPRESSED_BIT_BLOCK:
+            try:
+                data = img._decompress(buf, block_size)
+            except Exception as e:
+                raise SquashfsError(
+                    "could not decompress data block at %d: %s" % (pos, e)
+                )
+        if len(data) != size:
+            raise SquashfsError("data block of unexpected size at %d" % pos)
+        if data == bytes(size):
+            # mksquashfs would write a sparse block
+            raise SquashfsError("sparse data block at %d" % pos)
+        (repack, compressed) = _mangle(compress, data, block_size, block_size)
+        repack_entry = len(repack)
+        if not compressed:
+            repack_entry |= SQUASHFS_COMPRESSED_BIT_BLOCK
+        if repack_entry != entry or repack != buf:
+            raise SquashfsError("data block at %d differs" % pos)
+        return hashlib.sha256(data).digest()
+
+    # Plan the blocks to verify: mksquashfs writes the blocks of each file in
+    # turn, except for empty files and duplicates of an earlier file, which
+    # reuse its blocks
+    pos = _superblock_fmt.size
+    layouts = {}
+    res = []
+    tasks = []
+    for node in files:
+        size = node.inode.size
+        if size == 0:
+            res.append((0, ()))
+            continue
+        (start, blocks) = img.read_blocks(node.inode)
+        if len(blocks) != (size + block_size - 1) // block_size:
+            raise SquashfsError("file with a fragment")
+        if (start, blocks, size) in layouts:
+            res.append((start, blocks))
+            continue
+        if start != pos:
+            raise SquashfsError("data blocks out of order at %d" % start)
+        layouts[(start, blocks, size)] = len(res)
+        res.append((start, blocks))
+        for (i, entry) in enumerate(blocks):
+            tasks.append(
+                (len(res) - 1, pos, entry, min(block_size, size - i * block_size))
+            )
+            pos += entry & ~SQUASHFS_COMPRESSED_BIT_BLOCK
+
+    # Verify the blocks in order, a few at a time per thread, and check that
+    # no file duplicates an earlier one (mksquashfs would have reused its
+    # blocks)
+    digests = {}
+    contents = set()
+
+    def _done(idx, digest):
+        digests.setdefault(idx, []).append(digest)
+        (start, blocks) = res[idx]
+        if len(digests[idx]) == len(blocks):
+            key = (files[idx].inode.size, tuple(digests.pop(idx)))
+            if key in contents:
+                raise SquashfsError("duplicate file data at %d" % start)
+            contents.add(key)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        try:
+            for (idx, block_pos, entry, size) in tasks:
+                future = executor.submit(_verify_block, block_pos, entry, size)
+                pending.append((idx, future))
+                if len(pending) >= jobs * 4:
+                    (i, future) = pending.popleft()
+                    _done(i, future.result())
+            while pending:
+                (i, future) = pending.popleft()
+                _done(i, future.result())
+        finally:
+            for (_, future) in pending:
+                future.cancel()
+
+    return res, pos
+
+
+def _resquash_table(data, compress, pos):
+    """Return a table (export or id) written at pos like mksquashfs does:
+       the metadata blocks followed by their positions, and the position of
+       the latter
+    """
+    out = bytearray()
+    starts = []
+    for i in range(0, len(data), SQUASHFS_METADATA_SIZE):
+        (buf, compressed) = _mangle(
+            compress,
+            data[i : i + SQUASHFS_METADATA_SIZE],
+            SQUASHFS_METADATA_SIZE,
+            SQUASHFS_METADATA_SIZE,
+        )
+        starts.append(pos + len(out))
+        hdr = len(buf) if compressed else len(buf) | SQUASHFS_COMPRESSED_BIT
+        out += struct.pack("<H", hdr) + buf
+    return bytes(out) + struct.pack("<%dQ" % len(starts), *starts), pos + len(out)
+
+
+def _resquash_metadata(root, files, compress, all_root):
+    """Write the inode and directory tables of the tree like mksquashfs,
+       given the (start, block list) of the regular files. Returns the
+       tables, the inode reference of each inode number, the id table and
+       the root inode reference.
+    """
+    inodes = _MetadataWriter(compress)
+    dirs = _MetadataWriter(compress)
+    ids = []
+    lookup = {}
+
+    def _id(i):
+        if i not in ids:
+            ids.append(i)
+        return ids.index(i)
+
+    def _inode(node, itype, data):
+        inode = node.inode
+        (uid, gid) = (0, 0) if all_root else (inode.uid, inode.gid)
+        base = _inode_header_fmt.pack(
+            itype, inode.mode & 0o7777, _id(uid), _id(gid), inode.mtime, node.number
+        )
+        ref = inodes.ref(len(inodes.data))
+        inodes.data += base + data
+        lookup[node.number] = ref
+        return ref
+
+    def _dir(node, parent):
+        listing = _DirListing()
+        subdirs = 0
+        byte_count = 0
+        for child in node.children:
+            mode = child.inode.mode
+            if child.children is not None:
+                (ref, itype) = (_dir(child, node.number), SQUASHFS_DIR_TYPE)
+                subdirs += 1
+            elif stat.S_ISREG(mode):
+                (start, blocks) = files[child]
+                blist = struct.pack("<%dI" % len(blocks), *blocks)
+                size = child.inode.size
+                if size < 1 << 32 and start < 1 << 32:
+                    data = struct.pack("<IIII", start, SQUASHFS_INVALID_FRAG, 0, size)
+                    ref = _inode(child, SQUASHFS_REG_TYPE, data + blist)
+                else:
+                    data = struct.pack(
+                        "<QQQIIII",
+                        start,
+                        size,
+                        0,
+                        1,
+                        SQUASHFS_INVALID_FRAG,
+                        0,
+                        SQUASHFS_INVALID_XATTR,
+                    )
+                    ref = _inode(child, SQUASHFS_LREG_TYPE, data + blist)
+                itype = SQUASHFS_REG_TYPE
+            else:
+                target = child.inode.target.encode("utf-8", errors="surrogateescape")
+                data = struct.pack("<II", 1, len(target)) + target
+                ref = _inode(child, SQUASHFS_SYMLINK_TYPE, data)
+                itype = SQUASHFS_SYMLINK_TYPE
+            listing.add(ref, child.number, child.name, itype)
+            byte_count += len(child.name) + _dir_entry_fmt.size
+
+        buf = listing.finish()
+        pos = len(dirs.data)
+        dirs.data += buf
+        ref = dirs.ref(pos)
+        (block, offset) = (ref >> 16, ref & 0xFFFF)
+        nlink = subdirs + 2
+        if len(node.children) < 257 and byte_count < SQUASHFS_METADATA_SIZE:
+            data = struct.pack("<IIHHI", block, nlink, len(buf) + 3, offset, parent)
+            return _inode(node, SQUASHFS_DIR_TYPE, data)
+
+        index = b""
+        for (idx, name) in listing.index:
+            index += struct.pack("<III", idx, dirs.ref(pos + idx) >> 16, len(name) - 1)
+            index += name
+        data = struct.pack(
+            "<IIIIHHI",
+            nlink,
+            len(buf) + 3,
+            block,
+            parent,
+            len(listing.index),
+            offset,
+            SQUASHFS_INVALID_XATTR,
+        )
+        return _inode(node, SQUASHFS_LDIR_TYPE, data + index)
+
+    # the root has the last inode number and the next one as parent
+    root.number = _resquash_number(root, 1)
+    root_ref = _dir(root, root.number + 1)
+    return inodes.finish(), dirs.finish(), lookup, ids, root_ref
+
+
+def verify_resquash(fn, mksquashfs_opts, unsquashfs_root=False, jobs=1):
+    """Verify that the squashfs image fn is what 'unsquashfs' followed by
+       'mksquashfs <dir> <repack> -fstime <fstime of fn> <mksquashfs_opts>'
+       would recreate, without unpacking or repacking it: the tables are
+       recreated from the metadata of fn and the data blocks are decompressed
+       and recompressed in memory (in jobs threads), stopping at the first
+       difference. unsquashfs_root is whether unsquashfs runs as (fake)root.
+
+       Returns True or raises SquashfsError if the image differs or can't be
+       verified this way (eg, it has hard links, devices or sparse files), in
+       which case only a resquash with squashfs-tools can tell.
+    """
+    with SquashfsImage(fn) as img:
+        (comp, all_root) = _resquash_options(img, mksquashfs_opts)
+        compress = squashfs_compressors[comp]
+        if not all_root and not unsquashfs_root:
+            # the ownership of the unpacked files would be whoever unpacked them
+            raise SquashfsError("ownership is not kept without -all-root or root")
+
+        flags = SQUASHFS_NO_FRAG | SQUASHFS_DUPLICATE | SQUASHFS_EXPORT
+        flags |= SQUASHFS_NO_XATTR
+        if (
+            img.flags != flags
+            or img.block_size != SQUASHFS_BLOCK_SIZE
+            or img.fragments != 0
+            or img.xattr_id_table_start != SQUASHFS_INVALID_BLK
+            or (all_root and img.id_count != 1)
+        ):
+            raise SquashfsError("'%s' was not created with these options" % fn)
+
+        try:
+            root = _resquash_tree(img, unsquashfs_root)
+        except RecursionError:
+            raise SquashfsError("too deep directory tree in '%s'" % fn)
+        files = list(_resquash_files(root))
+        (layout, pos) = _resquash_data(img, files, compress, jobs)
+        (inode_table, dir_table, lookup, ids, root_ref) = _resquash_metadata(
+            root, dict(zip(files, layout)), compress, all_root
+        )
+
+        tables = [inode_table, dir_table]
+        inode_table_start = pos
+        directory_table_start = inode_table_start + len(inode_table)
+        fragment_table_start = directory_table_start + len(dir_table)
+
+        count = len(lookup)
+        refs = struct.pack("<%dQ" % count, *[lookup[i + 1] for i in range(count)])
+        (table, lookup_table_start) = _resquash_table(
+            refs, compress, fragment_table_start
+        )
+        tables.append(table)
+
+        (table, id_table_start) = _resquash_table(
+            struct.pack("<%dI" % len(ids), *ids),
+            compress,
+            fragment_table_start + len(table),
+        )
+        tables.append(table)
+        bytes_used = fragment_table_start + sum(len(t) for t in tables[2:])
+        tables.append(bytes(-bytes_used % 4096))
+
+        comp_id = [k for (k, v) in SQUASHFS_COMPRESSION.items() if v == comp][0]
+        superblock = _superblock_fmt.pack(
+            SQUASHFS_MAGIC,
+            count,
+            img.mkfs_time,
+            img.block_size,
+            0,
+            comp_id,
+            img.block_size.bit_length() - 1,
+            flags,
+            len(ids),
+            4,
+            0,
+            root_ref,
+            bytes_used,
+            id_table_start,
+            SQUASHFS_INVALID_BLK,
+            inode_table_start,
+            directory_table_start,
+            fragment_table_start,
+            lookup_table_start,
+        )
+        if superblock != img.superblock:
+            raise SquashfsError("superblock of '%s' differs" % fn)
+
+        tail = b"".join(tables)
+        img._fh.seek(pos)
+        if img._fh.read(len(tail) + 1) != tail:
+            raise SquashfsError("tables of '%s' differ" % fn)
+
+    return True
@@ -17,7 +17,6 @@
 from __future__ import print_function
 import os
 import re
-import yaml
 
 
 from reviewtools.common import (
@@ -26,9 +25,10 @@ from reviewtools.common import (
     error,
     open_file_read,
     read_snapd_base_declaration,
-    unsquashfs_lln,
-    unsquashfs_lln_parse,
+    get_squashfs_metadata,
     verify_type,
+    yaml_safe_load,
+    YamlDuplicateKeyError,
 )
 from reviewtools.overrides import interfaces_attribs_addons
 
@@ -40,6 +40,24 @@ class SnapReviewException(ReviewException):
     """This class represents SnapReview exceptions"""
 
 
+class SnapReviewContext(object):
+    """This class represents the parsed data of a snap package (snap.yaml,
+       snap/manifest.yaml, the base declaration and the unsquashfs -lln
+       listing). It is filled in by the first SnapReview given it and then
+       shared, read-only, by all the SnapReview classes of one review.
+    """
+
+    def __init__(self, fn):
+        self.pkg_filename = fn
+        self.loaded = False
+        self.snap_yaml = None
+        self.snap_manifest_yaml = None
+        self.base_declaration_series = None
+        self.base_declaration = None
+        self.unsquashfs_lln_hdr = None
+        self.unsquashfs_lln_entries = None
+
+
 class SnapReview(Review):
     """This class represents snap reviews"""
 
@@ -370,7 +388,7 @@ class SnapReview(Review):
 
     supported_compression_algorithms = ["xz", "lzo"]
 
-    def __init__(self, fn, review_type, overrides=None):
+    def __init__(self, fn, review_type, overrides=None, context=None):
         if review_type is None:  # for using utility functions
             return
         Review.__init__(self, fn, review_type, overrides=overrides)
@@ -379,63 +397,19 @@ class SnapReview(Review):
         if not self.is_snap2:
             return
 
-        snap_yaml = self._extract_snap_yaml()
-        try:
-            self.snap_yaml = yaml.safe_load(snap_yaml)
-        except Exception:  # pragma: nocover
-            error("Could not load snap.yaml. Is it properly formatted?")
-        snap_yaml.close()
-
-        # read yaml again for duplicated keys check (py-yaml does not
-        # do that)
-        snap_yaml = self._extract_snap_yaml()
-        try:
-            self._verify_no_duplicated_yaml_keys(snap_yaml.read())
-        except Exception as e:
-            error("Found duplicated yaml keys in snap.yaml: %s" % e)
-        snap_yaml.close()
-
-        self.snap_manifest_yaml = {}
-        manifest_yaml = self._extract_snap_manifest_yaml()
-        if manifest_yaml is not None:
-            try:
-                self.snap_manifest_yaml = yaml.safe_load(manifest_yaml)
-                manifest_yaml.close()
-                if self.snap_manifest_yaml is None:
-                    self.snap_manifest_yaml = {}
-            except Exception:  # pragma: nocover
-                error("Could not load snap/manifest.yaml. Is it properly " "formatted?")
-
-        (
-            self.base_declaration_series,
-            self.base_declaration,
-        ) = read_snapd_base_declaration()
+        # the parsed package data is shared by all the SnapReview classes
+        # given the same context
+        if context is None:
+            context = SnapReviewContext(fn)
+        if not context.loaded:
+            self._load_context(context)
 
-        # Add in-progress interfaces
-        if self.base_declaration_series in self.inprogress_interfaces:
-            rel = self.base_declaration_series
-            for side in ["plugs", "slots"]:
-                if (
-                    side not in self.base_declaration
-                    or side not in self.inprogress_interfaces[rel]
-                ):
-                    continue
-
-                if side == "plugs":
-                    oside = "slots"
-                else:
-                    oside = "plugs"
-
-                for iface in self.inprogress_interfaces[rel][side]:
-                    if (
-                        iface in self.base_declaration[side]
-                        or iface in self.base_declaration[oside]
-                    ):
-                        # don't override anything in the base declaration
-                        continue
-                    self.base_declaration[side][iface] = self.inprogress_interfaces[
-                        rel
-                    ][side][iface]
+        self.snap_yaml = context.snap_yaml
+        self.snap_manifest_yaml = context.snap_manifest_yaml
+        self.base_declaration_series = context.base_declaration_series
+        self.base_declaration = context.base_declaration
+        self.unsquashfs_lln_hdr = context.unsquashfs_lln_hdr
+        self.unsquashfs_lln_entries = context.unsquashfs_lln_entries
 
         # to simplify checks, gather up all the interfaces into one dict()
         for side in ["plugs", "slots"]:
@@ -460,10 +434,6 @@ class SnapReview(Review):
                                 k
                             ][v]
 
-        # default to 'app'
-        if "type" not in self.snap_yaml:
-            self.snap_yaml["type"] = "app"
-
         if "architectures" in self.snap_yaml:
             self.pkg_arch = self.snap_yaml["architectures"]
         else:
@@ -473,25 +443,92 @@ class SnapReview(Review):
         if "type" in self.snap_yaml and self.snap_yaml["type"] == "gadget":
             self.is_snap_gadget = True
 
+    def _load_context(self, context):
+        """Parse the package data shared through context"""
+        snap_yaml = self._extract_snap_yaml()
+        raw_snap_yaml = snap_yaml.read()
+        snap_yaml.close()
+        # check for duplicated keys while parsing (py-yaml does not do that)
+        try:
+            parsed_snap_yaml = yaml_safe_load(raw_snap_yaml, allow_duplicate_keys=False)
+        except YamlDuplicateKeyError as e:
+            error(
+                "Found duplicated yaml keys in snap.yaml: %s"
+                % SnapReviewException(e.problem)
+            )
+        except Exception:  # pragma: nocover
+            error("Could not load snap.yaml. Is it properly formatted?")
+
+        snap_manifest_yaml = {}
+        manifest_yaml = self._extract_snap_manifest_yaml()
+        if manifest_yaml is not None:
+            try:
+                snap_manifest_yaml = yaml_safe_load(manifest_yaml)
+                manifest_yaml.close()
+                if snap_manifest_yaml is None:
+                    snap_manifest_yaml = {}
+            except Exception:  # pragma: nocover
+                error("Could not load snap/manifest.yaml. Is it properly " "formatted?")
+
+        (base_declaration_series, base_declaration) = read_snapd_base_declaration()
+
+        # Add in-progress interfaces
+        if base_declaration_series in self.inprogress_interfaces:
+            rel = base_declaration_series
+            for side in ["plugs", "slots"]:
+                if (
+                    side not in base_declaration
+                    or side not in self.inprogress_interfaces[rel]
+                ):
+                    continue
+
+                if side == "plugs":
+                    oside = "slots"
+                else:
+                    oside = "plugs"
+
+                for iface in self.inprogress_interfaces[rel][side]:
+                    if (
+                        iface in base_declaration[side]
+                        or iface in base_declaration[oside]
+                    ):
+                        # don't override anything in the base declaration
+                        continue
+                    base_declaration[side][iface] = self.inprogress_interfaces[rel][
+                        side
+                    ][iface]
+
+        # default to 'app'
+        if "type" not in parsed_snap_yaml:
+            parsed_snap_yaml["type"] = "app"
+
         # snapd understands:
         #   plugs:
         #     foo: null
         # but yaml.safe_load() treats 'null' as 'None', but we need a {}, so
         # we need to account for that.
         for k in ["plugs", "slots"]:
-            if k not in self.snap_yaml:
+            if k not in parsed_snap_yaml:
                 continue
-            for iface in self.snap_yaml[k]:
-                if not isinstance(self.snap_yaml[k], dict):
+            for iface in parsed_snap_yaml[k]:
+                if not isinstance(parsed_snap_yaml[k], dict):
                     # eg, top-level "plugs: [ content ]"
                     error(
                         "Invalid top-level '%s' " "(not a dict)" % k
                     )  # pragma: nocover
-                if self.snap_yaml[k][iface] is None:
-                    self.snap_yaml[k][iface] = {}
+                if parsed_snap_yaml[k][iface] is None:
+                    parsed_snap_yaml[k][iface] = {}
 
         # cache unsquashfs -lln so we can use it all over
-        self.unsquashfs_lln_hdr, self.unsquashfs_lln_entries = self._unsquashfs_lln(fn)
+        (lln_hdr, lln_entries) = self._unsquashfs_lln(self.pkg_filename)
+
+        context.snap_yaml = parsed_snap_yaml
+        context.snap_manifest_yaml = snap_manifest_yaml
+        context.base_declaration_series = base_declaration_series
+        context.base_declaration = base_declaration
+        context.unsquashfs_lln_hdr = lln_hdr
+        context.unsquashfs_lln_entries = lln_entries
+        context.loaded = True
 
     # Since coverage is looked at via the testsuite and the testsuite mocks
     # this out, don't cover this
@@ -513,10 +550,13 @@ class SnapReview(Review):
 
     def _unsquashfs_lln(self, snap_pkg):
         """Run unsquashfs -lln on a snap package"""
-        (rc, out) = unsquashfs_lln(snap_pkg)
-        if rc != 0:
-            error("Could not unsquashfs -lln failed")
-        hdr, entries = unsquashfs_lln_parse(out)
+        metadata = get_squashfs_metadata(snap_pkg)
+        if not metadata.has_native_lln():
+            (rc, out) = metadata.lln()
+            if rc != 0:
+                error("Could not unsquashfs -lln failed")
+        # read once per package and shared by all the SnapReview classes
+        hdr, entries = metadata.lln_parse()
         return hdr, entries
 
     # Since coverage is looked at via the testsuite and the testsuite mocks
@@ -621,11 +661,7 @@ class SnapReview(Review):
 
     def _verify_no_duplicated_yaml_keys(self, raw_snap_yaml):
         """Verify there are no duplicated yaml map keys"""
-        import ruamel.yaml
-
-        yaml = ruamel.yaml.YAML(typ="safe")
-        yaml.allow_duplicate_keys = False
         try:
-            yaml.load(raw_snap_yaml)
-        except ruamel.yaml.constructor.DuplicateKeyError as e:
+            yaml_safe_load(raw_snap_yaml, allow_duplicate_keys=False)
+        except YamlDuplicateKeyError as e:
             raise SnapReviewException(e.problem)
@@ -124,9 +124,15 @@ class SnapDeclarationException(SnapReviewException):
 class SnapReviewDeclaration(SnapReview):
     """This class represents snap declaration reviews"""
 
-    def __init__(self, fn, overrides=None):
-        SnapReview.__init__(self, fn, "declaration-snap-v2", overrides=overrides)
+    def __init__(self, fn, overrides=None, context=None):
+        SnapReview.__init__(
+            self, fn, "declaration-snap-v2", overrides=overrides, context=context
+        )
 
+        # _verify_declaration() normalizes what it verifies in place, so
+        # work on a copy of the base declaration shared with the other
+        # modules
+        self.base_declaration = copy.deepcopy(self.base_declaration)
         self._verify_declaration(self.base_declaration, base=True)
 
         self.on_store = None
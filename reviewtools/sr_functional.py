@@ -16,7 +16,15 @@
 
 from __future__ import print_function
 from reviewtools.sr_common import SnapReview
-from reviewtools.common import StatLLN, cmd
+from reviewtools.common import StatLLN
+from reviewtools.elf import (
+    ElfError,
+    global_symbols,
+    has_execstack,
+    open_symbol_cache,
+    read_dynamic_symbols,
+    sha256sum,
+)
 from reviewtools.overrides import (
     func_execstack_overrides,
     func_execstack_skipped_pats,
@@ -25,6 +33,7 @@ from reviewtools.overrides import (
     func_base_state_files_snaps_overrides,
     redflagged_snap_types_overrides,
 )
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import copy
 import os
@@ -34,8 +43,10 @@ import re
 class SnapReviewFunctional(SnapReview):
     """This class represents snap functional reviews"""
 
-    def __init__(self, fn, overrides=None):
-        SnapReview.__init__(self, fn, "functional-snap-v2", overrides=overrides)
+    def __init__(self, fn, overrides=None, context=None):
+        SnapReview.__init__(
+            self, fn, "functional-snap-v2", overrides=overrides, context=context
+        )
         self._list_all_compiled_binaries()
 
         # State files only for base snaps, if have -lln output and
@@ -65,14 +76,14 @@ class SnapReviewFunctional(SnapReview):
             for (line, item) in self.unsquashfs_lln_entries:
                 if item is None:
                     continue
-
-                if ".so" in os.path.basename(item[StatLLN.FILENAME]):
-                    symbols = self._find_symbols(item[StatLLN.FILENAME])
-                    if symbols is not None:
-                        item["symbols"] = symbols
-
                 self.curr_state[item[StatLLN.FILENAME]] = item
 
+            symbols = self._find_all_symbols(
+                [fn for fn in self.curr_state if ".so" in os.path.basename(fn)]
+            )
+            for fn in symbols:
+                self.curr_state[fn]["symbols"] = symbols[fn]
+
             # update state_output with our current state
             self.overrides["state_output"][self.state_key] = self._serialize(
                 self.curr_state
@@ -85,75 +96,66 @@ class SnapReviewFunctional(SnapReview):
                     self.overrides["state_input"][self.state_key]
                 )
 
-    def _cmd_nm(self, args):  # pragma: nocover
-        """_cmd_nm indirection for unittests"""
-        real_path = os.path.join(self.unpack_dir, args[-1])
+    def _read_dynamic_symbols(self, fn):  # pragma: nocover
+        """_read_dynamic_symbols indirection for unittests"""
+        real_path = os.path.join(self.unpack_dir, fn)
         if real_path not in self.pkg_bin_files:
-            return -1, ""
-        args[-1] = real_path
-
-        return cmd(["nm"] + args)
+            return None
 
-    def _find_symbols(self, fn):
-        """Find the ABI for the list of files"""
-        if not fn.startswith("./"):
+        try:
+            return read_dynamic_symbols(real_path)
+        except (ElfError, OSError):
             return None
 
-        symbols = {}
-        nm_args = [
-            "--format=bsd",
-            "--dynamic",
-            "--demangle",
-            "--defined-only",
-            "--with-symbol-versions",
-            fn[2:],
-        ]
-        # --format=bsd: explicitly use the bsd format
-        # --dynamic: only care about shared libraries
-        # --demangle: demangle symbols
-        # --defined-only: only show defined symbols
-        # --with-symbol-versions: also show the symbols version
-        #
-        # Format:
-        # 000000000000089a T gtk_show_uri@@Base
-        # |                | |           |
-        # |                | |            -> symbol version
-        # |                |  -------------> symbol name
-        # |                 ---------------> symbol type
-        #  --------------------------------> address
-        #
-        # see 'man nm'
-        rc, report = self._cmd_nm(nm_args)
-        if rc != 0:
+    def _get_symbol_cache_key(self, fn):  # pragma: nocover
+        """_get_symbol_cache_key indirection for unittests"""
+        real_path = os.path.join(self.unpack_dir, fn)
+        if real_path not in self.pkg_bin_files:
             return None
+        return sha256sum(real_path)
+
+    def _find_all_symbols(self, fns):
+        """Find the ABI for the list of files"""
+        cache = open_symbol_cache()
+        cache_keys = {}
 
-        for line in report.splitlines():
-            tmp = line.split(maxsplit=2)
-            if len(tmp) < 3:
+        res = {}
+        dynamic_symbols = {}
+        for fn in fns:
+            if not fn.startswith("./"):
                 continue
-            symbol_type = tmp[1]
-            symbol = tmp[2]
-            symbol_version = ""
-            idx = tmp[2].find("@")
-            if idx > 1:
-                symbol = tmp[2][:idx]
-                symbol_version = tmp[2][idx:]
-
-            # quick check if global symbols (uppercase and special global 'u',
-            # 'v', 'w' (note, --defined-only should remove u, v and w))
-            if symbol_type.isupper() or symbol_type in ["u", "v", "w"]:
-                # skipped symbols:
-                # * N - debugging
-                # * U - undefined (note, --defined-only should handle this)
-                if symbol_type not in ["N", "U"]:
-                    if symbol not in symbols:
-                        symbols[symbol] = {
-                            "type": symbol_type,
-                            "version": symbol_version,
-                        }
-                # ???: filter out @@GLIBC_PRIVATE?
-
-        return symbols
+
+            if cache is not None:
+                key = self._get_symbol_cache_key(fn[2:])
+                if key is not None:
+                    symbols = cache.get(key)
+                    if symbols is not None:
+                        res[fn] = symbols
+                        continue
+                    cache_keys[fn] = key
+
+            symbols = self._read_dynamic_symbols(fn[2:])
+            if symbols is not None:
+                dynamic_symbols[fn] = symbols
+
+        # demangle the symbols of all the files at once
+        try:
+            found = global_symbols(dynamic_symbols)
+        except ElfError:
+            found = {}
+
+        for fn in found:
+            res[fn] = found[fn]
+            if fn in cache_keys:
+                cache.put(cache_keys[fn], found[fn])
+        if cache is not None:
+            cache.close()
+
+        return res
+
+    def _find_symbols(self, fn):
+        """Find the ABI for the file"""
+        return self._find_all_symbols([fn]).get(fn)
 
     def _serialize(self, state):
         """Serialize a review-tools state"""
@@ -276,34 +278,29 @@ class SnapReviewFunctional(SnapReview):
         if self.snap_yaml["type"] != "app":
             return
 
-        def has_execstack(fn):
-            (rc, out) = cmd(["execstack", "-q", fn])
-            if rc != 0:
+        def _has_execstack(fn):
+            try:
+                return has_execstack(fn)
+            except (OSError, ElfError):
                 return False
 
-            if out.startswith("X "):
-                return True
-            return False
-
         t = "info"
         n = self._get_check_name("execstack")
         s = "OK"
         link = None
         bins = []
 
-        # execstack not supported on arm64, so skip this check on arm64
-        if "SNAP_ARCH" in os.environ and os.environ["SNAP_ARCH"] == "arm64":
-            s = "OK (skipped on %s)" % os.environ["SNAP_ARCH"]
-            self._add_result(t, n, s, link=link)
-            return
-
         skipped_pats = []
         for p in func_execstack_skipped_pats:
             skipped_pats.append(re.compile(r"%s" % p))
 
-        for i in self.pkg_bin_files:
-            if has_execstack(i) and not self._in_patterns(skipped_pats, i):
-                bins.append(os.path.relpath(i, self.unpack_dir))
+        # only the ELF and program headers are read, so this mostly waits on
+        # the disk
+        with ThreadPoolExecutor() as pool:
+            found = pool.map(_has_execstack, self.pkg_bin_files)
+            for (i, execstack) in zip(self.pkg_bin_files, found):
+                if execstack and not self._in_patterns(skipped_pats, i):
+                    bins.append(os.path.relpath(i, self.unpack_dir))
 
         if len(bins) > 0:
             bins.sort()
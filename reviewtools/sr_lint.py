@@ -38,9 +38,11 @@ import unicodedata
 class SnapReviewLint(SnapReview):
     """This class represents snap lint reviews"""
 
-    def __init__(self, fn, overrides=None):
+    def __init__(self, fn, overrides=None, context=None):
         """Set up the class."""
-        SnapReview.__init__(self, fn, "lint-snap-v2", overrides=overrides)
+        SnapReview.__init__(
+            self, fn, "lint-snap-v2", overrides=overrides, context=context
+        )
         self.valid_architectures = ["all"] + self.valid_compiled_architectures
         self.vcs_files = [
             ".bzr*",
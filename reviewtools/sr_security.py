@@ -21,16 +21,20 @@ from reviewtools.common import (
     cmd,
     cmdIgnoreErrorStrings,
     create_tempdir,
+    debug,
+    files_identical,
+    get_squashfs_metadata,
     open_file_write,
+    open_resquash_cache,
     ReviewException,
+    resquash_cache_key,
     AA_PROFILE_NAME_MAXLEN,
     AA_PROFILE_NAME_ADVLEN,
     MKSQUASHFS_DEFAULT_COMPRESSION,
     MKSQUASHFS_OPTS,
     UNSQUASHFS_IGNORED_ERRORS,
+    unsquashfs_as_root,
     unsquashfs_supports_ignore_errors,
-    set_lang,
-    restore_lang,
     StatLLN,
 )
 from reviewtools.overrides import (
@@ -40,6 +44,7 @@ from reviewtools.overrides import (
     sec_mode_dev_overrides,
     sec_resquashfs_overrides,
 )
+from reviewtools.squashfs import SquashfsError, verify_resquash
 import copy
 import os
 import re
@@ -50,15 +55,14 @@ import sys
 class SnapReviewSecurity(SnapReview):
     """This class represents snap security reviews"""
 
-    def __init__(self, fn, overrides=None):
-        SnapReview.__init__(self, fn, "security-snap-v2", overrides=overrides)
+    def __init__(self, fn, overrides=None, context=None):
+        SnapReview.__init__(
+            self, fn, "security-snap-v2", overrides=overrides, context=context
+        )
 
     def _unsquashfs_stat(self, snap_pkg):
         """Run unsquashfs -stat on a snap package"""
-        (origLANG, origLC_ALL) = set_lang("C.UTF-8", "C.UTF-8")
-        (rc, out) = cmd(["unsquashfs", "-stat", snap_pkg])
-        restore_lang(origLANG, origLC_ALL)
-        return rc, out
+        return get_squashfs_metadata(snap_pkg).stat()
 
     def check_security_plugs_browser_support_with_daemon(self):
         """Check security plugs - browser-support not used with daemon"""
@@ -149,8 +153,9 @@ class SnapReviewSecurity(SnapReview):
 
         error = False
         for fn in [orig, resq]:
+            metadata = get_squashfs_metadata(fn)
             cmdline = ["unsquashfs", "-fstime", fn]
-            (rc, out) = cmd(cmdline)
+            (rc, out) = metadata.fstime()
             if rc != 0:
                 debug_output += "'%s' failed" % " ".join(cmdline)
                 error = True
@@ -158,7 +163,7 @@ class SnapReviewSecurity(SnapReview):
             debug_output += "squash fstime for %s: %s" % (os.path.basename(fn), out)
 
             cmdline = ["unsquashfs", "-lln", fn]
-            (rc, out) = cmd(cmdline)
+            (rc, out) = metadata.lln()
             if rc != 0:
                 debug_output += "'%s' failed" % " ".join(cmdline)
                 error = True
@@ -178,6 +183,136 @@ class SnapReviewSecurity(SnapReview):
 
         return debug_output
 
+    def _resquash_mksquashfs_opts(self, comp, mksquashfs_ignore_opts):
+        """Return the mksquashfs options of the resquash"""
+        if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
+            mksquash_opts = []
+            for i in MKSQUASHFS_OPTS:
+                if i not in mksquashfs_ignore_opts:
+                    mksquash_opts.append(i)
+            return mksquash_opts
+
+        mksquash_opts = copy.copy(MKSQUASHFS_OPTS)
+        if comp != MKSQUASHFS_DEFAULT_COMPRESSION:
+            idx = mksquash_opts.index(MKSQUASHFS_DEFAULT_COMPRESSION)
+            mksquash_opts[idx] = comp
+        return mksquash_opts
+
+    def _resquash_verified(self, fn, comp, mksquashfs_ignore_opts):
+        """Verify in-process that resquashing fn recreates it. Returns True
+           or None if only an actual resquash can tell
+        """
+        if os.environ.get("SNAP_NATIVE_RESQUASHFS") == "0":
+            return None
+
+        mksquash_opts = self._resquash_mksquashfs_opts(comp, mksquashfs_ignore_opts)
+        try:
+            return verify_resquash(
+                fn, mksquash_opts, unsquashfs_as_root(), jobs=os.cpu_count() or 1
+            )
+        except SquashfsError as e:
+            debug("falling back to mksquashfs: %s" % e)
+            return None
+
+    def _resquash_identical(self, fn, comp, fstime, mksquashfs_ignore_opts):
+        """Unsquash and repack fn and compare the repack with fn. Returns
+           (identical, tmpdir, repack) or None if the repack failed (the
+           failure is added to the results)
+        """
+        tmpdir = create_tempdir()  # this is autocleaned
+        tmp_unpack = os.path.join(tmpdir, "squashfs-root")
+        tmp_repack = os.path.join(tmpdir, "repack.snap")
+        fakeroot_env = os.path.join(tmpdir, "fakeroot.env")
+
+        curdir = os.getcwd()
+        os.chdir(tmpdir)
+        # ensure we don't alter the permissions from the unsquashfs
+        old_umask = os.umask(000)
+
+        fakeroot_cmd = []
+        if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
+            # We could use -l $SNAP/usr/lib/... --faked $SNAP/usr/bin/faked if
+            # os.environ['SNAP'] is set, but instead we let the snap packaging
+            # make fakeroot work correctly and keep this simple.
+            fakeroot_cmd = ["fakeroot", "--unknown-is-real"]
+
+            if shutil.which(fakeroot_cmd[0]) is None:  # pragma: nocover
+                t = "error"
+                n = self._get_check_name("has_fakeroot")
+                s = "Could not find 'fakeroot' command"
+                self._add_result(t, n, s)
+                return None
+
+        try:
+            fakeroot_args = []
+            mksquash_opts = self._resquash_mksquashfs_opts(comp, mksquashfs_ignore_opts)
+
+            if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
+                # run unsquashfs under fakeroot, saving the session to be
+                # reused by mksquashfs and thus preserving
+                # uids/gids/devices/etc
+                fakeroot_args = ["-s", fakeroot_env]
+
+            cmdline = (
+                fakeroot_cmd
+                + fakeroot_args
+                + ["unsquashfs", "-no-progress", "-d", tmp_unpack]
+            )
+            if unsquashfs_supports_ignore_errors():
+                cmdline.append("-ignore-errors")
+                cmdline.append("-quiet")
+            cmdline.append(fn)
+
+            (rc, out) = cmdIgnoreErrorStrings(cmdline, UNSQUASHFS_IGNORED_ERRORS)
+            if rc != 0:
+                raise ReviewException(
+                    "could not unsquash '%s': %s" % (os.path.basename(fn), out)
+                )
+
+            fakeroot_args = []
+            if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
+                fakeroot_args = ["-i", fakeroot_env]
+
+            cmdline = (
+                fakeroot_cmd
+                + fakeroot_args
+                + ["mksquashfs", tmp_unpack, tmp_repack, "-fstime", fstime]
+                + mksquash_opts
+            )
+
+            (rc, out) = cmd(cmdline)
+            if rc != 0:
+                raise ReviewException(
+                    "could not mksquashfs '%s': %s"
+                    % (os.path.relpath(tmp_unpack, tmpdir), out)
+                )
+        except ReviewException as e:
+            t = "error"
+            n = self._get_check_name("squashfs_resquash")
+            self._add_result(t, n, str(e))
+            return None
+        finally:
+            os.umask(old_umask)
+            os.chdir(curdir)
+
+        # Now compare the images. mksquashfs needs a seekable output (the
+        # superblock is written last, at offset 0), so the repack can't be
+        # streamed, but comparing in-process lets a mismatch stop at the first
+        # differing block instead of hashing both images in full
+        try:
+            identical = files_identical(fn, tmp_repack)
+        except OSError as e:
+            t = "error"
+            n = self._get_check_name("squashfs_repack_checksum")
+            if e.filename == tmp_repack:
+                s = "could not read '%s'" % os.path.relpath(tmp_repack, tmpdir)
+            else:
+                s = "could not read '%s'" % os.path.basename(fn)
+            self._add_result(t, n, s)
+            return None
+
+        return (identical, tmpdir, tmp_repack)
+
     def check_squashfs_resquash(self):
         """Check resquash of squashfs"""
         fn = os.path.abspath(self.pkg_filename)
@@ -241,7 +376,7 @@ class SnapReviewSecurity(SnapReview):
 
         # Verify squashfs supports the -fstime option, if not, warn (which
         # blocks in store)
-        (rc, out) = cmd(["unsquashfs", "-fstime", fn])
+        (rc, out) = get_squashfs_metadata(fn).fstime()
         if rc != 0:
             t = "warn"
             n = self._get_check_name("squashfs_supports_fstime")
@@ -260,11 +395,6 @@ class SnapReviewSecurity(SnapReview):
             self._add_result(t, n, s)
             return
 
-        tmpdir = create_tempdir()  # this is autocleaned
-        tmp_unpack = os.path.join(tmpdir, "squashfs-root")
-        tmp_repack = os.path.join(tmpdir, "repack.snap")
-        fakeroot_env = os.path.join(tmpdir, "fakeroot.env")
-
         # Don't use -all-root since the snap might have other users in it
         # NOTE: adding -no-xattrs here causes resquashfs to fail (unsquashfs
         # and mksquash use -xattrs by default. By specifying -no-xattrs to
@@ -275,110 +405,42 @@ class SnapReviewSecurity(SnapReview):
         # -xattrs.
         mksquashfs_ignore_opts = ["-all-root"]
 
-        curdir = os.getcwd()
-        os.chdir(tmpdir)
-        # ensure we don't alter the permissions from the unsquashfs
-        old_umask = os.umask(000)
-
-        fakeroot_cmd = []
-        if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
-            # We could use -l $SNAP/usr/lib/... --faked $SNAP/usr/bin/faked if
-            # os.environ['SNAP'] is set, but instead we let the snap packaging
-            # make fakeroot work correctly and keep this simple.
-            fakeroot_cmd = ["fakeroot", "--unknown-is-real"]
-
-            if shutil.which(fakeroot_cmd[0]) is None:  # pragma: nocover
-                t = "error"
-                n = self._get_check_name("has_fakeroot")
-                s = "Could not find 'fakeroot' command"
-                self._add_result(t, n, s)
-                return
-
+        # Reuse the verdict of a previous resquash of the same image with the
+        # same squashfs-tools, except when debugging (which needs the repack)
+        cache = None
+        if "SNAP_DEBUG_RESQUASHFS" not in os.environ:
+            cache = open_resquash_cache()
         try:
-            fakeroot_args = []
-            mksquash_opts = copy.copy(MKSQUASHFS_OPTS)
-            if comp != MKSQUASHFS_DEFAULT_COMPRESSION:
-                idx = mksquash_opts.index(MKSQUASHFS_DEFAULT_COMPRESSION)
-                mksquash_opts[idx] = comp
-
-            if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
-                # run unsquashfs under fakeroot, saving the session to be
-                # reused by mksquashfs and thus preserving
-                # uids/gids/devices/etc
-                fakeroot_args = ["-s", fakeroot_env]
-
-                mksquash_opts = []
-                for i in MKSQUASHFS_OPTS:
-                    if i not in mksquashfs_ignore_opts:
-                        mksquash_opts.append(i)
-
-            cmdline = (
-                fakeroot_cmd
-                + fakeroot_args
-                + ["unsquashfs", "-no-progress", "-d", tmp_unpack]
-            )
-            if unsquashfs_supports_ignore_errors():
-                cmdline.append("-ignore-errors")
-                cmdline.append("-quiet")
-            cmdline.append(fn)
-
-            (rc, out) = cmdIgnoreErrorStrings(cmdline, UNSQUASHFS_IGNORED_ERRORS)
-            if rc != 0:
-                raise ReviewException(
-                    "could not unsquash '%s': %s" % (os.path.basename(fn), out)
-                )
-
-            fakeroot_args = []
-            if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
-                fakeroot_args = ["-i", fakeroot_env]
-
-            cmdline = (
-                fakeroot_cmd
-                + fakeroot_args
-                + ["mksquashfs", tmp_unpack, tmp_repack, "-fstime", fstime]
-                + mksquash_opts
-            )
-
-            (rc, out) = cmd(cmdline)
-            if rc != 0:
-                raise ReviewException(
-                    "could not mksquashfs '%s': %s"
-                    % (os.path.relpath(tmp_unpack, tmpdir), out)
-                )
-        except ReviewException as e:
-            t = "error"
-            n = self._get_check_name("squashfs_resquash")
-            self._add_result(t, n, str(e))
-            return
+            cache_key = None
+            identical = None
+            if cache is not None:
+                cache_key = resquash_cache_key(fn, comp, fstime)
+                identical = cache.get(cache_key)
+            cached = identical is not None
+
+            if not cached:
+                # The in-process verification only ever confirms an image, so
+                # mismatches (and their debugging) go through an actual resquash
+                identical = self._resquash_verified(fn, comp, mksquashfs_ignore_opts)
+                if identical is None:
+                    res = self._resquash_identical(
+                        fn, comp, fstime, mksquashfs_ignore_opts
+                    )
+                    if res is None:
+                        return
+                    (identical, tmpdir, tmp_repack) = res
+                if cache is not None:
+                    cache.put(cache_key, identical)
         finally:
-            os.umask(old_umask)
-            os.chdir(curdir)
+            if cache is not None:
+                cache.close()
 
-        # Now calculate the hashes
         t = "info"
         n = self._get_check_name("squashfs_repack_checksum")
         s = "OK"
         link = None
 
-        (rc, out) = cmd(["sha512sum", fn])
-        if rc != 0:
-            t = "error"
-            s = "could not determine checksum of '%s'" % os.path.basename(fn)
-            self._add_result(t, n, s)
-            return
-        orig_sum = out.split()[0]
-
-        (rc, out) = cmd(["sha512sum", tmp_repack])
-        if rc != 0:
-            t = "error"
-            s = "could not determine checksum of '%s'" % os.path.relpath(
-                tmp_repack, tmpdir
-            )
-            self._add_result(t, n, s)
-            return
-        repack_sum = out.split()[0]
-
-        if orig_sum != repack_sum:
+        if not identical:
             if "SNAP_DEBUG_RESQUASHFS" in os.environ:
                 print(self._debug_resquashfs(tmpdir, fn, tmp_repack), file=sys.stderr)
 
@@ -457,6 +519,8 @@ class SnapReviewSecurity(SnapReview):
                         )
                         link = None
 
+        if cached:
+            s += " (cached verdict)"
         self._add_result(t, n, s, link)
 
     def _mode_in_override(self, pkgname, fname, mode):
@@ -21,8 +21,10 @@ from reviewtools.sr_common import SnapReview
 class SnapReviewSkeleton(SnapReview):
     """This class represents snap lint reviews"""
 
-    def __init__(self, fn, overrides=None):
-        SnapReview.__init__(self, fn, "skeleton-snap-v2", overrides=overrides)
+    def __init__(self, fn, overrides=None, context=None):
+        SnapReview.__init__(
+            self, fn, "skeleton-snap-v2", overrides=overrides, context=context
+        )
 
     def check_foo(self):
         """Check foo"""
@@ -31,7 +31,7 @@ TEST_PKGFMT_VERSION = "16.04"
 TEST_UNPACK_DIR = "/fake"
 TEST_UNSQUASHFS_LLN_HDR = ""
 TEST_UNSQUASHFS_LLN_ENTRIES = ("", None)
-TEST_CMD_NM = (0, "")
+TEST_DYNAMIC_SYMBOLS = []
 
 
 #
@@ -72,9 +72,9 @@ def _unsquashfs_lln(self, fn):
     return (TEST_UNSQUASHFS_LLN_HDR, TEST_UNSQUASHFS_LLN_ENTRIES)
 
 
-def _cmd_nm(self, args):
-    """Pretend ran nm ..."""
-    return TEST_CMD_NM
+def _read_dynamic_symbols(self, fn):
+    """Pretend we read the dynamic symbols of fn"""
+    return TEST_DYNAMIC_SYMBOLS
 
 
 def create_patches():
@@ -120,7 +120,10 @@ def create_patches():
 
     # sr_functional
     patches.append(
-        patch("reviewtools.sr_functional.SnapReviewFunctional._cmd_nm", _cmd_nm)
+        patch(
+            "reviewtools.sr_functional.SnapReviewFunctional._read_dynamic_symbols",
+            _read_dynamic_symbols,
+        )
     )
 
     return patches
@@ -217,9 +220,9 @@ class TestSnapReview(TestCase):
         TEST_UNSQUASHFS_LLN_HDR = hdr
         TEST_UNSQUASHFS_LLN_ENTRIES = copy.copy(entries)
 
-    def set_test_cmd_nm(self, rc, s):
-        global TEST_CMD_NM
-        TEST_CMD_NM = (rc, s)
+    def set_test_dynamic_symbols(self, symbols):
+        global TEST_DYNAMIC_SYMBOLS
+        TEST_DYNAMIC_SYMBOLS = symbols
 
     def setUp(self):
         """Make sure our patches are applied everywhere"""
@@ -245,8 +248,8 @@ class TestSnapReview(TestCase):
         TEST_UNSQUASHFS_LLN_HDR = ""
         global TEST_UNSQUASHFS_LLN_ENTRIES
         TEST_UNSQUASHFS_LLN_ENTRIES = ("", None)
-        global TEST_CMD_NM
-        TEST_CMD_NM = (0, "")
+        global TEST_DYNAMIC_SYMBOLS
+        TEST_DYNAMIC_SYMBOLS = []
 
         self._reset_test_data()
         os.umask(self.old_umask)
@@ -13,9 +13,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import copy
+import hashlib
 import pprint
 import re
-import yaml
 
 import reviewtools.debversion as debversion
 
@@ -25,6 +25,7 @@ from reviewtools.common import (
     get_os_codename,
     assign_type_to_dict_values,
     _add_error,  # make a class
+    yaml_safe_load,
 )
 import reviewtools.email as email
 from reviewtools.overrides import (
@@ -36,6 +37,7 @@ from reviewtools.overrides import (
 )
 from reviewtools.sr_common import SnapReview
 from reviewtools.rr_common import RockReview
+from reviewtools.usn import USNDatabase, get_usns_newer_than
 
 snap_to_release = {
     "base-18": "bionic",
@@ -46,6 +48,80 @@ snap_to_release = {
     "core22": "jammy",
 }
 
+# The number of manifests kept by SecnotReportMemo
+SECNOT_REPORT_MEMO_MAX_ENTRIES = 1024
+
+
+class SecnotReportMemo:
+    """Memo of the normalized manifests and secnot reports of manifest_yaml
+    texts, so that revisions with identical manifests (eg, the builds of a
+    snap for each architecture) are only parsed and checked once. The least
+    recently used entries beyond max_entries are dropped.
+    """
+
+    def __init__(self, max_entries=SECNOT_REPORT_MEMO_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.hits = 0
+        self.lookups = 0
+
+    def key(self, manifest_yaml, pkg_type):
+        """Return the memo key of manifest_yaml"""
+        h = hashlib.sha256(pkg_type.encode())
+        h.update(b"\0")
+        h.update(manifest_yaml.encode("utf-8", errors="surrogatepass"))
+        return h.digest()
+
+    def get(self, key):
+        """Return the memoized result for key or None"""
+        self.lookups += 1
+        res = self.entries.pop(key, None)
+        if res is not None:
+            self.hits += 1
+            self.entries[key] = res
+        return res
+
+    def put(self, key, res):
+        self.entries[key] = res
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+
+
+def _get_manifest_and_report(manifest_yaml, secnot_db, pkg_type):
+    """Load and normalize manifest_yaml and get its secnot report. Returns
+    (manifest, report, error) where report is None if the revision should be
+    skipped and error, if not None, is a (format, message) to report for the
+    revision as format % (revision, message).
+    """
+    try:
+        manifest = yaml_safe_load(manifest_yaml)
+        if manifest is None:
+            return (None, None, None)
+        if pkg_type == "snap":
+            manifest = get_faked_build_and_stage_packages(manifest)
+            normalize_and_verify_snap_manifest(manifest)
+        elif pkg_type == "rock":
+            normalize_and_verify_rock_manifest(manifest)
+        else:
+            raise TypeError("Unsupported pkg type: %s" % pkg_type)
+
+    except Exception as e:
+        return (None, None, ("error loading manifest for revision '%s': %s", str(e)))
+
+    try:
+        report = get_secnots_for_manifest(
+            manifest=manifest,
+            secnot_db=secnot_db,
+            with_cves=False,
+            manifest_type=pkg_type,
+        )
+    except ValueError as e:
+        if "not found in security notification database" not in str(e):
+            return (manifest, None, ("(revision '%s') %s", str(e)))
+        return (manifest, None, None)
+
+    return (manifest, report, None)
+
 
 # Used with auto-kernel. Assumes the binary is the meta-package with versions
 # MAJ.MIN.MIC.ABI.NNN where the snap version is MAJ.MIN.MIC-ABI.NNN.
@@ -193,7 +269,7 @@ def append_fake_packages_to_manifest(
                         ].append("%s=%s" % (pkg_name, pkg_version))
 
 
-def get_pkg_revisions(item, secnot_db, errors, pkg_type="snap"):
+def get_pkg_revisions(item, secnot_db, errors, pkg_type="snap", memo=None):
     for i in ["name", "publisher_email", "revisions"]:
         if i not in item:
             raise ValueError("required field '%s' not found" % i)
@@ -240,36 +316,22 @@ def get_pkg_revisions(item, secnot_db, errors, pkg_type="snap"):
             )
             continue
 
-        try:
-            manifest = yaml.load(rev["manifest_yaml"], Loader=yaml.SafeLoader)
-            if manifest is None:
-                continue
-            if pkg_type == "snap":
-                manifest = get_faked_build_and_stage_packages(manifest)
-                normalize_and_verify_snap_manifest(manifest)
-            elif pkg_type == "rock":
-                normalize_and_verify_rock_manifest(manifest)
-            else:
-                raise TypeError("Unsupported pkg type: %s" % pkg_type)
-
-        except Exception as e:
-            _add_error(
-                pkg_db["name"],
-                errors,
-                "error loading manifest for revision '%s': %s" % (r, e),
-            )
-            continue
-
-        try:
-            report = get_secnots_for_manifest(
-                manifest=manifest,
-                secnot_db=secnot_db,
-                with_cves=False,
-                manifest_type=pkg_type,
-            )
-        except ValueError as e:
-            if "not found in security notification database" not in str(e):
-                _add_error(pkg_db["name"], errors, "(revision '%s') %s" % (r, e))
+        # Revisions often have the same manifest as another one (eg, when
+        # built for several architectures), so reuse its result if memoized
+        key = None
+        res = None
+        if memo is not None and isinstance(rev["manifest_yaml"], str):
+            key = memo.key(rev["manifest_yaml"], pkg_type)
+            res = memo.get(key)
+        if res is None:
+            res = _get_manifest_and_report(rev["manifest_yaml"], secnot_db, pkg_type)
+            if key is not None:
+                memo.put(key, res)
+
+        (manifest, report, error) = res
+        if error is not None:
+            _add_error(pkg_db["name"], errors, error[0] % (r, error[1]))
+        if report is None:
             continue
 
         if r not in pkg_db["revisions"]:
@@ -324,6 +386,60 @@ def get_pkg_revisions(item, secnot_db, errors, pkg_type="snap"):
     return pkg_db
 
 
+def get_pkg_binaries(item, pkg_type="snap"):
+    """Get the binaries of each revision of the store db item as a set of
+    (release, binary, version, override, revision) where override, if not
+    None, is the update_package_version override that is compared against
+    instead of the version of every secnot for the binary (see
+    get_secnots_for_manifest()). Revisions whose manifest can't be used are
+    skipped, like with get_pkg_revisions().
+    """
+    if pkg_type not in ["snap", "rock"]:
+        raise TypeError("Unsupported pkg type: %s" % pkg_type)
+
+    binaries = set()
+    for rev in item.get("revisions", []):
+        if "revision" not in rev or "manifest_yaml" not in rev:
+            continue
+        r = str(rev["revision"])  # ensure yaml and json agree on type
+
+        try:
+            manifest = yaml_safe_load(rev["manifest_yaml"])
+            if manifest is None:
+                continue
+            if pkg_type == "snap":
+                manifest = get_faked_build_and_stage_packages(manifest)
+                normalize_and_verify_snap_manifest(manifest)
+                pkgs = get_staged_and_build_packages_from_manifest(manifest)
+            else:
+                normalize_and_verify_rock_manifest(manifest)
+                pkgs = get_staged_packages_from_rock_manifest(manifest)
+            rel = get_ubuntu_release_from_manifest(manifest, pkg_type)
+        except Exception as e:
+            debug("Skipping %s r%s: %s" % (item.get("name"), r, e))
+            continue
+
+        if rel is None or pkgs is None:
+            continue
+
+        for section in pkgs:
+            for pkg in pkgs[section]:
+                override = None
+                if pkg_type == "snap" and pkg in update_package_version:
+                    override_version = _get_package_version_override(manifest, pkg)
+                    if override_version is not None:
+                        override = override_version.full_version
+                for v in pkgs[section][pkg]:
+                    try:
+                        debversion.parse(v)
+                    except ValueError as e:
+                        debug("Skipping %s r%s: %s" % (item.get("name"), r, e))
+                        continue
+                    binaries.add((rel, pkg, v, override, r))
+
+    return binaries
+
+
 def get_shared_snap_without_override(store_db):
     """Report snaps that use a shared email but don't have an entry for
     additional addresses.
@@ -532,6 +648,26 @@ def normalize_and_verify_rock_manifest(m):
         raise ValueError(msg)
 
 
+def _get_package_version_override(manifest, pkg):
+    """Get the update_package_version override for pkg if it is found in any
+    of the manifest's parts"""
+    version = None
+    for part in manifest["parts"]:
+        for key in update_package_version[pkg]:
+            if key in manifest["parts"][part]:
+                for entry in manifest["parts"][part][key]:
+                    if "=" not in entry:
+                        warn("'%s' not properly formatted. Skipping" % entry)
+                        continue
+                    if pkg == entry.split("=")[0]:
+                        version = debversion.parse(update_package_version[pkg][key])
+                        # For this situation is enough to find pkg in at
+                        # least one part and break as the version will come
+                        # from the override
+                        break
+    return version
+
+
 def get_secnots_for_manifest(
     manifest, secnot_db, with_cves=False, manifest_type="snap"
 ):
@@ -559,42 +695,52 @@ def get_secnots_for_manifest(
     # keys, adding secnots into each group
     for pkg_type in stage_and_build_pkgs:
         for pkg in stage_and_build_pkgs[pkg_type]:
-            if pkg in secnot_db[rel]:
-                for v in stage_and_build_pkgs[pkg_type][pkg]:
-                    pkgversion = debversion.DebVersion(v)
+            if pkg not in secnot_db[rel]:
+                continue
+
+            # The override for update_package_version is for snaps only:
+            #   update_package_version = {'<pkg>': {'<part-key>': '<version>'}
+            # and when it applies, it is used as the version of every secnot
+            # for pkg.
+            # TODO: update when fully support installed-snaps or further
+            #  snapcraft updates
+            override_version = None
+            if manifest_type == "snap" and pkg in update_package_version:
+                override_version = _get_package_version_override(manifest, pkg)
+
+            # Use the sorted index (when available) to find the affecting
+            # secnots with a bisection rather than comparing against each one
+            sorted_usns = None
+            if (
+                override_version is None
+                and isinstance(secnot_db, USNDatabase)
+                and rel in secnot_db.sorted_usns
+                and pkg in secnot_db.sorted_usns[rel]
+            ):
+                sorted_usns = secnot_db.sorted_usns[rel][pkg]
+
+            for v in stage_and_build_pkgs[pkg_type][pkg]:
+                pkgversion = debversion.parse(v)
+                if sorted_usns is not None:
+                    affecting = get_usns_newer_than(sorted_usns, pkgversion)
+                    for secnot in affecting:
+                        debug(
+                            "adding %s: %s (pkg:%s < secnot:%s)"
+                            % (
+                                pkg,
+                                secnot,
+                                pkgversion.full_version,
+                                secnot_db[rel][pkg][secnot]["version"].full_version,
+                            )
+                        )
+                else:
+                    affecting = []
                     for secnot in secnot_db[rel][pkg]:
-                        # The override for update_package_version is for
-                        # snaps only:
-                        #   update_package_version = {'<pkg>': {'<part-key>':
-                        #   '<version>'}
-                        # TODO: update when fully support installed-snaps
-                        #  or further snapcraft updates
-                        secnotversion = None
-                        if manifest_type == "snap":
-                            if pkg in update_package_version:
-                                for part in manifest["parts"]:
-                                    for key in update_package_version[pkg]:
-                                        if key in manifest["parts"][part]:
-                                            for entry in manifest["parts"][part][key]:
-                                                if "=" not in entry:
-                                                    warn(
-                                                        "'%s' not properly "
-                                                        "formatted. Skipping" % entry
-                                                    )
-                                                    continue
-                                                if pkg == entry.split("=")[0]:
-                                                    secnotversion = debversion.DebVersion(
-                                                        update_package_version[pkg][key]
-                                                    )
-                                                    # For this situation is enough
-                                                    # to find pkg in at least one
-                                                    # part and break as the version
-                                                    # will come from the override
-                                                    break
+                        secnotversion = override_version
                         if secnotversion is None:
                             secnotversion = secnot_db[rel][pkg][secnot]["version"]
 
-                        if debversion.compare(pkgversion, secnotversion) < 0:
+                        if pkgversion < secnotversion:
                             debug(
                                 "adding %s: %s (pkg:%s < secnot:%s)"
                                 % (
@@ -604,21 +750,7 @@ def get_secnots_for_manifest(
                                     secnotversion.full_version,
                                 )
                             )
-                            # Only adding pkg_type if there is a pending secnote
-                            if pkg_type not in pending_secnots:
-                                pending_secnots[pkg_type] = {}
-                            if pkg not in pending_secnots[pkg_type]:
-                                if with_cves:
-                                    pending_secnots[pkg_type][pkg] = {}
-                                else:
-                                    pending_secnots[pkg_type][pkg] = []
-                            if secnot not in pending_secnots[pkg_type][pkg]:
-                                if with_cves:
-                                    pending_secnots[pkg_type][pkg][secnot] = secnot_db[
-                                        rel
-                                    ][pkg][secnot]["cves"]
-                                else:
-                                    pending_secnots[pkg_type][pkg].append(secnot)
+                            affecting.append(secnot)
                         else:
                             debug(
                                 "skipping %s: %s (pkg:%s >= secnot:%s)"
@@ -630,12 +762,28 @@ def get_secnots_for_manifest(
                                 )
                             )
 
-                        if (
-                            pkg_type in pending_secnots
-                            and pkg in pending_secnots[pkg_type]
-                            and not with_cves
-                        ):
-                            pending_secnots[pkg_type][pkg].sort()
+                if len(affecting) == 0:
+                    continue
+
+                # Only adding pkg_type if there is a pending secnote
+                if pkg_type not in pending_secnots:
+                    pending_secnots[pkg_type] = {}
+                if pkg not in pending_secnots[pkg_type]:
+                    if with_cves:
+                        pending_secnots[pkg_type][pkg] = {}
+                    else:
+                        pending_secnots[pkg_type][pkg] = []
+                for secnot in affecting:
+                    if secnot not in pending_secnots[pkg_type][pkg]:
+                        if with_cves:
+                            pending_secnots[pkg_type][pkg][secnot] = secnot_db[rel][
+                                pkg
+                            ][secnot]["cves"]
+                        else:
+                            pending_secnots[pkg_type][pkg].append(secnot)
+
+                if not with_cves:
+                    pending_secnots[pkg_type][pkg].sort()
     return pending_secnots
 
 
@@ -766,7 +914,7 @@ def get_snapcraft_version_from_manifest(m):
         and m["snapcraft-version"]
     ):
         try:
-            return debversion.DebVersion(m["snapcraft-version"])
+            return debversion.parse(m["snapcraft-version"])
         except ValueError as e:
             warn("Invalid Snapcraft version: %s" % e)
             return None
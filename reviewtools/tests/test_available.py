@@ -15,8 +15,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from unittest import TestCase
+from unittest.mock import patch
 
+import json
 import os
+import sqlite3
 import tempfile
 
 import reviewtools.available as available
@@ -879,6 +882,53 @@ Revision r12 (i386; channels: candidate, beta)
         for r in ["7", "8", "9", "10"]:
             self.assertNotIn(r, seen_db["0ad"])
 
+    def test_check_read_seen_db_sqlite(self):
+        """Test read_seen_db() - sqlite"""
+        self.tmpdir = tempfile.mkdtemp()
+        tmp = os.path.join(self.tmpdir, "seen.sqlite")
+        res = available.read_seen_db(tmp)
+        self.assertEqual(len(res), 0)
+        self.assertTrue(available._is_sqlite_seen_db(tmp))
+
+    def test_check__update_seen_sqlite(self):
+        """Test _update_seen() - sqlite"""
+        self.tmpdir = tempfile.mkdtemp()
+        json_fn = os.path.join(self.tmpdir, self.seen_db)
+        sqlite_fn = os.path.join(self.tmpdir, "seen.sqlite")
+        seen_db = {
+            "0ad": {"9": ["3401-1"], "10": ["3401-1"]},
+            "other": {"1": ["3401-1"]},
+        }
+        with open(json_fn, "w") as fh:
+            json.dump(seen_db, fh)
+
+        # import into a new sqlite seen db
+        available.import_seen_db(json_fn, sqlite_fn)
+        self.assertTrue(available._is_sqlite_seen_db(sqlite_fn))
+        self.assertEqual(available.read_seen_db(sqlite_fn), seen_db)
+
+        json_seen_db = available.read_seen_db(json_fn)
+        available._update_seen(json_fn, json_seen_db, self.pkg_db)
+        sqlite_seen_db = available.read_seen_db(sqlite_fn)
+        available._update_seen(sqlite_fn, sqlite_seen_db, self.pkg_db)
+
+        self.assertEqual(json_seen_db, sqlite_seen_db)
+        res = available.read_seen_db(sqlite_fn)
+        self.assertEqual(res, available.read_seen_db(json_fn))
+        self.assertEqual(len(res["0ad"]), 7)
+        for r in ["9", "10"]:
+            self.assertNotIn(r, res["0ad"])
+        self.assertEqual(res["0ad"]["11"], ["3501-1", "3602-1", "3606-1"])
+        self.assertEqual(res["other"], {"1": ["3401-1"]})
+
+    def test_check_import_seen_db_not_sqlite(self):
+        """Test import_seen_db() - not sqlite"""
+        self.tmpdir = tempfile.mkdtemp()
+        json_fn = os.path.join(self.tmpdir, self.seen_db)
+        available.read_seen_db(json_fn)
+        with self.assertRaises(ValueError):
+            available.import_seen_db(json_fn, json_fn)
+
     def test_check_scan_shared_publishers(self):
         """Test scan_shared_publishers()"""
         fn = "./tests/test-store-missing-shared-override.db"
@@ -1052,6 +1102,86 @@ Revision r12 (i386; channels: candidate, beta)
                 for sn in secnots:
                     self.assertIn(sn, body)
 
+    def test_check_scan_store_jobs(self):
+        """Test scan_store() - jobs"""
+        self.tmpdir = tempfile.mkdtemp()
+        store_db = []
+        for fn in [
+            self.store_fn,
+            "./tests/test-store-unittest-bad-1.db",
+            "./tests/test-store-os-release.db",
+            "./tests/test-store-missing-shared-override.db",
+            self.budgie_store_fn,
+        ]:
+            store_db += read_file_as_json_dict(fn)
+        store_fn = os.path.join(self.tmpdir, "store.db")
+        with open(store_fn, "w") as fh:
+            json.dump(store_db, fh)
+
+        res = {}
+        for jobs in [1, 3]:
+            seen_fn = os.path.join(self.tmpdir, "seen-%d.db" % jobs)
+            (sent, errors) = available.scan_store(
+                self.secnot_fn, store_fn, seen_fn, None, jobs=jobs
+            )
+            res[jobs] = (sent, errors, read_file_as_json_dict(seen_fn))
+
+        self.assertTrue(len(res[1][0]) > 1)
+        self.assertTrue(len(res[1][1]) > 0)
+        self.assertEqual(res[1], res[3])
+
+    def test_check_scan_store_sqlite_seen(self):
+        """Test scan_store() - sqlite seen db"""
+        self.tmpdir = tempfile.mkdtemp()
+        store_db = []
+        for fn in [self.store_fn, self.budgie_store_fn]:
+            store_db += read_file_as_json_dict(fn)
+        store_fn = os.path.join(self.tmpdir, "store.db")
+        with open(store_fn, "w") as fh:
+            json.dump(store_db, fh)
+
+        json_fn = os.path.join(self.tmpdir, self.seen_db)
+        json_res = available.scan_store(self.secnot_fn, store_fn, json_fn, None)
+        self.assertTrue(len(json_res[0]) > 1)
+
+        sqlite_fn = os.path.join(self.tmpdir, "seen.sqlite")
+        with patch(
+            "reviewtools.available._open_sqlite_seen_db",
+            wraps=available._open_sqlite_seen_db,
+        ) as mock_open:
+            sqlite_res = available.scan_store(self.secnot_fn, store_fn, sqlite_fn, None)
+        self.assertEqual(sqlite_res, json_res)
+        self.assertEqual(
+            available.read_seen_db(sqlite_fn), read_file_as_json_dict(json_fn)
+        )
+        # created and read by read_seen_db(), then one for all the updates
+        self.assertEqual(mock_open.call_count, 3)
+
+    def test_check_scan_store_memo(self):
+        """Test scan_store() - identical manifests"""
+        self.tmpdir = tempfile.mkdtemp()
+        store_db = read_file_as_json_dict(self.store_fn)
+        item = store_db[0]
+        for rev in item["revisions"]:
+            rev["manifest_yaml"] = item["revisions"][0]["manifest_yaml"]
+        store_fn = os.path.join(self.tmpdir, "store.db")
+        with open(store_fn, "w") as fh:
+            json.dump(store_db, fh)
+
+        expected = "secnot report memo: %d hits in %d lookups" % (
+            len(item["revisions"]) - 1,
+            len(item["revisions"]),
+        )
+        for jobs in [1, 3]:
+            with patch("reviewtools.available.debug") as debug:
+                (sent, errors) = available.scan_store(
+                    self.secnot_fn, store_fn, None, None, jobs=jobs
+                )
+            self.assertEqual(len(sent), 1)
+            self.assertTrue(
+                any(c[0][0].startswith(expected) for c in debug.call_args_list)
+            )
+
     def test_check_scan_store_with_pkgname(self):
         """Test scan_store() - with pkgname - snaps and rocks"""
         store_dbs = {
@@ -1422,3 +1552,364 @@ References:
         self.assertFalse(contains_stage_pkgs)
         self.assertFalse(contains_build_pkgs)
         self.assertEqual("", subj)
+
+    def _get_secnot_reports(self, secnot_db, store_fn, store_db_type="snap"):
+        """Return the (name, revision)s that each secnot is reported for by
+        get_pkg_revisions()"""
+        reports = {}
+        for item in read_file_as_json_dict(store_fn):
+            try:
+                pkg_db = store.get_pkg_revisions(item, secnot_db, {}, store_db_type)
+            except ValueError:
+                continue
+            for r in pkg_db["revisions"]:
+                report = pkg_db["revisions"][r]["secnot-report"]
+                for pkg_type in report:
+                    for pkg in report[pkg_type]:
+                        for secnot in report[pkg_type][pkg]:
+                            if secnot not in reports:
+                                reports[secnot] = set()
+                            reports[secnot].add((item["name"], r))
+        return reports
+
+    def test_check_update_affected_index(self):
+        """Test update_affected_index()"""
+        self.tmpdir = tempfile.mkdtemp()
+        index_fn = os.path.join(self.tmpdir, "affected.sqlite")
+
+        res = available.update_affected_index(self.store_fn, index_fn)
+        self.assertEqual(res, (len(self.store_db), 0, 0))
+        res = available.update_affected_index(self.store_fn, index_fn)
+        self.assertEqual(res, (0, len(self.store_db), 0))
+        # rocks are indexed separately
+        res = available.update_affected_index(self.rock_store_fn, index_fn, "rock")
+        self.assertEqual(res, (len(self.rock_store_db), 0, 0))
+
+        # a new revision of an item and a new item
+        store_fn = os.path.join(self.tmpdir, "store.db")
+        item = json.loads(json.dumps(self.store_db[0]))
+        item["revisions"].append(dict(item["revisions"][0], revision=99))
+        with open(store_fn, "w") as fh:
+            json.dump([item, self.budgie_store_db[0]], fh)
+        res = available.update_affected_index(store_fn, index_fn, merge=True)
+        self.assertEqual(res, (2, 0, 0))
+        affected = available.get_affected_by(self.secnot_db, index_fn, "3501-1")
+        self.assertIn(
+            ("snap", "0ad", "99"),
+            [(a["pkg_type"], a["name"], a["revision"]) for a in affected],
+        )
+
+        # without merge, the items not in the store db are removed
+        res = available.update_affected_index(self.store_fn, index_fn)
+        self.assertEqual(res, (1, 0, 1))
+        affected = available.get_affected_by(self.secnot_db, index_fn, "3501-1")
+        self.assertNotIn("99", [a["revision"] for a in affected])
+        self.assertEqual(
+            sorted(set((a["pkg_type"], a["name"]) for a in affected)),
+            [("rock", "redis"), ("snap", "0ad")],
+        )
+
+        # changed overrides reindex everything
+        with patch("reviewtools.overrides.update_binaries_ignore", ["libtiff5"]):
+            res = available.update_affected_index(self.store_fn, index_fn)
+        self.assertEqual(res, (len(self.store_db), 0, 0))
+
+    def test_check_get_affected_by(self):
+        """Test get_affected_by() matches the secnot reports"""
+        self.tmpdir = tempfile.mkdtemp()
+        for (secnot_fn, store_fn, store_db_type) in [
+            (self.secnot_fn, self.store_fn, "snap"),
+            (
+                self.secnot_build_and_stage_pkgs_fn,
+                "./tests/test-store-unittest-3.db",
+                "snap",
+            ),
+            (self.secnot_kernel_and_build_pkgs_fn, self.kernel_store_fn, "snap"),
+            (self.secnot_budgie_fn, self.budgie_store_fn, "snap"),
+            (self.secnot_lp1841848_fn, self.lp1841848_needed_store_fn, "snap"),
+            (self.secnot_fn, self.rock_store_fn, "rock"),
+        ]:
+            with self.subTest(secnot_fn=secnot_fn, store_fn=store_fn):
+                index_fn = os.path.join(self.tmpdir, os.path.basename(store_fn))
+                available.update_affected_index(store_fn, index_fn, store_db_type)
+                secnot_db = usn.read_usn_db(
+                    secnot_fn, support_non_lts=store_db_type == "rock"
+                )
+                reports = self._get_secnot_reports(secnot_db, store_fn, store_db_type)
+                self.assertTrue(len(reports) > 0)
+
+                secnot_db = usn.read_usn_db(secnot_fn, support_non_lts=True)
+                secnots = set()
+                for rel in secnot_db:
+                    for pkg in secnot_db[rel]:
+                        secnots.update(secnot_db[rel][pkg])
+                for secnot in secnots:
+                    affected = available.get_affected_by(secnot_db, index_fn, secnot)
+                    self.assertEqual(
+                        set((a["name"], a["revision"]) for a in affected),
+                        reports.get(secnot, set()),
+                        secnot,
+                    )
+
+    def test_check_get_affected_by_bad(self):
+        """Test get_affected_by() - unknown USN or index"""
+        self.tmpdir = tempfile.mkdtemp()
+        index_fn = os.path.join(self.tmpdir, "affected.sqlite")
+        with self.assertRaises(ValueError):
+            available.get_affected_by(self.secnot_db, index_fn, "3501-1")
+
+        available.update_affected_index(self.store_fn, index_fn)
+        with self.assertRaises(ValueError):
+            available.get_affected_by(self.secnot_db, index_fn, "9999-1")
+
+    def test_check_scan_affected_by(self):
+        """Test scan_affected_by()"""
+        self.tmpdir = tempfile.mkdtemp()
+        index_fn = os.path.join(self.tmpdir, "affected.sqlite")
+        available.update_affected_index(self.store_fn, index_fn)
+
+        res = json.loads(
+            available.scan_affected_by(self.secnot_fn, index_fn, "USN-3602-1")
+        )
+        self.assertTrue(len(res) > 0)
+        for a in res:
+            self.assertEqual(a["pkg_type"], "snap")
+            self.assertEqual(a["name"], "0ad")
+            self.assertEqual(a["release"], "xenial")
+            self.assertEqual(a["binary"], "libtiff5")
+        self.assertEqual(res, sorted(res, key=lambda a: a["revision"]))
+
+        # affects nothing in the index
+        available.update_affected_index("./tests/test-store-unittest-bare.db", index_fn)
+        res = available.scan_affected_by(self.secnot_fn, index_fn, "3602-1")
+        self.assertEqual(res, "")
+
+    def _get_delta_store_fn(self):
+        """Return a store db with an item that has errors and items that are
+        affected by different versions of the budgie USN db"""
+        store_db = read_file_as_json_dict(self.store_fn)
+        store_db += read_file_as_json_dict(self.budgie_store_fn)
+        store_db += read_file_as_json_dict(self.kernel_store_fn)
+        store_db += [
+            item
+            for item in read_file_as_json_dict("./tests/test-store-unittest-bad-1.db")
+            if item["name"] == "1ad"
+        ]
+        store_fn = os.path.join(self.tmpdir, "store.db")
+        with open(store_fn, "w") as fh:
+            json.dump(store_db, fh)
+        return store_fn
+
+    def _scan_store_delta(self, secnot_fn, store_fn, seen_fn, index_fn, jobs=1):
+        """Return the sent emails (that have a body), errors and delta scan
+        debug message of scan_store() with delta_index_fn"""
+        with patch("reviewtools.available.debug") as debug:
+            (sent, errors) = available.scan_store(
+                secnot_fn, store_fn, seen_fn, None, jobs=jobs, delta_index_fn=index_fn
+            )
+        msgs = [c[0][0] for c in debug.call_args_list if "delta scan" in c[0][0]]
+        self.assertEqual(len(msgs), 1)
+        return ([s for s in sent if s[2] is not None], errors, msgs[0])
+
+    def test_check_scan_store_delta(self):
+        """Test scan_store() - delta_index_fn"""
+        self.tmpdir = tempfile.mkdtemp()
+        store_fn = self._get_delta_store_fn()
+
+        for jobs in [1, 3]:
+            with self.subTest(jobs=jobs):
+                full_seen_fn = os.path.join(self.tmpdir, "seen-full-%d.db" % jobs)
+                seen_fn = os.path.join(self.tmpdir, "seen-delta-%d.db" % jobs)
+                index_fn = os.path.join(self.tmpdir, "affected-%d.sqlite" % jobs)
+                msgs = []
+                for secnot_fn in [
+                    "./tests/test-usn-budgie-1.db",
+                    "./tests/test-usn-budgie-2.db",
+                    self.secnot_budgie_fn,
+                    "./tests/test-usn-budgie-3.db",
+                    "./tests/test-usn-budgie-3.db",
+                ]:
+                    (sent, errors) = available.scan_store(
+                        secnot_fn, store_fn, full_seen_fn, None, jobs=jobs
+                    )
+                    expected = [s for s in sent if s[2] is not None]
+                    res = self._scan_store_delta(
+                        secnot_fn, store_fn, seen_fn, index_fn, jobs
+                    )
+                    self.assertEqual(res[0], expected)
+                    self.assertEqual(res[1], errors)
+                    self.assertEqual(
+                        read_file_as_json_dict(seen_fn),
+                        read_file_as_json_dict(full_seen_fn),
+                    )
+                    msgs.append(res[2])
+
+                # the first scan is a full one, the item with errors is always
+                # scanned and those with binaries with new secnots are
+                self.assertEqual(
+                    msgs,
+                    [
+                        "delta scan: 4 changed and 0 affected items scanned, "
+                        "0 skipped",
+                        "delta scan: 1 changed and 1 affected items scanned, "
+                        "2 skipped",
+                        "delta scan: 1 changed and 0 affected items scanned, "
+                        "3 skipped",
+                        "delta scan: 1 changed and 2 affected items scanned, "
+                        "1 skipped",
+                        "delta scan: 1 changed and 0 affected items scanned, "
+                        "3 skipped",
+                    ],
+                )
+                # nothing new to report
+                self.assertEqual(res[0], [])
+
+    def test_check_scan_store_delta_store_db(self):
+        """Test scan_store() - delta_index_fn with store db changes"""
+        self.tmpdir = tempfile.mkdtemp()
+        index_fn = os.path.join(self.tmpdir, "affected.sqlite")
+        store_fn = self._get_delta_store_fn()
+        res = self._scan_store_delta(self.secnot_fn, store_fn, None, index_fn)
+        self.assertEqual(len(res[0]), 2)
+        res = self._scan_store_delta(self.secnot_fn, store_fn, None, index_fn)
+        self.assertEqual(len(res[0]), 0)
+
+        # updating the index doesn't count as a scan of the changed items
+        store_db = read_file_as_json_dict(store_fn)
+        item = store_db[0]
+        self.assertEqual(item["name"], "0ad")
+        item["revisions"].append(dict(item["revisions"][0], revision=99))
+        store_db = [item] + [
+            i for i in store_db[1:] if i["name"] != "ubuntu-budgie-welcome"
+        ]
+        with open(store_fn, "w") as fh:
+            json.dump(store_db, fh)
+        available.update_affected_index(store_fn, index_fn, merge=True)
+
+        res = self._scan_store_delta(self.secnot_fn, store_fn, None, index_fn)
+        self.assertEqual(len(res[0]), 1)
+        self.assertIn("Revision r99", res[0][0][2])
+        self.assertEqual(
+            res[2], "delta scan: 2 changed and 0 affected items scanned, 1 skipped"
+        )
+        # the items no longer in the store db are removed from the index
+        affected = available.get_affected_by(self.secnot_budgie_db, index_fn, "3598-1")
+        self.assertEqual(sorted(set(a["name"] for a in affected)), ["0ad"])
+
+    def test_check_scan_store_delta_fail(self):
+        """Test scan_store() - delta_index_fn not updated on failure"""
+        self.tmpdir = tempfile.mkdtemp()
+        index_fn = os.path.join(self.tmpdir, "affected.sqlite")
+        seen_fn = os.path.join(self.tmpdir, "seen.db")
+        store_fn = self._get_delta_store_fn()
+
+        with patch(
+            "reviewtools.available._update_seen", side_effect=OSError("disk full")
+        ):
+            with self.assertRaises(OSError):
+                available.scan_store(
+                    self.secnot_fn, store_fn, seen_fn, None, delta_index_fn=index_fn
+                )
+
+        res = self._scan_store_delta(self.secnot_fn, store_fn, seen_fn, index_fn)
+        self.assertEqual(len(res[0]), 2)
+        self.assertEqual(
+            res[2], "delta scan: 4 changed and 0 affected items scanned, 0 skipped"
+        )
+
+    def test_check_scan_store_delta_setup_fail(self):
+        """Test scan_store() - delta_index_fn closed when reading it fails"""
+        self.tmpdir = tempfile.mkdtemp()
+        index_fn = os.path.join(self.tmpdir, "affected.sqlite")
+        seen_fn = os.path.join(self.tmpdir, "seen.sqlite")
+        store_fn = self._get_delta_store_fn()
+
+        conns = []
+        orig_open = available._open_affected_index
+
+        def _open(fn):
+            conns.append(orig_open(fn))
+            return conns[-1]
+
+        for jobs in [1, 3]:
+            with self.subTest(jobs=jobs):
+                conns.clear()
+                with patch(
+                    "reviewtools.available._open_affected_index", side_effect=_open
+                ), patch(
+                    "reviewtools.available._get_changed_secnots",
+                    side_effect=ValueError("bad usn db"),
+                ):
+                    with self.assertRaises(ValueError):
+                        available.scan_store(
+                            self.secnot_fn,
+                            store_fn,
+                            seen_fn,
+                            None,
+                            jobs=jobs,
+                            delta_index_fn=index_fn,
+                        )
+                self.assertEqual(len(conns), 1)
+                with self.assertRaises(sqlite3.ProgrammingError):
+                    conns[0].execute("SELECT 1")
+
+    def test_check_scan_store_delta_email_fail(self):
+        """Test scan_store() - delta_index_fn rescans items with errors"""
+        self.tmpdir = tempfile.mkdtemp()
+        index_fn = os.path.join(self.tmpdir, "affected.sqlite")
+        seen_fn = os.path.join(self.tmpdir, "seen.db")
+        store_fn = self._get_delta_store_fn()
+        self._scan_store_delta(
+            "./tests/test-usn-budgie-1.db", store_fn, seen_fn, index_fn
+        )
+
+        # ubuntu-budgie-welcome is unchanged and only affected by the new
+        # secnots
+        real_email_report_for_pkg = available._email_report_for_pkg
+
+        def _email_report_for_pkg(pkg_db, seen_db):
+            if pkg_db["name"] == "ubuntu-budgie-welcome":
+                raise OSError("smtp down")
+            return real_email_report_for_pkg(pkg_db, seen_db)
+
+        with patch(
+            "reviewtools.available._email_report_for_pkg",
+            side_effect=_email_report_for_pkg,
+        ):
+            res = self._scan_store_delta(
+                "./tests/test-usn-budgie-2.db", store_fn, seen_fn, index_fn
+            )
+        self.assertEqual(res[0], [])
+        self.assertEqual(res[1]["ubuntu-budgie-welcome"], ["smtp down"])
+        self.assertEqual(
+            res[2], "delta scan: 1 changed and 1 affected items scanned, 2 skipped"
+        )
+
+        res = self._scan_store_delta(
+            "./tests/test-usn-budgie-2.db", store_fn, seen_fn, index_fn
+        )
+        self.assertEqual(len(res[0]), 1)
+        self.assertEqual(
+            res[0][0][1], "ubuntu-budgie-welcome contains outdated Ubuntu packages"
+        )
+        self.assertEqual(
+            res[2], "delta scan: 2 changed and 0 affected items scanned, 2 skipped"
+        )
+
+        # and once reported, it is skipped again
+        res = self._scan_store_delta(
+            "./tests/test-usn-budgie-2.db", store_fn, seen_fn, index_fn
+        )
+        self.assertEqual(res[0], [])
+        self.assertEqual(
+            res[2], "delta scan: 1 changed and 0 affected items scanned, 3 skipped"
+        )
+
+    def test_check_scan_store_delta_with_pkgname(self):
+        """Test scan_store() - delta_index_fn with pkgname"""
+        self.tmpdir = tempfile.mkdtemp()
+        index_fn = os.path.join(self.tmpdir, "affected.sqlite")
+        with self.assertRaises(ValueError):
+            available.scan_store(
+                self.secnot_fn, self.store_fn, None, "0ad", delta_index_fn=index_fn
+            )
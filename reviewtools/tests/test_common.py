@@ -15,9 +15,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import copy
+import glob
+import json
 import os
+import re
 import shutil
 import tempfile
+import yaml
+from unittest.mock import patch
 
 from reviewtools.sr_common import SnapReview, ReviewException
 import reviewtools.sr_tests as sr_tests
@@ -132,6 +137,54 @@ exit 1
         self.assertEqual(rc, 1)
         self.assertTrue("unsquashfs failure" in out)
 
+    def test_get_squashfs_metadata(self):
+        """Test get_squashfs_metadata() - unsquashfs run once per query"""
+        output_dir = self.mkdtemp()
+        package = utils.make_snap2(output_dir=output_dir)
+        self.addCleanup(reviewtools.common.cleanup_unpack)
+
+        # fake unsquashfs that logs its invocations
+        log = os.path.join(output_dir, "unsquashfs.log")
+        unsquashfs = os.path.join(output_dir, "unsquashfs")
+        content = (
+            """#!/bin/sh
+echo "$1" >> %s
+if [ "$1" = "-lln" ]; then
+    echo "drwxr-xr-x 0/0                29 2016-03-11 12:25 squashfs-root"
+fi
+exit 0
+"""
+            % log
+        )
+        with open(unsquashfs, "w") as f:
+            f.write(content)
+        os.chmod(unsquashfs, 0o775)
+
+        old_path = os.environ["PATH"]
+        os.environ["PATH"] = "%s:%s" % (output_dir, old_path)
+        self.addCleanup(os.environ.__setitem__, "PATH", old_path)
+
+        metadata = reviewtools.common.get_squashfs_metadata(package)
+        self.assertIs(
+            metadata,
+            reviewtools.common.get_squashfs_metadata(os.path.relpath(package)),
+        )
+        for i in range(2):
+            rc, out = reviewtools.common.unsquashfs_lln(package)
+            self.assertEqual(rc, 0)
+            hdr, entries = metadata.lln_parse()
+            self.assertIs(entries, metadata.lln_parse()[1])
+            reviewtools.common._calculate_snap_unsquashfs_uncompressed_size(package)
+            metadata.stat()
+            metadata.fstime()
+
+        with open(log, "r") as f:
+            self.assertEqual(f.read().splitlines(), ["-lln", "-stat", "-fstime"])
+
+        # a changed package is queried again
+        os.utime(package, ns=(0, 0))
+        self.assertIsNot(metadata, reviewtools.common.get_squashfs_metadata(package))
+
     def test_unsquashfs_lln_parse_good(self):
         """Test unsquashfs_lln_parse() - good"""
         input = """Parallel unsquashfs: Using 4 processors
@@ -699,3 +752,408 @@ drwxr-xr-x 0/0                48 2020-03-24 09:11 squashfs-root/meta
             e.exception.value,
             "Unexpected number of layer tar archives inside layer directory: 2",
         )
+
+    def test_read_file_as_json_array_items(self):
+        """Test read_file_as_json_array_items()"""
+        fn = "./tests/test-store-unittest-1.db"
+        with open(fn, "r") as fh:
+            expected = json.load(fh)
+        for chunk_size in [1, 7, 4096, 1024 * 1024]:
+            res = list(
+                reviewtools.common.read_file_as_json_array_items(
+                    fn, chunk_size=chunk_size
+                )
+            )
+            self.assertEqual(expected, res)
+
+    def test_read_file_as_json_array_items_empty(self):
+        """Test read_file_as_json_array_items() - empty array"""
+        fn = os.path.join(self.mkdtemp(), "empty.json")
+        with open(fn, "w") as fh:
+            fh.write(" [ ]\n")
+        res = list(reviewtools.common.read_file_as_json_array_items(fn))
+        self.assertEqual(res, [])
+
+    def test_read_file_as_json_array_items_invalid(self):
+        """Test read_file_as_json_array_items() - invalid"""
+        tmpdir = self.mkdtemp()
+        for content in ['{"foo": 1}', '[{"foo": 1}', '[{"foo": 1} {}]']:
+            fn = os.path.join(tmpdir, "invalid.json")
+            with open(fn, "w") as fh:
+                fh.write(content)
+            with self.assertRaises(ValueError):
+                list(reviewtools.common.read_file_as_json_array_items(fn))
+
+    def test_is_elf_file(self):
+        """Test _is_elf_file()"""
+        tmpdir = self.mkdtemp()
+        elf = os.path.join(tmpdir, "elf")
+        with open(elf, "wb") as fh:
+            fh.write(b"\x7fELF\x02\x01\x01")
+        script = os.path.join(tmpdir, "script")
+        with open(script, "w") as fh:
+            fh.write("#!/bin/sh\n")
+        short = os.path.join(tmpdir, "short")
+        with open(short, "wb") as fh:
+            fh.write(b"\x7fE")
+        link = os.path.join(tmpdir, "link")
+        os.symlink(elf, link)
+
+        self.assertTrue(reviewtools.common._is_elf_file(elf))
+        self.assertFalse(reviewtools.common._is_elf_file(script))
+        self.assertFalse(reviewtools.common._is_elf_file(short))
+        self.assertFalse(reviewtools.common._is_elf_file(link))
+        self.assertFalse(reviewtools.common._is_elf_file(tmpdir))
+        self.assertFalse(
+            reviewtools.common._is_elf_file(os.path.join(tmpdir, "nonexistent"))
+        )
+
+    def _mock_unpack_cache(self, max_size=None):
+        """Enable the unpack cache in a temp dir with a fake unpack_pkg()"""
+        env = {"RT_UNPACK_CACHE": os.path.join(self.mkdtemp(), "cache")}
+        if max_size is not None:
+            env["RT_UNPACK_CACHE_MAX_SIZE"] = str(max_size)
+        p = patch.dict(os.environ, env)
+        p.start()
+        self.addCleanup(p.stop)
+        self.addCleanup(reviewtools.common.cleanup_unpack)
+
+        unpacked = []
+
+        def _unpack_pkg(fn, dest=None, items=[]):
+            unpacked.append(fn)
+            os.makedirs(os.path.join(dest, "snap"))
+            with open(os.path.join(dest, "snap/manifest.yaml"), "w") as fh:
+                fh.write("fn: %s\n" % os.path.basename(fn))
+            return dest
+
+        p = patch("reviewtools.common.unpack_pkg", _unpack_pkg)
+        p.start()
+        self.addCleanup(p.stop)
+        return (env["RT_UNPACK_CACHE"], unpacked)
+
+    def _mock_pkg(self, content):
+        fn = os.path.join(self.mkdtemp(), "%s.snap" % content)
+        with open(fn, "w") as fh:
+            fh.write(content)
+        return fn
+
+    def test_unpack_pkg_cached_disabled(self):
+        """Test unpack_pkg_cached() - disabled"""
+        with patch.dict(os.environ):
+            os.environ.pop("RT_UNPACK_CACHE", None)
+            self.assertIsNone(reviewtools.common.get_unpack_cache_dir())
+            self.assertIsNone(reviewtools.common.unpack_pkg_cached("foo.snap"))
+
+    def test_unpack_pkg_cached(self):
+        """Test unpack_pkg_cached()"""
+        (cache, unpacked) = self._mock_unpack_cache()
+        fn = self._mock_pkg("foo")
+
+        d = reviewtools.common.unpack_pkg_cached(fn)
+        self.assertEqual(d, os.path.join(cache, reviewtools.common.sha512sum(fn)))
+        self.assertTrue(os.path.isfile(os.path.join(d, "snap/manifest.yaml")))
+        self.assertEqual(unpacked, [fn])
+
+        # reused by a later run, even under another name
+        reviewtools.common.cleanup_unpack()
+        self.assertTrue(os.path.isdir(d))
+        copy_fn = os.path.join(self.mkdtemp(), "copy.snap")
+        shutil.copy(fn, copy_fn)
+        self.assertEqual(reviewtools.common.unpack_pkg_cached(copy_fn), d)
+        self.assertEqual(unpacked, [fn])
+
+    def test_unpack_pkg_cached_evict(self):
+        """Test unpack_pkg_cached() - evict least recently used"""
+        (cache, unpacked) = self._mock_unpack_cache(max_size=0)
+        fns = [self._mock_pkg(c) for c in ["foo", "bar", "baz"]]
+
+        dirs = []
+        for fn in fns[:2]:
+            dirs.append(reviewtools.common.unpack_pkg_cached(fn))
+            reviewtools.common.cleanup_unpack()
+        # in use, so not evicted
+        dirs.append(reviewtools.common.unpack_pkg_cached(fns[2]))
+        self.assertFalse(os.path.exists(dirs[0]))
+        self.assertFalse(os.path.exists(dirs[1]))
+        self.assertTrue(os.path.isdir(dirs[2]))
+        self.assertEqual(
+            sorted(os.listdir(cache)),
+            sorted([os.path.basename(dirs[2]), os.path.basename(dirs[2]) + ".lock"]),
+        )
+
+    def test_get_snap_manifest_unpack_cache(self):
+        """Test get_snap_manifest() - unpack cache"""
+        (cache, unpacked) = self._mock_unpack_cache()
+        fn = self._mock_pkg("foo")
+        d = reviewtools.common.unpack_pkg_cached(fn)
+        reviewtools.common.cleanup_unpack()
+
+        (man, dpkg) = reviewtools.common.get_snap_manifest(fn)
+        self.assertEqual(man, {"fn": "foo.snap"})
+        self.assertIsNone(dpkg)
+        self.assertEqual(unpacked, [fn])
+        self.assertTrue(os.path.isdir(d))
+        self.assertEqual(reviewtools.common.UNPACK_CACHE_LOCKS, {})
+
+    def test_read_snapd_base_declaration_cached(self):
+        """Test read_snapd_base_declaration() - parsed once, copies returned"""
+        with patch(
+            "reviewtools.common.yaml_safe_load",
+            wraps=reviewtools.common.yaml_safe_load,
+        ) as m:
+            reviewtools.common.BASE_DECLARATION_CACHE = {}
+            (series, decl) = reviewtools.common.read_snapd_base_declaration()
+            self.assertEqual(series, "16")
+            self.assertIn("plugs", decl)
+            decl["plugs"]["nonexistent"] = {}
+
+            (series, decl2) = reviewtools.common.read_snapd_base_declaration()
+            self.assertNotIn("nonexistent", decl2["plugs"])
+            self.assertEqual(m.call_count, 1)
+
+    def test_yaml_safe_load(self):
+        """Test yaml_safe_load()"""
+        if hasattr(yaml, "CSafeLoader"):
+            self.assertEqual(reviewtools.common.YAML_SAFE_LOADER, yaml.CSafeLoader)
+        for y in ["", "foo", "a: 1\nb: [yes, 1.0, null]", b"a: 1", "a: !!str 1"]:
+            self.assertEqual(reviewtools.common.yaml_safe_load(y), yaml.safe_load(y))
+
+        with open("./reviewtools/data/snapd-base-declaration.yaml") as fh:
+            self.assertIn("16", reviewtools.common.yaml_safe_load(fh))
+
+        for y in ["a: !!python/name:os.system", "a: [", "a: 1\n- b"]:
+            with self.assertRaises(yaml.YAMLError):
+                reviewtools.common.yaml_safe_load(y)
+
+    def test_yaml_safe_load_duplicate_keys(self):
+        """Test yaml_safe_load() - duplicate keys"""
+        for y in [
+            "key: 1\nkey: 2",
+            "map:\n key:\n key:",
+            "- a: 1\n  b: {key: 1, key: 2}",
+            "key: 1\n'key': 2",
+            "1: a\n0x1: b",
+        ]:
+            # the last value wins by default, like yaml.safe_load()
+            self.assertEqual(reviewtools.common.yaml_safe_load(y), yaml.safe_load(y))
+            with self.assertRaises(reviewtools.common.YamlDuplicateKeyError) as e:
+                reviewtools.common.yaml_safe_load(y, allow_duplicate_keys=False)
+            self.assertRegex(e.exception.problem, r'^found duplicate key ".*"$')
+            self.assertIsInstance(e.exception, yaml.YAMLError)
+
+        for y in [
+            "key: 1\nKey: 2\nmap: {key: 1}",
+            "base: &base {a: 1, b: 2}\nover:\n  <<: *base\n  b: 3",
+            "[{key: 1}, {key: 2}]",
+        ]:
+            self.assertEqual(
+                reviewtools.common.yaml_safe_load(y, allow_duplicate_keys=False),
+                yaml.safe_load(y),
+            )
+
+    def _check_yaml_loaders_agree(self, data, what):
+        """Check yaml_safe_load() and the pure-python yaml.SafeLoader parse
+           data the same"""
+        try:
+            expected = yaml.load(data, Loader=yaml.SafeLoader)
+        except yaml.YAMLError:
+            with self.assertRaises(yaml.YAMLError, msg=what):
+                reviewtools.common.yaml_safe_load(data)
+            return False
+
+        # repr() so that eg, 1, 1.0 and True are told apart
+        res = reviewtools.common.yaml_safe_load(data)
+        self.assertEqual(repr(res), repr(expected), what)
+        try:
+            res = reviewtools.common.yaml_safe_load(data, allow_duplicate_keys=False)
+            self.assertEqual(repr(res), repr(expected), what)
+        except reviewtools.common.YamlDuplicateKeyError:
+            pass
+        return True
+
+    def test_yaml_safe_load_fixtures(self):
+        """Test yaml_safe_load() matches yaml.SafeLoader on the test yaml"""
+        count = 0
+        for fn in sorted(glob.glob("./tests/*.db")):
+            with open(fn) as fh:
+                db = json.load(fh)
+            if not isinstance(db, list):  # USN databases
+                continue
+            for item in db:
+                for rev in item.get("revisions", []):
+                    if "manifest_yaml" in rev:
+                        what = "%s: %s r%s" % (fn, item["name"], rev["revision"])
+                        self._check_yaml_loaders_agree(rev["manifest_yaml"], what)
+                        count += 1
+
+        # id|revision|<yaml>, as read by dump-tool
+        for fn in sorted(glob.glob("./tests/test-store-dump.[0-9]")):
+            with open(fn) as fh:
+                dump = fh.read()
+            for y in re.split(r"^[a-zA-Z0-9]{32}\|[0-9]+\|", dump, flags=re.M):
+                if y.strip() != "":
+                    self._check_yaml_loaders_agree(y, fn)
+                    count += 1
+
+        with open("./reviewtools/data/snapd-base-declaration.yaml") as fh:
+            self.assertTrue(self._check_yaml_loaders_agree(fh.read(), fh.name))
+        self.assertGreater(count, 50)
+
+    def test_yaml_safe_load_fixtures_snaps(self):
+        """Test yaml_safe_load() matches yaml.SafeLoader on the test snaps"""
+        count = 0
+        for fn in sorted(glob.glob("./tests/*.snap")):
+            items = ["meta/snap.yaml", "snap/manifest.yaml"]
+            # unpack_pkg() is mocked by TestSnapReview
+            d = reviewtools.common._unpack_snap_squashfs(fn, None, items)
+            self.addCleanup(shutil.rmtree, d)
+            for item in items:
+                item_fn = os.path.join(d, item)
+                if os.path.isfile(item_fn):
+                    with open(item_fn, "rb") as fh:
+                        what = "%s: %s" % (fn, item)
+                        self._check_yaml_loaders_agree(fh.read(), what)
+                    count += 1
+        self.assertGreater(count, 90)
+
+    def test_timer(self):
+        """Test Timer, timings_summary() and timings_write_trace()"""
+        p = patch("reviewtools.common.TIMINGS", None)
+        p.start()
+        self.addCleanup(p.stop)
+
+        # disabled by default
+        with reviewtools.common.Timer("check", "foo"):
+            pass
+        self.assertIsNone(reviewtools.common.TIMINGS)
+
+        reviewtools.common.timings_enable()
+        with reviewtools.common.Timer("check", "foo"):
+            reviewtools.common.cmd(["true"])
+        with self.assertRaises(ValueError):
+            with reviewtools.common.Timer("check", "foo"):
+                raise ValueError("still recorded")
+        timings = reviewtools.common.TIMINGS
+        self.assertEqual(
+            [(t["category"], t["name"]) for t in timings],
+            [("cmd", "true"), ("check", "foo"), ("check", "foo")],
+        )
+        self.assertEqual(timings[0]["args"], {"argv": ["true"]})
+        self.assertLessEqual(timings[0]["wall"], timings[1]["wall"])
+
+        summary = reviewtools.common.timings_summary(timings)
+        self.assertEqual(sorted(summary), ["check", "cmd"])
+        self.assertEqual(summary["check"]["foo"]["count"], 2)
+        self.assertEqual(summary["cmd"]["true"]["count"], 1)
+        self.assertEqual(
+            sorted(summary["cmd"]["true"]), ["child_cpu", "count", "cpu", "wall"]
+        )
+
+        fn = os.path.join(self.mkdtemp(), "trace.json")
+        reviewtools.common.timings_write_trace(timings, fn)
+        with open(fn) as f:
+            events = json.load(f)["traceEvents"]
+        self.assertEqual(len(events), 3)
+        self.assertEqual(events[0]["name"], "true")
+        self.assertEqual(events[0]["cat"], "cmd")
+        self.assertEqual(events[0]["ph"], "X")
+        self.assertEqual(events[0]["args"]["argv"], ["true"])
+
+    def test_files_identical(self):
+        """Test files_identical()"""
+        d = self.mkdtemp()
+        fns = {}
+        for name, data in [
+            ("a", b"x" * 10),
+            ("b", b"x" * 10),
+            ("c", b"x" * 9 + b"y"),
+            ("d", b"x" * 11),
+        ]:
+            fns[name] = os.path.join(d, name)
+            with open(fns[name], "wb") as f:
+                f.write(data)
+
+        self.assertTrue(reviewtools.common.files_identical(fns["a"], fns["b"]))
+        self.assertTrue(
+            reviewtools.common.files_identical(fns["a"], fns["b"], blocksize=3)
+        )
+        self.assertFalse(
+            reviewtools.common.files_identical(fns["a"], fns["c"], blocksize=3)
+        )
+        self.assertFalse(reviewtools.common.files_identical(fns["a"], fns["d"]))
+        with self.assertRaises(OSError):
+            reviewtools.common.files_identical(fns["a"], os.path.join(d, "e"))
+
+    def test_resquash_cache(self):
+        """Test ResquashCache and open_resquash_cache()"""
+        with patch.dict(os.environ):
+            os.environ.pop("RT_RESQUASH_CACHE", None)
+            self.assertIsNone(reviewtools.common.open_resquash_cache())
+
+            os.environ["RT_RESQUASH_CACHE"] = os.path.join(self.mkdtemp(), "r.sqlite")
+            os.environ["RT_RESQUASH_CACHE_MAX_ENTRIES"] = "2"
+            cache = reviewtools.common.open_resquash_cache()
+            self.assertEqual(cache.max_entries, 2)
+            self.assertIsNone(cache.get("a"))
+            cache.put("a", True)
+            cache.put("b", False)
+            cache.close()
+
+            cache = reviewtools.common.open_resquash_cache()
+            self.assertFalse(cache.get("b"))
+            cache.close()
+
+            cache = reviewtools.common.open_resquash_cache()
+            self.assertTrue(cache.get("a"))
+            cache.put("c", True)
+            with patch("reviewtools.common.time.time", return_value=2 ** 40):
+                cache.close()
+
+            # "b" was the least recently used
+            cache = reviewtools.common.open_resquash_cache()
+            self.assertIsNone(cache.get("b"))
+            self.assertTrue(cache.get("a"))
+            self.assertTrue(cache.get("c"))
+            cache.close()
+
+    def test_resquash_cache_key(self):
+        """Test resquash_cache_key()"""
+        fn = os.path.join(self.mkdtemp(), "test.snap")
+        with open(fn, "wb") as f:
+            f.write(b"squashfs")
+        with patch(
+            "reviewtools.common.squashfs_tools_version", return_value=["4.5", "4.5"]
+        ), patch("reviewtools.common.os.geteuid", return_value=1000):
+            key = reviewtools.common.resquash_cache_key(fn, "xz", "1")
+            self.assertEqual(key, reviewtools.common.resquash_cache_key(fn, "xz", "1"))
+            self.assertNotEqual(
+                key, reviewtools.common.resquash_cache_key(fn, "gzip", "1")
+            )
+            self.assertNotEqual(
+                key, reviewtools.common.resquash_cache_key(fn, "xz", "2")
+            )
+            with patch.dict(os.environ, {"SNAP_FAKEROOT_RESQUASHFS": "1"}):
+                fakeroot_key = reviewtools.common.resquash_cache_key(fn, "xz", "1")
+                self.assertNotEqual(key, fakeroot_key)
+            # unsquashfs as root keeps ownership like fakeroot does
+            with patch("reviewtools.common.os.geteuid", return_value=0):
+                root_key = reviewtools.common.resquash_cache_key(fn, "xz", "1")
+            self.assertNotEqual(key, root_key)
+            self.assertEqual(fakeroot_key, root_key)
+
+            # a cache shared by root and non-root runs misses across them
+            cache_fn = os.path.join(self.mkdtemp(), "r.sqlite")
+            cache = reviewtools.common.ResquashCache(cache_fn)
+            cache.put(key, True)
+            cache.close()
+            cache = reviewtools.common.ResquashCache(cache_fn)
+            self.assertTrue(cache.get(key))
+            self.assertIsNone(cache.get(root_key))
+            cache.close()
+        with patch(
+            "reviewtools.common.squashfs_tools_version", return_value=["4.6", "4.6"]
+        ):
+            self.assertNotEqual(
+                key, reviewtools.common.resquash_cache_key(fn, "xz", "1")
+            )
@@ -15,7 +15,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from unittest import TestCase
-from reviewtools.debversion import DebVersion, compare, _order
+import random
+
+from reviewtools.debversion import DebVersion, compare, parse, _order, _verrevcomp
 
 
 class TestDebVersion(TestCase):
@@ -195,3 +197,67 @@ class TestDebVersion(TestCase):
         for ver, expected in expected_db:
             res = _order(ver)
             self.assertEqual(res, expected)
+
+    def test_check_version_operators(self):
+        """Test DebVersion comparison operators"""
+        for (av, bv, expected) in [
+            ("1.2-3", "1.2-3build1", -1),
+            ("1.2-3", "1.2-3~foo", 1),
+            ("1:0", "2", 1),
+            ("0-00", "00-0", 0),
+            ("1.0", "1.0~", 1),
+            ("1.0", "1.0.", -1),
+            ("1.0a", "1.0~a", 1),
+        ]:
+            a = DebVersion(av)
+            b = DebVersion(bv)
+            self.assertEqual(a < b, expected < 0)
+            self.assertEqual(a <= b, expected <= 0)
+            self.assertEqual(a > b, expected > 0)
+            self.assertEqual(a >= b, expected >= 0)
+            self.assertEqual(a == b, expected == 0)
+            self.assertEqual(a != b, expected != 0)
+
+    def test_check_version_hash(self):
+        """Test hash(DebVersion)"""
+        self.assertEqual(hash(DebVersion("0-00")), hash(DebVersion("00-0")))
+        self.assertEqual(len({DebVersion("1:1.0-0"), DebVersion("1:1.0")}), 1)
+        self.assertNotEqual(DebVersion("1.0"), "1.0")
+
+    def test_check_version_compare_verrevcomp(self):
+        """Test compare(a, b) agrees with _verrevcomp()"""
+
+        def _compare(a, b):
+            if a.epoch != b.epoch:
+                return a.epoch - b.epoch
+            rc = _verrevcomp(a.version, b.version)
+            if rc != 0:
+                return rc
+            return _verrevcomp(a.revision, b.revision)
+
+        random.seed(0)
+        versions = []
+        while len(versions) < 300:
+            v = "".join(random.choice("0019az~+.-:") for i in range(8))
+            try:
+                versions.append(DebVersion(v))
+            except ValueError:
+                continue
+
+        for a in versions:
+            for b in versions:
+                expected = _compare(a, b)
+                self.assertEqual(
+                    compare(a, b), (expected > 0) - (expected < 0), "%s %s" % (a, b)
+                )
+
+    def test_check_parse(self):
+        """Test parse()"""
+        v = parse("1:1.0-1")
+        self.assertEqual(v.full_version, "1:1.0-1")
+        self.assertIs(parse("1:1.0-1"), v)
+
+    def test_check_parse_invalid(self):
+        """Test parse() - invalid"""
+        with self.assertRaises(ValueError):
+            parse("1-2-")
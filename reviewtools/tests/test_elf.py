@@ -0,0 +1,426 @@
+"""test_elf.py: tests for the elf module"""
+#
+# Copyright (C) 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import time
+from unittest import TestCase
+
+from unittest.mock import patch
+
+from reviewtools.elf import (
+    ElfError,
+    SymbolCache,
+    demangle,
+    global_symbols,
+    has_execstack,
+    open_symbol_cache,
+    read_dynamic_symbols,
+)
+
+
+def _strtab(names):
+    """Return a string table with names and their offsets"""
+    data = b"\0"
+    offsets = {}
+    for name in names:
+        offsets[name] = len(data)
+        data += name.encode() + b"\0"
+    return (data, offsets)
+
+
+def make_elf(fn):
+    """Write a minimal 64-bit little endian shared object with versioned
+       dynamic symbols
+    """
+    (dynstr, dynstr_off) = _strtab(
+        ["libtest.so", "VERS_0", "VERS_1", "foo", "bar", "baz", "undef", "_ZdaPv"]
+        + ["local"]
+    )
+    shnames = [".text", ".data", ".bss", ".dynstr", ".dynsym", ".gnu.version"]
+    shnames += [".gnu.version_d", ".shstrtab"]
+    (shstrtab, shstrtab_off) = _strtab(shnames)
+
+    # (name, info, shndx, versym)
+    symbols = [
+        ("", 0, 0, 0),
+        ("foo", 0x12, 1, 2),  # global func in .text
+        ("bar", 0x11, 2, 0x8003),  # global object in .data, hidden version
+        ("baz", 0x21, 3, 1),  # weak object in .bss
+        ("undef", 0x12, 0, 1),  # undefined
+        ("_ZdaPv", 0x12, 1, 2),  # mangled
+        ("VERS_1", 0x11, 0xFFF1, 2),  # version definition
+        ("local", 0x02, 1, 0),  # local func
+    ]
+    dynsym = b"".join(
+        struct.pack("<IBBHQQ", dynstr_off[n] if n else 0, i, 0, s, 0, 0)
+        for (n, i, s, v) in symbols
+    )
+    versym = b"".join(struct.pack("<H", v) for (n, i, s, v) in symbols)
+    verdef = b""
+    for (ndx, name) in [(1, "libtest.so"), (2, "VERS_1"), (3, "VERS_0")]:
+        verdef += struct.pack(
+            "<HHHHIII", 1, ndx == 1, ndx, 1, 0, 20, 28 if ndx < 3 else 0
+        )
+        verdef += struct.pack("<II", dynstr_off[name], 0)
+
+    # (name, type, flags, data, link)
+    sections = [
+        (".text", 1, 0x6, b"\xc3" * 16, 0),
+        (".data", 1, 0x3, b"\0" * 16, 0),
+        (".bss", 8, 0x3, b"", 0),
+        (".dynstr", 3, 0x2, dynstr, 0),
+        (".dynsym", 11, 0x2, dynsym, 4),
+        (".gnu.version", 0x6FFFFFFF, 0x2, versym, 5),
+        (".gnu.version_d", 0x6FFFFFFD, 0x2, verdef, 4),
+        (".shstrtab", 3, 0, shstrtab, 0),
+    ]
+
+    data = b""
+    shdrs = [b"\0" * 64]
+    offset = 64
+    for (name, typ, flags, content, link) in sections:
+        shdrs.append(
+            struct.pack(
+                "<IIQQQQIIQQ",
+                shstrtab_off[name],
+                typ,
+                flags,
+                offset,
+                offset,
+                len(content) if typ != 8 else 16,
+                link,
+                3 if name == ".gnu.version_d" else 0,
+                1,
+                {11: 24, 0x6FFFFFFF: 2}.get(typ, 0),
+            )
+        )
+        data += content
+        offset += len(content)
+
+    ehdr = b"\x7fELF\x02\x01\x01" + b"\0" * 9
+    ehdr += struct.pack(
+        "<HHIQQQIHHHHHH", 3, 62, 1, 0, 0, offset, 0, 64, 0, 0, 64, len(shdrs), 8
+    )
+    with open(fn, "wb") as f:
+        f.write(ehdr + data + b"".join(shdrs))
+
+
+def patch_elf(fn, offset, fmt, value, section=None):
+    """Overwrite the field of the given struct format at offset of fn (or of
+       its section header section, for 64-bit little endian files)
+    """
+    with open(fn, "r+b") as f:
+        if section is not None:
+            f.seek(0x28)
+            (shoff,) = struct.unpack("<Q", f.read(8))
+            offset += shoff + section * 64
+        f.seek(offset)
+        f.write(struct.pack(fmt, value))
+
+
+def make_phdrs_elf(fn, eclass, endian, etype, phdrs, xnum=False):
+    """Write an ELF header of the given class (1 for 32-bit, 2 for 64-bit),
+       endianness ("<" or ">") and type followed by the (p_type, p_flags)
+       program headers. With xnum, the program header count is stored in the
+       first section header.
+    """
+    ehsize = 52 if eclass == 1 else 64
+    if eclass == 1:
+        phdr_fmt = endian + "IIIIIIII"
+        shdr_fmt = endian + "IIIIIIIIII"
+    else:
+        phdr_fmt = endian + "IIQQQQQQ"
+        shdr_fmt = endian + "IIQQQQIIQQ"
+    phentsize = struct.calcsize(phdr_fmt)
+    shentsize = struct.calcsize(shdr_fmt)
+
+    data = b""
+    for (typ, flags) in phdrs:
+        if eclass == 1:
+            data += struct.pack(phdr_fmt, typ, 0, 0, 0, 0, 0, flags, 0)
+        else:
+            data += struct.pack(phdr_fmt, typ, flags, 0, 0, 0, 0, 0, 0)
+
+    phnum = len(phdrs)
+    shoff = 0
+    shnum = 0
+    if xnum:
+        shoff = ehsize + len(data)
+        shnum = 1
+        data += struct.pack(shdr_fmt, 0, 0, 0, 0, 0, 0, 0, phnum, 0, 0)
+        phnum = 0xFFFF
+
+    ehdr = b"\x7fELF" + bytes([eclass, 1 if endian == "<" else 2, 1]) + b"\0" * 9
+    ehdr += struct.pack(
+        endian + ("HHIIIIIHHHHHH" if eclass == 1 else "HHIQQQIHHHHHH"),
+        etype,
+        62,
+        1,
+        0,
+        ehsize,
+        shoff,
+        0,
+        ehsize,
+        phentsize,
+        phnum,
+        shentsize,
+        shnum,
+        0,
+    )
+    with open(fn, "wb") as f:
+        f.write(ehdr + data)
+
+
+class TestElf(TestCase):
+    """Tests for the elf functions."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.fn = os.path.join(self.tmpdir, "libtest.so")
+        make_elf(self.fn)
+
+    def test_read_dynamic_symbols(self):
+        """Test read_dynamic_symbols()"""
+        res = read_dynamic_symbols(self.fn)
+        expected = [
+            ("VERS_1", "A", "@@VERS_1"),
+            ("_ZdaPv", "T", "@@VERS_1"),
+            ("bar", "D", "@VERS_0"),
+            ("baz", "V", "@@Base"),
+            ("foo", "T", "@@VERS_1"),
+            ("local", "t", ""),
+        ]
+        self.assertEqual(res, expected)
+
+    def test_read_dynamic_symbols_not_elf(self):
+        """Test read_dynamic_symbols() - not ELF"""
+        fn = os.path.join(self.tmpdir, "script.so")
+        with open(fn, "w") as f:
+            f.write("#!/bin/sh\n")
+        with self.assertRaises(ElfError):
+            read_dynamic_symbols(fn)
+
+    def test_read_dynamic_symbols_truncated(self):
+        """Test read_dynamic_symbols() - truncated"""
+        with open(self.fn, "rb") as f:
+            data = f.read()
+        with open(self.fn, "wb") as f:
+            f.write(data[:-100])
+        with self.assertRaises(ElfError):
+            read_dynamic_symbols(self.fn)
+
+    def test_read_dynamic_symbols_bad_headers(self):
+        """Test read_dynamic_symbols() - offsets and sizes out of range"""
+        # .dynsym and .gnu.version are the section headers 5 and 6
+        for (offset, fmt, value, section) in [
+            (0x18, "<Q", 1 << 63, 5),  # sh_offset
+            (0x20, "<Q", 1 << 62, 5),  # sh_size
+            (0x20, "<Q", 1 << 16, 5),
+            (0x38, "<Q", 16, 5),  # sh_entsize
+            (0x38, "<Q", 4, 6),
+            (0x3C, "<H", 0xFFFF, None),  # e_shnum
+            (0x3A, "<H", 32, None),  # e_shentsize
+            (0x28, "<Q", 1 << 63, None),  # e_shoff
+        ]:
+            with self.subTest(offset=offset, value=value, section=section):
+                make_elf(self.fn)
+                patch_elf(self.fn, offset, fmt, value, section)
+                with self.assertRaises(ElfError):
+                    read_dynamic_symbols(self.fn)
+
+        # large section counts are stored in the first section header
+        make_elf(self.fn)
+        patch_elf(self.fn, 0x3C, "<H", 0)
+        patch_elf(self.fn, 0x20, "<Q", 1 << 40, 0)
+        with self.assertRaises(ElfError):
+            read_dynamic_symbols(self.fn)
+
+    def test_has_execstack(self):
+        """Test has_execstack()"""
+        fn = os.path.join(self.tmpdir, "bin")
+        # PT_LOAD, PT_GNU_STACK
+        for eclass in [1, 2]:
+            for endian in ["<", ">"]:
+                for etype in [2, 3]:  # ET_EXEC, ET_DYN
+                    for (flags, expected) in [(0x7, True), (0x6, False)]:
+                        make_phdrs_elf(
+                            fn, eclass, endian, etype, [(1, 0x5), (0x6474E551, flags)]
+                        )
+                        self.assertEqual(has_execstack(fn), expected)
+
+        # no PT_GNU_STACK
+        make_phdrs_elf(fn, 2, "<", 3, [(1, 0x7)])
+        self.assertFalse(has_execstack(fn))
+
+        # not an executable or shared object (ET_REL)
+        make_phdrs_elf(fn, 2, "<", 1, [(0x6474E551, 0x7)])
+        self.assertFalse(has_execstack(fn))
+
+        # program header count in the first section header
+        make_phdrs_elf(fn, 1, ">", 2, [(1, 0x5), (0x6474E551, 0x7)], xnum=True)
+        self.assertTrue(has_execstack(fn))
+
+        # no program headers
+        self.assertFalse(has_execstack(self.fn))
+
+    def test_has_execstack_bad(self):
+        """Test has_execstack() - bad files"""
+        fn = os.path.join(self.tmpdir, "script")
+        with open(fn, "w") as f:
+            f.write("#!/bin/sh\n")
+        with self.assertRaises(ElfError):
+            has_execstack(fn)
+
+        make_phdrs_elf(fn, 2, "<", 2, [(1, 0x5), (0x6474E551, 0x7)])
+        with open(fn, "rb") as f:
+            data = f.read()
+        with open(fn, "wb") as f:
+            f.write(data[:-10])
+        with self.assertRaises(ElfError):
+            has_execstack(fn)
+
+        # offsets, sizes and counts out of range
+        for (offset, fmt, value) in [
+            (0x20, "<Q", 1 << 63),  # e_phoff
+            (0x36, "<H", 0xFFFF),  # e_phentsize
+            (0x36, "<H", 32),
+            (0x38, "<H", 0xFFFE),  # e_phnum
+        ]:
+            with self.subTest(offset=offset, value=value):
+                make_phdrs_elf(fn, 2, "<", 2, [(1, 0x5), (0x6474E551, 0x7)])
+                patch_elf(fn, offset, fmt, value)
+                with self.assertRaises(ElfError):
+                    has_execstack(fn)
+
+    def test_demangle(self):
+        """Test demangle()"""
+        res = demangle(["_ZdaPv", "foo", "_ZNSs4swapERSs", "_not_mangled"])
+        self.assertEqual(
+            res,
+            {
+                "_ZdaPv": "operator delete[](void*)",
+                "_ZNSs4swapERSs": "std::string::swap(std::string&)",
+            },
+        )
+
+    def test_global_symbols(self):
+        """Test global_symbols()"""
+        res = global_symbols({"./libtest.so": read_dynamic_symbols(self.fn)})
+        expected = {
+            "./libtest.so": {
+                "VERS_1": {"type": "A", "version": "@@VERS_1"},
+                "operator delete[](void*)": {"type": "T", "version": "@@VERS_1"},
+                "bar": {"type": "D", "version": "@VERS_0"},
+                "baz": {"type": "V", "version": "@@Base"},
+                "foo": {"type": "T", "version": "@@VERS_1"},
+            }
+        }
+        self.assertEqual(res, expected)
+
+    def test_symbol_cache(self):
+        """Test SymbolCache()"""
+        fn = os.path.join(self.tmpdir, "symbols.sqlite")
+        symbols = {"foo": {"type": "T", "version": "@@Base"}}
+        cache = SymbolCache(fn)
+        self.assertIsNone(cache.get("abc"))
+        cache.put("abc", symbols)
+        cache.close()
+
+        cache = SymbolCache(fn)
+        self.assertEqual(cache.get("abc"), symbols)
+        self.assertIsNone(cache.get("def"))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.close()
+
+    def test_symbol_cache_corrupt(self):
+        """Test SymbolCache() - corrupt entry"""
+        fn = os.path.join(self.tmpdir, "symbols.sqlite")
+        symbols = {"foo": {"type": "T", "version": "@@Base"}}
+        cache = SymbolCache(fn)
+        cache.put("abc", symbols)
+        cache.close()
+
+        conn = sqlite3.connect(fn)
+        with conn:
+            conn.execute("UPDATE symbols SET symbols = '{\"foo\": {'")
+        conn.close()
+
+        # a miss, which is then replaced
+        cache = SymbolCache(fn)
+        with patch("reviewtools.elf.warn") as warn:
+            self.assertIsNone(cache.get("abc"))
+        self.assertEqual(warn.call_count, 1)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        cache.put("abc", symbols)
+        cache.close()
+
+        cache = SymbolCache(fn)
+        self.assertEqual(cache.get("abc"), symbols)
+        cache.close()
+
+    def test_symbol_cache_evict(self):
+        """Test SymbolCache() - evict least recently used"""
+        fn = os.path.join(self.tmpdir, "symbols.sqlite")
+        symbols = {"foo": {"type": "T", "version": "@@Base"}}
+        size = len(json.dumps(symbols, separators=(",", ":")))
+
+        cache = SymbolCache(fn)
+        for key in ["a", "b", "c"]:
+            cache.put(key, symbols)
+        with patch("reviewtools.elf.time.time", return_value=time.time() - 10):
+            cache.close()
+
+        # 'a' is used again, so 'b' and 'c' are the least recently used
+        cache = SymbolCache(fn, max_size=size * 2)
+        cache.get("a")
+        cache.put("d", symbols)
+        cache.close()
+
+        cache = SymbolCache(fn)
+        self.assertEqual(
+            [k for k in ["a", "b", "c", "d"] if cache.get(k) is not None], ["a", "d"]
+        )
+        cache.close()
+
+    def test_symbol_cache_format(self):
+        """Test SymbolCache() - stale format"""
+        fn = os.path.join(self.tmpdir, "symbols.sqlite")
+        cache = SymbolCache(fn)
+        cache.put("abc", {})
+        cache.close()
+
+        with patch("reviewtools.elf.SYMBOL_CACHE_FORMAT", 0):
+            cache = SymbolCache(fn)
+            self.assertIsNone(cache.get("abc"))
+            cache.close()
+
+    def test_open_symbol_cache(self):
+        """Test open_symbol_cache()"""
+        with patch.dict(os.environ):
+            os.environ.pop("RT_SYMBOL_CACHE", None)
+            self.assertIsNone(open_symbol_cache())
+
+            os.environ["RT_SYMBOL_CACHE"] = os.path.join(self.tmpdir, "s.sqlite")
+            os.environ["RT_SYMBOL_CACHE_MAX_SIZE"] = "1"
+            cache = open_symbol_cache()
+            self.assertEqual(cache.max_size, 1024 * 1024)
+            cache.close()
@@ -1,6 +1,8 @@
 import glob
 import reviewtools
+from unittest.mock import patch
 from reviewtools import modules, sr_tests
+from reviewtools.sr_common import SnapReviewContext
 
 
 class TestModules(sr_tests.TestSnapReview):
@@ -35,3 +37,18 @@ class TestModules(sr_tests.TestSnapReview):
             "Not all files in reviewtools/sr_*.py contain "
             "classes named Snap*Review.",
         )
+
+    def test_find_main_class_cached(self):
+        """Verify modules are only loaded once"""
+        module_name = self.modules[0]
+        review = modules.find_main_class(module_name)
+        with patch("reviewtools.modules.imp.load_source") as m:
+            self.assertEqual(modules.find_main_class(module_name), review)
+            m.assert_not_called()
+
+    def test_init_main_class_context(self):
+        """Verify the review classes share the context"""
+        context = SnapReviewContext("app.snap")
+        for module_name in self.modules:
+            review = modules.init_main_class(module_name, "app.snap", context=context)
+            self.assertIs(review.snap_yaml, context.snap_yaml)
@@ -0,0 +1,214 @@
+"""test_squashfs.py: tests for the squashfs module"""
+#
+# Copyright (C) 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import stat
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import reviewtools.common as common
+from reviewtools.common import StatLLN
+from reviewtools.squashfs import SquashfsError, SquashfsImage, verify_resquash
+
+
+class TestSquashfs(TestCase):
+    """Tests for the squashfs functions."""
+
+    def test_check_superblock(self):
+        """Test SquashfsImage() - superblock"""
+        with SquashfsImage("./tests/busybox-static-mvo_2.snap") as img:
+            self.assertEqual(img.compression, "xz")
+            self.assertEqual(img.fragments, 0)
+            self.assertEqual(img.mkfs_time, 1500994513)
+            self.assertEqual(img.inode_count, 4)
+
+    def test_check_walk(self):
+        """Test SquashfsImage.walk()"""
+        with SquashfsImage("./tests/busybox-static-mvo_2.snap") as img:
+            res = [(path, oct(inode.mode), inode.size) for path, inode in img.walk()]
+        expected = [
+            ("", oct(stat.S_IFDIR | 0o755), 42),
+            ("/busybox", oct(stat.S_IFREG | 0o755), 1996936),
+            ("/meta", oct(stat.S_IFDIR | 0o755), 32),
+            ("/meta/snap.yaml", oct(stat.S_IFREG | 0o644), 187),
+        ]
+        self.assertEqual(res, expected)
+
+    def test_check_walk_gzip(self):
+        """Test SquashfsImage.walk() - gzip"""
+        with SquashfsImage("./tests/test-gzip_1.snap") as img:
+            self.assertEqual(img.compression, "gzip")
+            res = [path for path, inode in img.walk()]
+        self.assertEqual(
+            res, ["", "/bin", "/bin/sh", "/meta", "/meta/icon.png", "/meta/snap.yaml"],
+        )
+
+    def test_check_walk_device(self):
+        """Test SquashfsImage.walk() - device"""
+        with SquashfsImage("./tests/test-app-devnull_1.0_all.snap") as img:
+            res = [inode for path, inode in img.walk() if path == "/dev/null"]
+        self.assertEqual(len(res), 1)
+        self.assertTrue(stat.S_ISCHR(res[0].mode))
+        self.assertEqual(res[0].rdev, (1 << 8) | 3)
+
+    def test_check_walk_cycle(self):
+        """Test SquashfsImage.walk() - directory cycle"""
+        with SquashfsImage("./tests/busybox-static-mvo_2.snap") as img:
+            root = img.root_inode
+            # /meta points back at the root directory
+            entries = [
+                (name, root if name == "meta" else ref)
+                for name, ref in img.read_dir(img.read_inode(root))
+            ]
+            with patch.object(img, "read_dir", return_value=entries):
+                with self.assertRaises(SquashfsError):
+                    list(img.walk())
+
+    def test_check_walk_shared_dir(self):
+        """Test SquashfsImage.walk() - directory in two directories"""
+        with SquashfsImage("./tests/busybox-static-mvo_2.snap") as img:
+            entries = img.read_dir(img.read_inode(img.root_inode))
+            meta = dict(entries)["meta"]
+            entries = [("etc", meta)] + entries
+            with patch.object(img, "read_dir", side_effect=[entries, []]):
+                with self.assertRaises(SquashfsError):
+                    list(img.walk())
+
+    def test_check_walk_too_many_entries(self):
+        """Test SquashfsImage.walk() - too many entries"""
+        with SquashfsImage("./tests/busybox-static-mvo_2.snap") as img:
+            with patch("reviewtools.squashfs.SQUASHFS_MAX_ENTRIES", 3):
+                with self.assertRaises(SquashfsError):
+                    list(img.walk())
+            self.assertEqual(len(list(img.walk())), 4)
+
+    def test_check_not_squashfs(self):
+        """Test SquashfsImage() - not squashfs"""
+        with self.assertRaises(SquashfsError):
+            SquashfsImage("./tests/hello-world_1.0.6_all.snap")
+
+    def test_check_truncated(self):
+        """Test SquashfsImage() - truncated"""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        fn = os.path.join(tmpdir, "truncated.snap")
+        with open("./tests/busybox-static-mvo_2.snap", "rb") as f:
+            data = f.read(1024)
+        with open(fn, "wb") as f:
+            f.write(data)
+
+        with self.assertRaises(SquashfsError):
+            with SquashfsImage(fn) as img:
+                list(img.walk())
+
+    def test_check_squashfs_lln_parse(self):
+        """Test squashfs_lln_parse() matches unsquashfs_lln_parse_line()"""
+        for snap in [
+            "./tests/busybox-static-mvo_2.snap",
+            "./tests/test-all-core_1_all.snap",
+            "./tests/test-bad-desktop-file_1_all.snap",
+            "./tests/test-base-devnull_1.0_all.snap",
+        ]:
+            with SquashfsImage(snap) as img:
+                hdr, entries = common.squashfs_lln_parse(img)
+            self.assertEqual(hdr, [])
+            self.assertEqual(entries[0][1][StatLLN.FILENAME], ".")
+            self.assertEqual(entries[0][1][StatLLN.FULLNAME], "squashfs-root")
+            for (line, item) in entries:
+                self.assertEqual(item, common.unsquashfs_lln_parse_line(line))
+
+    def test_check_squashfs_lln_parse_symlink(self):
+        """Test squashfs_lln_parse() - symlink"""
+        with SquashfsImage("./tests/test-bad-desktop-file_1_all.snap") as img:
+            hdr, entries = common.squashfs_lln_parse(img)
+        symlinks = [item for (line, item) in entries if item[StatLLN.FILETYPE] == "l"]
+        self.assertEqual(len(symlinks), 1)
+        self.assertEqual(
+            symlinks[0][StatLLN.FILENAME], "./meta/gui/env.desktop -> nonexistent"
+        )
+        self.assertEqual(symlinks[0][StatLLN.MODE], "rwxrwxrwx")
+        self.assertEqual(symlinks[0][StatLLN.SIZE], str(len("nonexistent")))
+
+    def test_verify_resquash(self):
+        """Test verify_resquash()"""
+        self.assertTrue(
+            verify_resquash("./tests/busybox-static-mvo_2.snap", common.MKSQUASHFS_OPTS)
+        )
+
+    def test_verify_resquash_jobs(self):
+        """Test verify_resquash() - jobs"""
+        self.assertTrue(
+            verify_resquash(
+                "./tests/test-all-app_1_all.snap", common.MKSQUASHFS_OPTS, jobs=4
+            )
+        )
+
+    def test_verify_resquash_gzip(self):
+        """Test verify_resquash() - gzip"""
+        opts = ["gzip" if o == "xz" else o for o in common.MKSQUASHFS_OPTS]
+        self.assertTrue(verify_resquash("./tests/test-gzip_1.snap", opts))
+
+    def test_verify_resquash_not_all_root(self):
+        """Test verify_resquash() - not -all-root"""
+        opts = [o for o in common.MKSQUASHFS_OPTS if o != "-all-root"]
+        self.assertTrue(verify_resquash("./tests/test-all-core_1_all.snap", opts, True))
+
+    def test_verify_resquash_not_all_root_nor_root(self):
+        """Test verify_resquash() - not -all-root nor root"""
+        opts = [o for o in common.MKSQUASHFS_OPTS if o != "-all-root"]
+        with self.assertRaises(SquashfsError):
+            verify_resquash("./tests/test-all-core_1_all.snap", opts)
+
+    def test_verify_resquash_wrong_compression(self):
+        """Test verify_resquash() - wrong compression"""
+        with self.assertRaises(SquashfsError):
+            verify_resquash("./tests/test-gzip_1.snap", common.MKSQUASHFS_OPTS)
+
+    def test_verify_resquash_unsupported_opts(self):
+        """Test verify_resquash() - unsupported mksquashfs options"""
+        opts = common.MKSQUASHFS_OPTS + ["-processors", "1"]
+        with self.assertRaises(SquashfsError):
+            verify_resquash("./tests/busybox-static-mvo_2.snap", opts)
+
+    def test_verify_resquash_device(self):
+        """Test verify_resquash() - device"""
+        with self.assertRaises(SquashfsError):
+            verify_resquash(
+                "./tests/test-app-devnull_1.0_all.snap", common.MKSQUASHFS_OPTS
+            )
+
+    def test_verify_resquash_unlistable_dir(self):
+        """Test verify_resquash() - unlistable directory"""
+        with self.assertRaises(SquashfsError):
+            verify_resquash(
+                "./tests/test-dir-perms_0_amd64.snap", common.MKSQUASHFS_OPTS
+            )
+
+    def test_verify_resquash_data_mismatch(self):
+        """Test verify_resquash() - data block mismatch"""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        fn = os.path.join(tmpdir, "mismatch.snap")
+        with open("./tests/busybox-static-mvo_2.snap", "rb") as f:
+            data = bytearray(f.read())
+        data[50000] ^= 1
+        with open(fn, "wb") as f:
+            f.write(data)
+
+        with self.assertRaises(SquashfsError):
+            verify_resquash(fn, common.MKSQUASHFS_OPTS)
@@ -14,7 +14,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from reviewtools.sr_common import SnapReview
+from unittest.mock import patch
+
+from reviewtools.sr_common import SnapReview, SnapReviewContext
 import reviewtools.sr_tests as sr_tests
 
 
@@ -66,3 +68,30 @@ map:
             with self.assertRaises(Exception) as e:
                 self.review._verify_no_duplicated_yaml_keys(ok)
             self.assertRegex(str(e.exception), r'found duplicate key "key".*')
+
+    def test_context(self):
+        """Check SnapReviewContext is parsed once and shared"""
+        extracted = []
+
+        def _extract_snap_yaml(review):
+            extracted.append(review)
+            return sr_tests._extract_snap_yaml(review)
+
+        context = SnapReviewContext("app.snap")
+        with patch(
+            "reviewtools.sr_common.SnapReview._extract_snap_yaml", _extract_snap_yaml
+        ):
+            c1 = SnapReview("app.snap", "sr_common_review_type", context=context)
+            c2 = SnapReview("app.snap", "sr_common_review_type", context=context)
+        self.assertEqual(extracted, [c1])
+        self.assertTrue(context.loaded)
+        self.assertIs(c1.snap_yaml, c2.snap_yaml)
+        self.assertIs(c1.snap_manifest_yaml, c2.snap_manifest_yaml)
+        self.assertIs(c1.base_declaration, c2.base_declaration)
+        self.assertIs(c1.unsquashfs_lln_entries, c2.unsquashfs_lln_entries)
+        self.assertEqual(c1.snap_yaml["type"], "app")
+
+        # without a context, each class parses the package itself
+        c3 = SnapReview("app.snap", "sr_common_review_type")
+        self.assertIsNot(c1.snap_yaml, c3.snap_yaml)
+        self.assertEqual(c1.snap_yaml, c3.snap_yaml)
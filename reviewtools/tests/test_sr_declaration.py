@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from reviewtools.sr_common import SnapReview, SnapReviewContext
 from reviewtools.sr_declaration import (
     SnapReviewDeclaration,
     SnapDeclarationException,
@@ -130,6 +131,27 @@ slots:
 
         self._set_base_declaration(c, decl)
 
+    def test_shared_base_declaration(self):
+        """Test the base declaration shared with other modules is unchanged"""
+        context = SnapReviewContext("app.snap")
+        other = SnapReview("app.snap", "sr_common_review_type", context=context)
+        # snap declarations from the store express bools as strings, which
+        # _verify_declaration() normalizes
+        decl = context.base_declaration
+        decl["slots"]["audio-playback"]["deny-connection"]["on-classic"] = "false"
+
+        c = SnapReviewDeclaration("app.snap", context=context)
+        self.assertIs(other.base_declaration, decl)
+        self.assertEqual(
+            decl["slots"]["audio-playback"]["deny-connection"]["on-classic"], "false"
+        )
+        self.assertIsNot(c.base_declaration, decl)
+        self.assertFalse(
+            c.base_declaration["slots"]["audio-playback"]["deny-connection"][
+                "on-classic"
+            ]
+        )
+
     def test_all_checks_as_v2(self):
         """Test snap v2 has checks"""
         self.set_test_pkgfmt("snap", "16.04")
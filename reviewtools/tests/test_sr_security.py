@@ -16,6 +16,7 @@
 
 from __future__ import print_function
 from unittest import TestCase
+from unittest.mock import patch
 import os
 import re
 import shutil
@@ -26,6 +27,7 @@ from reviewtools.common import cleanup_unpack
 from reviewtools.common import check_results as common_check_results
 from reviewtools.common import unsquashfs_lln_parse as common_unsquashfs_lln_parse
 from reviewtools.sr_security import SnapReviewSecurity
+from reviewtools.squashfs import SquashfsError
 import reviewtools.sr_tests as sr_tests
 from reviewtools.tests import utils
 
@@ -1357,8 +1359,10 @@ exit 1
             os.environ["PATH"] = output_dir  # pragma: nocover
 
         os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
+        os.environ["SNAP_NATIVE_RESQUASHFS"] = "0"
         c.check_squashfs_resquash()
         os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
+        os.environ.pop("SNAP_NATIVE_RESQUASHFS")
         os.environ["PATH"] = old_path
         report = c.review_report
         expected_counts = {"info": None, "warn": 0, "error": 1}
@@ -1399,8 +1403,10 @@ exit 1
             os.environ["PATH"] = output_dir  # pragma: nocover
 
         os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
+        os.environ["SNAP_NATIVE_RESQUASHFS"] = "0"
         c.check_squashfs_resquash()
         os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
+        os.environ.pop("SNAP_NATIVE_RESQUASHFS")
         os.environ["PATH"] = old_path
         report = c.review_report
         expected_counts = {"info": None, "warn": 0, "error": 1}
@@ -1436,150 +1442,160 @@ exit 1
             os.environ["PATH"] = output_dir  # pragma: nocover
 
         os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
+        os.environ["SNAP_NATIVE_RESQUASHFS"] = "0"
         c.check_squashfs_resquash()
         os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
+        os.environ.pop("SNAP_NATIVE_RESQUASHFS")
         os.environ["PATH"] = old_path
         report = c.review_report
         expected_counts = {"info": None, "warn": 0, "error": 1}
         self.check_results(report, expected_counts)
 
-    def test_check_squashfs_resquash_sha512sum_fail(self):
-        """Test check_squashfs_resquash() - sha512sum failure"""
+    def test_check_squashfs_resquash_read_fail(self):
+        """Test check_squashfs_resquash() - read failure"""
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
-        content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo test error: sha512sum failure
-    exit 1
-fi
-exit 0
-"""
-        with open(sha512sum, "w") as f:
-            f.write(content)
-        os.chmod(sha512sum, 0o775)
-
-        old_path = os.environ["PATH"]
-        if old_path:
-            os.environ["PATH"] = "%s:%s" % (output_dir, os.environ["PATH"])
-        else:
-            os.environ["PATH"] = output_dir  # pragma: nocover
-
         os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
-        c.check_squashfs_resquash()
+        os.environ["SNAP_NATIVE_RESQUASHFS"] = "0"
+        with patch(
+            "reviewtools.sr_security.files_identical",
+            side_effect=OSError(2, "No such file or directory", package),
+        ):
+            c.check_squashfs_resquash()
         os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
-        os.environ["PATH"] = old_path
+        os.environ.pop("SNAP_NATIVE_RESQUASHFS")
         report = c.review_report
         expected_counts = {"info": None, "warn": 0, "error": 1}
         self.check_results(report, expected_counts)
 
-    def test_check_squashfs_resquash_sha512sum_fail_repacked(self):
-        """Test check_squashfs_resquash() - sha512sum failure (repacked)"""
+    def test_check_squashfs_resquash_read_fail_repacked(self):
+        """Test check_squashfs_resquash() - read failure (repacked)"""
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
-        content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" != "test_1.0_all.snap" ]; then
-    echo test error: sha512sum failure
-    exit 1
-fi
-echo deadbeef $1
-exit 0
-"""
-        with open(sha512sum, "w") as f:
-            f.write(content)
-        os.chmod(sha512sum, 0o775)
-
-        old_path = os.environ["PATH"]
-        if old_path:
-            os.environ["PATH"] = "%s:%s" % (output_dir, os.environ["PATH"])
-        else:
-            os.environ["PATH"] = output_dir  # pragma: nocover
-
         os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
-        c.check_squashfs_resquash()
+        os.environ["SNAP_NATIVE_RESQUASHFS"] = "0"
+        with patch(
+            "reviewtools.sr_security.files_identical",
+            side_effect=OSError(2, "No such file or directory", "repack.snap"),
+        ):
+            c.check_squashfs_resquash()
         os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
-        os.environ["PATH"] = old_path
+        os.environ.pop("SNAP_NATIVE_RESQUASHFS")
         report = c.review_report
         expected_counts = {"info": None, "warn": 0, "error": 1}
         self.check_results(report, expected_counts)
 
-    def test_check_squashfs_resquash_sha512sum_mismatch(self):
-        """Test check_squashfs_resquash() - sha512sum mismatch (no enforce)"""
+    def test_check_squashfs_resquash_mismatch(self):
+        """Test check_squashfs_resquash() - image mismatch (no enforce)"""
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
-        content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo beefeeee $1
-else
-    echo deadbeef $1
-fi
-exit 0
-"""
-        with open(sha512sum, "w") as f:
-            f.write(content)
-        os.chmod(sha512sum, 0o775)
-
-        old_path = os.environ["PATH"]
-        if old_path:
-            os.environ["PATH"] = "%s:%s" % (output_dir, os.environ["PATH"])
-        else:
-            os.environ["PATH"] = output_dir  # pragma: nocover
-
         os.environ["SNAP_ENFORCE_RESQUASHFS"] = "0"
-        c.check_squashfs_resquash()
+        os.environ["SNAP_NATIVE_RESQUASHFS"] = "0"
+        with patch("reviewtools.sr_security.files_identical", return_value=False):
+            c.check_squashfs_resquash()
         os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
-        os.environ["PATH"] = old_path
+        os.environ.pop("SNAP_NATIVE_RESQUASHFS")
         report = c.review_report
         expected_counts = {"info": 1, "warn": 0, "error": 0}
         self.check_results(report, expected_counts)
 
-    def test_check_squashfs_resquash_sha512sum_mismatch_enforce(self):
-        """Test check_squashfs_resquash() - sha512sum mismatch - enforce"""
+    def test_check_squashfs_resquash_cached(self):
+        """Test check_squashfs_resquash() - cached verdict"""
+        output_dir = self.mkdtemp()
+        package = utils.make_snap2(output_dir=output_dir)
+
+        with patch.dict(os.environ):
+            os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
+            os.environ["SNAP_NATIVE_RESQUASHFS"] = "0"
+            os.environ["RT_RESQUASH_CACHE"] = os.path.join(output_dir, "r.sqlite")
+            for expected_text in ["OK", "OK (cached verdict)"]:
+                c = SnapReviewSecurity(package)
+                with patch(
+                    "reviewtools.sr_security.SnapReviewSecurity._resquash_identical",
+                    return_value=(True, None, None),
+                ) as m:
+                    c.check_squashfs_resquash()
+                self.assertEqual(m.call_count, 0 if "cached" in expected_text else 1)
+
+                expected = dict()
+                expected["error"] = dict()
+                expected["warn"] = dict()
+                expected["info"] = dict()
+                name = "security-snap-v2:squashfs_repack_checksum"
+                expected["info"][name] = {"text": expected_text}
+                self.check_results(c.review_report, expected=expected)
+
+    def test_check_squashfs_resquash_native(self):
+        """Test check_squashfs_resquash() - verified in-process"""
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
-        content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo beefeeee $1
-else
-    echo deadbeef $1
-fi
-exit 0
-"""
-        with open(sha512sum, "w") as f:
-            f.write(content)
-        os.chmod(sha512sum, 0o775)
+        os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
+        with patch(
+            "reviewtools.sr_security.verify_resquash", return_value=True
+        ) as verify, patch(
+            "reviewtools.sr_security.SnapReviewSecurity._resquash_identical"
+        ) as resquash:
+            c.check_squashfs_resquash()
+        os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual(resquash.call_count, 0)
 
-        old_path = os.environ["PATH"]
-        if old_path:
-            os.environ["PATH"] = "%s:%s" % (output_dir, os.environ["PATH"])
-        else:
-            os.environ["PATH"] = output_dir  # pragma: nocover
+        expected = dict()
+        expected["error"] = dict()
+        expected["warn"] = dict()
+        expected["info"] = dict()
+        name = "security-snap-v2:squashfs_repack_checksum"
+        expected["info"][name] = {"text": "OK"}
+        self.check_results(c.review_report, expected=expected)
+
+    def test_check_squashfs_resquash_native_fallback(self):
+        """Test check_squashfs_resquash() - in-process verification fallback"""
+        output_dir = self.mkdtemp()
+        package = utils.make_snap2(output_dir=output_dir)
+        c = SnapReviewSecurity(package)
 
         os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
+        with patch(
+            "reviewtools.sr_security.verify_resquash",
+            side_effect=SquashfsError("unsupported file type"),
+        ), patch(
+            "reviewtools.sr_security.SnapReviewSecurity._resquash_identical",
+            return_value=(True, None, None),
+        ) as resquash:
+            c.check_squashfs_resquash()
+        os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
+        self.assertEqual(resquash.call_count, 1)
+
+        expected = dict()
+        expected["error"] = dict()
+        expected["warn"] = dict()
+        expected["info"] = dict()
+        name = "security-snap-v2:squashfs_repack_checksum"
+        expected["info"][name] = {"text": "OK"}
+        self.check_results(c.review_report, expected=expected)
+
+    def test_check_squashfs_resquash_mismatch_enforce(self):
+        """Test check_squashfs_resquash() - image mismatch - enforce"""
+        output_dir = self.mkdtemp()
+        package = utils.make_snap2(output_dir=output_dir)
+        c = SnapReviewSecurity(package)
+
+        os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
+        os.environ["SNAP_NATIVE_RESQUASHFS"] = "0"
         os.environ["SNAP_DEBUG_RESQUASHFS"] = "1"
-        c.check_squashfs_resquash()
+        with patch("reviewtools.sr_security.files_identical", return_value=False):
+            c.check_squashfs_resquash()
         os.environ.pop("SNAP_DEBUG_RESQUASHFS")
         os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
-        os.environ["PATH"] = old_path
+        os.environ.pop("SNAP_NATIVE_RESQUASHFS")
         report = c.review_report
         expected_counts = {"info": 0, "warn": 0, "error": 1}
         self.check_results(report, expected_counts)
@@ -1594,47 +1610,28 @@ exit 0
         }
         self.check_results(report, expected=expected)
 
-    def test_check_squashfs_resquash_sha512sum_mismatch_override(self):
-        """Test check_squashfs_resquash() - sha512sum mismatch - overridden"""
+    def test_check_squashfs_resquash_mismatch_override(self):
+        """Test check_squashfs_resquash() - image mismatch - overridden"""
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
-        content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo beefeeee $1
-else
-    echo deadbeef $1
-fi
-exit 0
-"""
-        with open(sha512sum, "w") as f:
-            f.write(content)
-        os.chmod(sha512sum, 0o775)
-
-        old_path = os.environ["PATH"]
-        if old_path:
-            os.environ["PATH"] = "%s:%s" % (output_dir, os.environ["PATH"])
-        else:
-            os.environ["PATH"] = output_dir  # pragma: nocover
-
         os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
+        os.environ["SNAP_NATIVE_RESQUASHFS"] = "0"
         os.environ["SNAP_DEBUG_RESQUASHFS"] = "1"
 
         # add this snap to the override
         from reviewtools.overrides import sec_resquashfs_overrides
 
         sec_resquashfs_overrides.append("test")
-        c.check_squashfs_resquash()
+        with patch("reviewtools.sr_security.files_identical", return_value=False):
+            c.check_squashfs_resquash()
         # then clean up
         sec_resquashfs_overrides.remove("test")
 
         os.environ.pop("SNAP_DEBUG_RESQUASHFS")
         os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
-        os.environ["PATH"] = old_path
+        os.environ.pop("SNAP_NATIVE_RESQUASHFS")
         report = c.review_report
         expected_counts = {"info": 1, "warn": 0, "error": 0}
         self.check_results(report, expected_counts)
@@ -1649,8 +1646,8 @@ exit 0
         }
         self.check_results(report, expected=expected)
 
-    def test_check_squashfs_resquash_sha512sum_mismatch_enforce_os(self):
-        """Test check_squashfs_resquash() - sha512sum mismatch - enforce os"""
+    def test_check_squashfs_resquash_mismatch_enforce_os(self):
+        """Test check_squashfs_resquash() - image mismatch - enforce os"""
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         sy_path = os.path.join(output_dir, "snap.yaml")
@@ -1671,31 +1668,12 @@ type: os
 
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
-        content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo beefeeee $1
-else
-    echo deadbeef $1
-fi
-exit 0
-"""
-        with open(sha512sum, "w") as f:
-            f.write(content)
-        os.chmod(sha512sum, 0o775)
-
-        old_path = os.environ["PATH"]
-        if old_path:
-            os.environ["PATH"] = "%s:%s" % (output_dir, os.environ["PATH"])
-        else:
-            os.environ["PATH"] = output_dir  # pragma: nocover
-
         os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
-        c.check_squashfs_resquash()
+        os.environ["SNAP_NATIVE_RESQUASHFS"] = "0"
+        with patch("reviewtools.sr_security.files_identical", return_value=False):
+            c.check_squashfs_resquash()
         os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
-        os.environ["PATH"] = old_path
+        os.environ.pop("SNAP_NATIVE_RESQUASHFS")
         report = c.review_report
         expected_counts = {"info": 1, "warn": 0, "error": 0}
         self.check_results(report, expected_counts)
@@ -1710,8 +1688,8 @@ exit 0
         }
         self.check_results(report, expected=expected)
 
-    def test_check_squashfs_resquash_sha512sum_mismatch_enforce_app_override(self):
-        """Test check_squashfs_resquash() - sha512sum mismatch - enforce app
+    def test_check_squashfs_resquash_mismatch_enforce_app_override(self):
+        """Test check_squashfs_resquash() - image mismatch - enforce app
            with override.
         """
         output_dir = self.mkdtemp()
@@ -1733,31 +1711,12 @@ architectures: [ amd64 ]
 
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
-        content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo beefeeee $1
-else
-    echo deadbeef $1
-fi
-exit 0
-"""
-        with open(sha512sum, "w") as f:
-            f.write(content)
-        os.chmod(sha512sum, 0o775)
-
-        old_path = os.environ["PATH"]
-        if old_path:
-            os.environ["PATH"] = "%s:%s" % (output_dir, os.environ["PATH"])
-        else:
-            os.environ["PATH"] = output_dir  # pragma: nocover
-
         os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
-        c.check_squashfs_resquash()
+        os.environ["SNAP_NATIVE_RESQUASHFS"] = "0"
+        with patch("reviewtools.sr_security.files_identical", return_value=False):
+            c.check_squashfs_resquash()
         os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
-        os.environ["PATH"] = old_path
+        os.environ.pop("SNAP_NATIVE_RESQUASHFS")
         report = c.review_report
         expected_counts = {"info": 1, "warn": 0, "error": 0}
         self.check_results(report, expected_counts)
@@ -1772,8 +1731,8 @@ exit 0
         }
         self.check_results(report, expected=expected)
 
-    def test_check_squashfs_resquash_sha512sum_mismatch_enforce_app_override_list(self):
-        """Test check_squashfs_resquash() - sha512sum mismatch - enforce app
+    def test_check_squashfs_resquash_mismatch_enforce_app_override_list(self):
+        """Test check_squashfs_resquash() - image mismatch - enforce app
            with override (list).
         """
         # update the overrides
@@ -1800,33 +1759,14 @@ architectures: [ amd64 ]
 
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
-        content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo beefeeee $1
-else
-    echo deadbeef $1
-fi
-exit 0
-"""
-        with open(sha512sum, "w") as f:
-            f.write(content)
-        os.chmod(sha512sum, 0o775)
-
-        old_path = os.environ["PATH"]
-        if old_path:
-            os.environ["PATH"] = "%s:%s" % (output_dir, os.environ["PATH"])
-        else:
-            os.environ["PATH"] = output_dir  # pragma: nocover
-
         os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
-        c.check_squashfs_resquash()
+        os.environ["SNAP_NATIVE_RESQUASHFS"] = "0"
+        with patch("reviewtools.sr_security.files_identical", return_value=False):
+            c.check_squashfs_resquash()
         # clean up
         del sec_mode_overrides["foo"]
         os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
-        os.environ["PATH"] = old_path
+        os.environ.pop("SNAP_NATIVE_RESQUASHFS")
         report = c.review_report
         expected_counts = {"info": 1, "warn": 0, "error": 0}
         self.check_results(report, expected_counts)
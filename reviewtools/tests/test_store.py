@@ -337,6 +337,58 @@ class TestStore(TestCase):
                 self.assertEqual(len(errors), 0)
                 self.assertEqual(len(pkg_db["revisions"]), 0)
 
+    def test_check_get_package_revisions_memo(self):
+        """Test get_package_revisions() - memo"""
+        item = copy.deepcopy(self.store_db[0])
+        for rev in item["revisions"]:
+            rev["manifest_yaml"] = item["revisions"][self.first_revision][
+                "manifest_yaml"
+            ]
+
+        errors = {}
+        expected = store.get_pkg_revisions(item, self.secnot_db, errors)
+        memo = store.SecnotReportMemo()
+        res = store.get_pkg_revisions(item, self.secnot_db, errors, memo=memo)
+        self.assertEqual(len(errors), 0)
+        self.assertEqual(res, expected)
+        self.assertEqual(memo.lookups, len(item["revisions"]))
+        self.assertEqual(memo.hits, len(item["revisions"]) - 1)
+
+    def test_check_get_package_revisions_memo_bad_manifest(self):
+        """Test get_package_revisions() - memo - bad manifest"""
+        item = copy.deepcopy(self.store_db[0])
+        for rev in item["revisions"]:
+            rev["manifest_yaml"] = "{"
+
+        errors = {}
+        memo = store.SecnotReportMemo()
+        store.get_pkg_revisions(item, self.secnot_db, errors, memo=memo)
+        self.assertEqual(memo.hits, len(item["revisions"]) - 1)
+        self.assertEqual(len(errors["0ad"]), len(item["revisions"]))
+        for (rev, error) in zip(item["revisions"], errors["0ad"]):
+            self.assertTrue(
+                error.startswith(
+                    "error loading manifest for revision '%s':" % rev["revision"]
+                )
+            )
+
+    def test_check_secnot_report_memo(self):
+        """Test SecnotReportMemo"""
+        memo = store.SecnotReportMemo(max_entries=2)
+        keys = [memo.key(m, "snap") for m in ["a", "b", "c"]]
+        self.assertEqual(len(set(keys)), 3)
+        self.assertNotEqual(memo.key("a", "rock"), keys[0])
+
+        memo.put(keys[0], "a")
+        memo.put(keys[1], "b")
+        self.assertEqual(memo.get(keys[0]), "a")
+        # the least recently used entry is dropped
+        memo.put(keys[2], "c")
+        self.assertIsNone(memo.get(keys[1]))
+        self.assertEqual(memo.get(keys[0]), "a")
+        self.assertEqual(memo.get(keys[2]), "c")
+        self.assertEqual((memo.hits, memo.lookups), (3, 4))
+
     def test_check_get_package_revisions_empty_uploader(self):
         """Test get_package_revisions() - empty uploader"""
         store_dbs = {
@@ -2494,3 +2546,19 @@ class TestStore(TestCase):
                         ),
                         0,
                     )
+
+    def test_check_get_secnots_for_manifest_sorted_usns(self):
+        """Test get_secnots_for_manifest() - sorted_usns matches full scan"""
+        # a plain dict has no sorted_usns so each secnot is compared
+        unindexed_db = dict(self.secnot_db)
+        self.assertIsInstance(self.secnot_db, usn.USNDatabase)
+        for with_cves in [False, True]:
+            for rev in self.store_db[0]["revisions"]:
+                m = yaml.load(rev["manifest_yaml"], Loader=yaml.SafeLoader)
+                expected = store.get_secnots_for_manifest(
+                    m, unindexed_db, with_cves=with_cves
+                )
+                res = store.get_secnots_for_manifest(
+                    m, self.secnot_db, with_cves=with_cves
+                )
+                self.assertEqual(expected, res)
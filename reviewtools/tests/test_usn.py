@@ -19,10 +19,13 @@ from unittest.mock import patch, MagicMock
 
 import reviewtools.usn as usn
 import reviewtools.common as common
+import reviewtools.debversion as debversion
 
 import json
 import os
 import pprint
+import shutil
+import tempfile
 
 
 class TestUSN(TestCase):
@@ -778,3 +781,109 @@ class TestUSN(TestCase):
         self.maxDiff = None
         self.assertEqual(len(expected_db), len(res))
         self.assertEqual(len(expected_db["xenial"]), len(res["xenial"]))
+
+    def _mkdtemp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(common.recursive_rm, tmpdir)
+        return tmpdir
+
+    def test_check_read_usn_db_cache(self):
+        """Test read_usn_db() - cache_dir"""
+        cache_dir = os.path.join(self._mkdtemp(), "cache")
+        expected = usn.read_usn_db("./tests/test-usn-unittest-1.db")
+
+        res = usn.read_usn_db("./tests/test-usn-unittest-1.db", cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        self.assertEqual(pprint.pformat(expected), pprint.pformat(res))
+
+        # the compiled db is reused without reading the USN db
+        with patch("reviewtools.usn._read_usn_db") as m:
+            res = usn.read_usn_db("./tests/test-usn-unittest-1.db", cache_dir=cache_dir)
+            m.assert_not_called()
+        self.assertEqual(pprint.pformat(expected), pprint.pformat(res))
+
+    def test_check_read_usn_db_cache_non_lts(self):
+        """Test read_usn_db() - cache_dir with support_non_lts"""
+        cache_dir = self._mkdtemp()
+        usn.read_usn_db("./tests/test-usn-unittest-1.db", cache_dir=cache_dir)
+        with patch("reviewtools.usn._read_usn_db", wraps=usn._read_usn_db) as m:
+            usn.read_usn_db(
+                "./tests/test-usn-unittest-1.db",
+                support_non_lts=True,
+                cache_dir=cache_dir,
+            )
+            m.assert_called_once()
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_check_read_usn_db_cache_updated(self):
+        """Test read_usn_db() - cache_dir with updated USN db"""
+        tmpdir = self._mkdtemp()
+        cache_dir = os.path.join(tmpdir, "cache")
+        usn_fn = os.path.join(tmpdir, "database.json")
+
+        shutil.copy("./tests/test-usn-unittest-1.db", usn_fn)
+        res = usn.read_usn_db(usn_fn, cache_dir=cache_dir)
+        self.assertTrue("libtiff-doc" in res["xenial"])
+        old = os.listdir(cache_dir)
+
+        shutil.copy("./tests/test-usn-1.db", usn_fn)
+        res = usn.read_usn_db(usn_fn, cache_dir=cache_dir)
+        self.assertEqual(
+            pprint.pformat(usn.read_usn_db("./tests/test-usn-1.db")),
+            pprint.pformat(res),
+        )
+
+        # the stale cache is removed
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        self.assertNotEqual(old, os.listdir(cache_dir))
+
+    def test_check_read_usn_db_cache_corrupt(self):
+        """Test read_usn_db() - cache_dir with corrupt cache"""
+        cache_dir = self._mkdtemp()
+        usn.read_usn_db("./tests/test-usn-unittest-1.db", cache_dir=cache_dir)
+        cache_fn = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        with open(cache_fn, "wb") as fd:
+            fd.write(b"corrupt")
+
+        res = usn.read_usn_db("./tests/test-usn-unittest-1.db", cache_dir=cache_dir)
+        self.assertTrue("libtiff-doc" in res["xenial"])
+        with open(cache_fn, "rb") as fd:
+            self.assertNotEqual(fd.read(), b"corrupt")
+
+    def test_check_read_usn_db_sorted_usns(self):
+        """Test read_usn_db() - sorted_usns"""
+        res = usn.read_usn_db("./tests/test-usn-unittest-1.db")
+        self.assertEqual(sorted(res.keys()), sorted(res.sorted_usns.keys()))
+        for rel in res:
+            self.assertEqual(sorted(res[rel].keys()), sorted(res.sorted_usns[rel]))
+            for bin in res[rel]:
+                sorted_usns = res.sorted_usns[rel][bin]
+                self.assertEqual(
+                    sorted(res[rel][bin].keys()), sorted([u for (_, u) in sorted_usns])
+                )
+                for i in range(1, len(sorted_usns)):
+                    self.assertTrue(
+                        debversion.compare(sorted_usns[i - 1][0], sorted_usns[i][0])
+                        <= 0
+                    )
+        self.assertEqual(
+            [u for (_, u) in res.sorted_usns["xenial"]["libtiff5"]],
+            ["3602-1", "3606-1"],
+        )
+
+    def test_check_get_usns_newer_than(self):
+        """Test get_usns_newer_than()"""
+        res = usn.read_usn_db("./tests/test-usn-unittest-1.db")
+        sorted_usns = res.sorted_usns["xenial"]["libtiff5"]
+        for v, expected in [
+            ("4.0.6-1", ["3602-1", "3606-1"]),
+            ("4.0.6-1ubuntu0.3", ["3606-1"]),
+            ("4.0.6-1ubuntu0.3+1", ["3606-1"]),
+            ("4.0.6-1ubuntu0.4", []),
+            ("1:1.0", []),
+        ]:
+            self.assertEqual(
+                usn.get_usns_newer_than(sorted_usns, debversion.DebVersion(v)),
+                expected,
+            )
+        self.assertEqual(usn.get_usns_newer_than([], debversion.DebVersion("1")), [])
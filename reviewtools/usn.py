@@ -12,11 +12,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import os
+import pickle
 import re
+import tempfile
 from pkg_resources import resource_filename
 
 import reviewtools.common as common
+from reviewtools.common import debug, warn
 import reviewtools.debversion as debversion
 
 tracked_releases = ["xenial", "bionic", "focal"]
@@ -25,12 +29,164 @@ tracked_releases = ["xenial", "bionic", "focal"]
 non_lts_tracked_releases = ["hirsute", "impish"]
 epoch_pat = re.compile(r"^[0-9]+:")
 
+# Bump this whenever the layout of the usn_db (or of the objects it contains,
+# eg DebVersion) changes so stale caches are not loaded
+USN_DB_CACHE_FORMAT = 3
+
+
+class USNDatabase(dict):
+    """The usn_db along with a per-binary index of its USNs sorted by
+    version:
+      sorted_usns[release][binary] = [(<DebVersion>, <usn>), ...]
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sorted_usns = {}
+
+    def index(self):
+        """(Re)build sorted_usns from the usn_db"""
+        self.sorted_usns = {}
+        for rel in self:
+            self.sorted_usns[rel] = {}
+            for bin in self[rel]:
+                self.sorted_usns[rel][bin] = sorted(
+                    [(self[rel][bin][usn]["version"], usn) for usn in self[rel][bin]],
+                    key=lambda item: item[0],
+                )
+
+
+def get_usns_newer_than(sorted_usns, version):
+    """Return the USNs from sorted_usns (as indexed by USNDatabase) that have a
+    version greater than 'version'"""
+    lo = 0
+    hi = len(sorted_usns)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if version < sorted_usns[mid][0]:
+            hi = mid
+        else:
+            lo = mid + 1
+    return [usn for (_, usn) in sorted_usns[lo:]]
+
+
+def _get_unmatched_vers_fn():
+    """Find the ubuntu-unmatched-bin-versions.json file"""
+    unmatched_vers_fn = "./reviewtools/data/ubuntu-unmatched-bin-versions.json"
+    if not os.path.exists(unmatched_vers_fn):  # pragma: nocover
+        unmatched_vers_fn = resource_filename(
+            __name__, "data/ubuntu-unmatched-bin-versions.json"
+        )
+        if not os.path.exists(unmatched_vers_fn):
+            unmatched_vers_fn = None
+    return unmatched_vers_fn
+
+
+def _get_usn_db_cache_flavor(support_non_lts):
+    return "with-non-lts" if support_non_lts else "lts-only"
+
+
+def _get_usn_db_cache_fn(cache_dir, fn, support_non_lts):
+    """Get the name of the compiled usn_db cache for fn. The name is derived
+    from the sha256 of the USN db and of the unmatched binary versions (the
+    inputs to read_usn_db()) so any change to them results in a new cache
+    entry.
+    """
+    h = hashlib.sha256()
+    for i in [fn, _get_unmatched_vers_fn()]:
+        if i is None:  # pragma: nocover
+            continue
+        with open(i, "rb") as fd:
+            for chunk in iter(lambda: fd.read(1024 * 1024), b""):
+                h.update(chunk)
+
+    return os.path.join(
+        cache_dir,
+        "usn-db-%d-%s-%s.pickle"
+        % (
+            USN_DB_CACHE_FORMAT,
+            h.hexdigest(),
+            _get_usn_db_cache_flavor(support_non_lts),
+        ),
+    )
+
+
+def _read_usn_db_cache(cache_fn):
+    """Read the compiled usn_db from cache_fn. Returns None if it can't be
+    used"""
+    if not os.path.exists(cache_fn):
+        return None
+
+    debug("Loading: %s" % cache_fn)
+    try:
+        with open(cache_fn, "rb") as fd:
+            usn_db = pickle.load(fd)
+    except Exception as e:
+        warn("Could not load '%s': %s" % (cache_fn, e))
+        return None
+
+    if not isinstance(usn_db, USNDatabase):
+        warn("Could not load '%s': not a USNDatabase" % cache_fn)
+        return None
+
+    return usn_db
+
+
+def _write_usn_db_cache(cache_fn, usn_db, support_non_lts):
+    """Atomically write the compiled usn_db to cache_fn and remove any stale
+    caches"""
+    cache_dir = os.path.dirname(cache_fn)
+    try:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, 0o0700)
+
+        (fd, tmp) = tempfile.mkstemp(prefix=common.MKDTEMP_PREFIX, dir=cache_dir)
+        with os.fdopen(fd, "wb") as fh:
+            pickle.dump(usn_db, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, cache_fn)
+    except Exception as e:
+        warn("Could not write '%s': %s" % (cache_fn, e))
+        return
+
+    # each USN db update creates a new cache entry, so only keep the current
+    # one for each flavor
+    suffix = "-%s.pickle" % _get_usn_db_cache_flavor(support_non_lts)
+    for f in os.listdir(cache_dir):
+        stale = os.path.join(cache_dir, f)
+        if f.startswith("usn-db-") and f.endswith(suffix) and stale != cache_fn:
+            debug("Removing stale '%s'" % stale)
+            try:
+                os.unlink(stale)
+            except OSError:  # pragma: nocover
+                pass
+
 
 # For fast checks:
 # usn_db[release][binary][usn][version]
-def read_usn_db(fn, support_non_lts=False):
+#
+# The returned USNDatabase also has usn_db.sorted_usns[release][binary] for
+# finding the USNs affecting a particular binary version via bisection (see
+# get_usns_newer_than()).
+#
+# When cache_dir is specified, the compiled usn_db is stored there and reused
+# by subsequent calls for as long as the USN db (and the unmatched binary
+# versions) are unchanged.
+def read_usn_db(fn, support_non_lts=False, cache_dir=None):
+    if cache_dir is None:
+        return _read_usn_db(fn, support_non_lts)
+
+    cache_fn = _get_usn_db_cache_fn(cache_dir, fn, support_non_lts)
+    usn_db = _read_usn_db_cache(cache_fn)
+    if usn_db is None:
+        usn_db = _read_usn_db(fn, support_non_lts)
+        _write_usn_db_cache(cache_fn, usn_db, support_non_lts)
+
+    return usn_db
+
+
+def _read_usn_db(fn, support_non_lts=False):
     def get_best_version(unmatched_vers, rel, bin, rawv):
-        version = debversion.DebVersion(rawv)
+        version = debversion.parse(rawv)
 
         if rel in unmatched_vers and bin in unmatched_vers[rel]:
             # If there is an epoch in the source_version, strip it and see if
@@ -40,7 +196,7 @@ def read_usn_db(fn, support_non_lts=False):
             binv = unmatched_vers[rel][bin]["version"]
             if epoch_pat.search(srcv) and binv == srcv.split(":", 1)[1]:
                 if ":" in rawv:
-                    version = debversion.DebVersion(rawv.split(":", 1)[1])
+                    version = debversion.parse(rawv.split(":", 1)[1])
             # Else if there is an epoch in the binary version from overrides,
             # but not the source_version, add the binary's epoch to the
             # source_version add see if they match. If so, add the epoch from
@@ -53,7 +209,7 @@ def read_usn_db(fn, support_non_lts=False):
                 and not epoch_pat.search(srcv)
                 and binv == "%s:%s" % (binv.split(":", 1)[0], srcv)
             ):
-                version = debversion.DebVersion("%s:%s" % (binv.split(":", 1)[0], rawv))
+                version = debversion.parse("%s:%s" % (binv.split(":", 1)[0], rawv))
             else:
                 # Don't pretend we know the version if we can't accurately
                 # guess
@@ -61,13 +217,7 @@ def read_usn_db(fn, support_non_lts=False):
 
         return version
 
-    unmatched_vers_fn = "./reviewtools/data/ubuntu-unmatched-bin-versions.json"
-    if not os.path.exists(unmatched_vers_fn):  # pragma: nocover
-        unmatched_vers_fn = resource_filename(
-            __name__, "data/ubuntu-unmatched-bin-versions.json"
-        )
-        if not os.path.exists(unmatched_vers_fn):
-            unmatched_vers_fn = None
+    unmatched_vers_fn = _get_unmatched_vers_fn()
 
     unmatched_vers = {}
     # read in our unmatched binary versions if we have them
@@ -76,7 +226,7 @@ def read_usn_db(fn, support_non_lts=False):
 
     raw = common.read_file_as_json_dict(fn)
 
-    usn_db = {}
+    usn_db = USNDatabase()
     for usn in raw:
         if "releases" not in raw[usn]:
             continue
@@ -189,4 +339,6 @@ def read_usn_db(fn, support_non_lts=False):
                             usn_db[rel][bin][usn]["cves"] = raw[usn]["cves"]
                             usn_db[rel][bin][usn]["cves"].sort()
 
+    usn_db.index()
+
     return usn_db
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+"""bench-debversion-compare.py: time of comparing Debian versions
+
+Usage: PYTHONPATH=. ./tests/bench-debversion-compare.py [USN_DB...]
+
+Collects the version strings of the given USN databases (default: the test
+USN databases; for the real one, use the database.json fetched with
+'review-tools.fetch-usn-db database.json.bz2') and reports the time taken to
+parse them, to sort them and to compare random pairs of them with the
+DebVersion sort keys, compared to walking the strings for each comparison
+like compare() used to.
+"""
+#
+# Copyright (C) 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from functools import cmp_to_key
+import glob
+import json
+import random
+import sys
+import time
+
+from reviewtools.debversion import DebVersion, _verrevcomp, compare, parse
+
+
+def compare_strings(a, b):
+    """compare() as it was before DebVersion had sort keys"""
+    if a.epoch > b.epoch:
+        return 1
+    elif a.epoch < b.epoch:
+        return -1
+    rc = _verrevcomp(a.version, b.version)
+    if rc != 0:
+        return rc
+    return _verrevcomp(a.revision, b.revision)
+
+
+def collect_versions(obj, versions):
+    if isinstance(obj, dict):
+        for (k, v) in obj.items():
+            if k == "version" and isinstance(v, str):
+                versions.append(v)
+            else:
+                collect_versions(v, versions)
+    elif isinstance(obj, list):
+        for v in obj:
+            collect_versions(v, versions)
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    res = f(*args)
+    return res, time.perf_counter() - start
+
+
+def main():
+    fns = sys.argv[1:]
+    if not fns:
+        fns = sorted(glob.glob("./tests/test-usn*.db"))
+    raw = []
+    for fn in fns:
+        with open(fn) as f:
+            collect_versions(json.load(f), raw)
+
+    def _parse_all(f):
+        parsed = []
+        for v in raw:
+            try:
+                parsed.append(f(v))
+            except ValueError:
+                pass
+        return parsed
+
+    (versions, t_init) = timed(_parse_all, DebVersion)
+    (_, t_parse) = timed(_parse_all, parse)
+    (_, t_parse_cached) = timed(_parse_all, parse)
+
+    (old_sorted, t_old_sort) = timed(
+        lambda: sorted(versions, key=cmp_to_key(compare_strings))
+    )
+    (new_sorted, t_new_sort) = timed(sorted, versions)
+    for (a, b) in zip(old_sorted, new_sorted):
+        assert compare_strings(a, b) == 0
+
+    random.seed(0)
+    count = max(len(versions) * 10, 100000)
+    pairs = [(random.choice(versions), random.choice(versions)) for i in range(count)]
+
+    def _compare_all(f):
+        return [f(a, b) for (a, b) in pairs]
+
+    (_, t_old_cmp) = timed(_compare_all, compare_strings)
+    (_, t_new_cmp) = timed(_compare_all, compare)
+    (_, t_lt) = timed(_compare_all, lambda a, b: a < b)
+
+    print("versions:            %d (%d unique)" % (len(versions), len(set(raw))))
+    print("DebVersion():        %.3fs" % t_init)
+    print("parse():             %.3fs (%.3fs when cached)" % (t_parse, t_parse_cached))
+    print("sort (strings):      %.3fs" % t_old_sort)
+    print("sort (keys):         %.3fs" % t_new_sort)
+    print("%d comparisons:" % count)
+    print("  compare (strings): %.3fs" % t_old_cmp)
+    print("  compare (keys):    %.3fs" % t_new_cmp)
+    print("  a < b:             %.3fs" % t_lt)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+"""bench-unsquashfs-lln-parse.py: time and memory of parsing 'unsquashfs -lln'
+
+Usage: PYTHONPATH=. ./tests/bench-unsquashfs-lln-parse.py [ENTRIES]
+
+Parses a synthetic listing (default 100000 entries, the size of a large base
+snap) with unsquashfs_lln_parse() and reports the parse time, the memory
+retained by the entries and the process RSS. For comparison, it also reports
+the memory of the same entries as the StatLLN-keyed dicts that were used
+previously.
+"""
+#
+# Copyright (C) 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import resource
+import sys
+import time
+import tracemalloc
+
+from reviewtools.common import unsquashfs_lln_parse
+
+
+def make_listing(count):
+    lines = [
+        "Parallel unsquashfs: Using 4 processors",
+        "%d inodes (%d blocks) to write" % (count, count),
+        "",
+        "drwxr-xr-x 0/0               215 2020-03-23 14:32 squashfs-root",
+    ]
+    for i in range(1, count):
+        d = i // 100
+        if i % 100 == 0:
+            lines.append(
+                "drwxr-xr-x 0/0               %d 2020-03-23 14:23 "
+                "squashfs-root/usr/lib/dir%d" % (i, d)
+            )
+        elif i % 50 == 0:
+            lines.append(
+                "lrwxrwxrwx 0/0                12 2020-03-14 18:21 "
+                "squashfs-root/usr/lib/dir%d/lib%d.so -> lib%d.so.1" % (d, i, i)
+            )
+        elif i % 999 == 0:
+            lines.append(
+                "crw-rw-rw- 0/0             1,  3 2020-03-14 18:21 "
+                "squashfs-root/dev/null%d" % i
+            )
+        else:
+            lines.append(
+                "-rw-r--r-- 0/0             %d 2020-03-23 14:24 "
+                "squashfs-root/usr/lib/dir%d/file%d" % (i * 7, d, i)
+            )
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    count = 100000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    lln = make_listing(count)
+
+    start = time.perf_counter()
+    hdr, entries = unsquashfs_lln_parse(lln)
+    elapsed = time.perf_counter() - start
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    del entries
+
+    # parse again while tracing, as tracing slows the parse down
+    tracemalloc.start()
+    hdr, entries = unsquashfs_lln_parse(lln)
+    retained = tracemalloc.get_traced_memory()[0]
+    as_dicts = [dict(item) for (line, item) in entries]
+    dicts = tracemalloc.get_traced_memory()[0] - retained
+    tracemalloc.stop()
+    del as_dicts
+
+    # the raw lines are retained in both cases
+    lines = sum(sys.getsizeof(line) for (line, item) in entries)
+
+    print("entries:           %d" % len(entries))
+    print("parse time:        %.2fs" % elapsed)
+    print("entries memory:    %.1fM" % ((retained - lines) / 1024 / 1024))
+    print("(as dicts:         %.1fM)" % (dicts / 1024 / 1024))
+    print("max RSS (parse):   %.1fM" % (maxrss / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+"""bench-yaml-load.py: throughput of parsing the snap.yamls of a store dump
+
+Usage: PYTHONPATH=. ./tests/bench-yaml-load.py [--repeat N] [DUMP...]
+
+Splits the given store dumps (default: the test store dumps; see dump-tool
+for the format) into their snap.yamls and reports how long parsing all of
+them takes with the pure-python yaml.SafeLoader, with yaml_safe_load() (which
+uses libyaml's CSafeLoader when PyYAML was built with it) and with
+yaml_safe_load() checking for duplicated keys like SnapReview does.
+"""
+#
+# Copyright (C) 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import glob
+import re
+import time
+import yaml
+
+from reviewtools.common import YAML_SAFE_LOADER, yaml_safe_load
+
+
+def read_dump(fn):
+    """Return the non-empty snap.yamls of the store dump fn"""
+    with open(fn) as fh:
+        dump = fh.read()
+    docs = re.split(r"^[a-zA-Z0-9]{32}\|[0-9]+\|", dump, flags=re.M)
+    return [y for y in docs if y.strip() != ""]
+
+
+def timed(f, docs, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        res = [f(y) for y in docs]
+    return res, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="time parsing the snap.yamls of a store dump"
+    )
+    parser.add_argument("--repeat", type=int, default=0, help="parse the dump N times")
+    parser.add_argument("dump", nargs="*", help="store dump")
+    args = parser.parse_args()
+
+    fns = args.dump
+    if not fns:
+        fns = sorted(glob.glob("./tests/test-store-dump.[0-9]"))
+    docs = []
+    for fn in fns:
+        docs += read_dump(fn)
+    size = sum(len(y.encode("utf-8")) for y in docs)
+    repeat = args.repeat
+    if repeat <= 0:
+        # small dumps are parsed (at least) 1000 times in all
+        repeat = max(1, 1000 // len(docs))
+
+    (expected, t_py) = timed(
+        lambda y: yaml.load(y, Loader=yaml.SafeLoader), docs, repeat
+    )
+    (res, t_load) = timed(yaml_safe_load, docs, repeat)
+    assert res == expected
+    (res, t_strict) = timed(
+        lambda y: yaml_safe_load(y, allow_duplicate_keys=False), docs, repeat
+    )
+    assert res == expected
+
+    total = len(docs) * repeat
+    mb = size * repeat / 1024 / 1024
+    print(
+        "snap.yamls:       %d (%d bytes), parsed %d times" % (len(docs), size, repeat)
+    )
+    print("loader:           %s" % YAML_SAFE_LOADER.__name__)
+    for (name, t) in [
+        ("yaml.SafeLoader", t_py),
+        ("yaml_safe_load", t_load),
+        ("  no duplicates", t_strict),
+    ]:
+        print(
+            "%-17s %.3fs (%.0f yamls/s, %.2f MB/s, %.1fx)"
+            % (name + ":", t, total / t, mb / t, t_py / t)
+        )
+
+
+if __name__ == "__main__":
+    main()